@@ -0,0 +1,105 @@
+"""
+Compares the heap based NavMesh.find_path_a_star against the original list based A*
+Checks that both return the same paths and prints the time per query
+
+python -m benchmarks.bench_astar
+"""
+
+import time
+
+from benchmarks.synthetic_village import SyntheticVillage, setup_benchmark
+from villagers.navmesh import Node
+
+
+def legacy_find_path_a_star(navmesh, start_pnt, end_pnt):
+    """
+    The original A* with a linear min() over the open list, kept here as the baseline
+    """
+    graph = navmesh.graph
+    start = navmesh.nodes_quadtree.nearest_neighbors(start_pnt, number_of_neighbors=1)[0].item
+    end = navmesh.nodes_quadtree.nearest_neighbors(end_pnt, number_of_neighbors=1)[0].item
+
+    open_list = [start]
+    closed_list = []
+    came_from = {start: None}
+    g_score = {node: float('inf') for node in graph.nodes()}
+    g_score[start] = 0
+    h_score = {node: ((graph.xs[node] - graph.xs[end]) ** 2 + (graph.ys[node] - graph.ys[end]) ** 2) ** 0.5 for node in graph.nodes()}
+
+    while open_list:
+        current = min(open_list, key=lambda node: g_score[node] + h_score[node])
+        if current == end:
+            path = []
+            while current is not None:
+                path.append(Node(graph.xs[current], graph.ys[current]))
+                current = came_from[current]
+            path = path[::-1]
+            path.append(Node(end_pnt[0], end_pnt[1]))
+            path.insert(0, Node(start_pnt[0], start_pnt[1]))
+            return path
+
+        open_list.remove(current)
+        closed_list.append(current)
+
+        for neighbor, cost in graph.neighbors(current):
+            if neighbor in closed_list:
+                continue
+            tentative_g_score = g_score[current] + cost
+            if neighbor not in open_list:
+                open_list.append(neighbor)
+            elif tentative_g_score >= g_score[neighbor]:
+                continue
+            came_from[neighbor] = current
+            g_score[neighbor] = tentative_g_score
+
+    return None
+
+
+def heap_find_path_a_star(navmesh, start_pnt, end_pnt):
+    """
+    NavMesh.find_path_a_star without the path cache, flow fields or hierarchy, just the heap based search
+    """
+    graph = navmesh.graph
+    start = navmesh.nodes_quadtree.nearest_neighbors(start_pnt, number_of_neighbors=1)[0].item
+    end = navmesh.nodes_quadtree.nearest_neighbors(end_pnt, number_of_neighbors=1)[0].item
+    node_path = navmesh.search_path(start, end)
+    if node_path is None:
+        return None
+    path = [Node(graph.xs[node], graph.ys[node]) for node in node_path]
+    path.insert(0, Node(start_pnt[0], start_pnt[1]))
+    path.append(Node(end_pnt[0], end_pnt[1]))
+    return path
+
+
+def path_points(path):
+    if path is None:
+        return None
+    return [(node.x, node.y) for node in path]
+
+
+def time_queries(find_path, navmesh, queries):
+    start_time = time.perf_counter()
+    paths = [find_path(navmesh, start, end) for start, end in queries]
+    return time.perf_counter() - start_time, paths
+
+
+def run(num_buildings, num_queries=200):
+    village = SyntheticVillage(num_buildings)
+    village.navmesh.generate_navmesh()
+    queries = [(village.random_point(margin=5), village.random_point(margin=5)) for _ in range(num_queries)]
+
+    legacy_time, legacy_paths = time_queries(legacy_find_path_a_star, village.navmesh, queries)
+    heap_time, heap_paths = time_queries(heap_find_path_a_star, village.navmesh, queries)
+
+    mismatches = sum(path_points(a) != path_points(b) for a, b in zip(legacy_paths, heap_paths))
+    print(f"{num_buildings:5d} buildings, {len(village.navmesh.graph):5d} nodes: "
+          f"legacy {legacy_time / num_queries * 1000:8.3f} ms/query, "
+          f"heap {heap_time / num_queries * 1000:8.3f} ms/query, "
+          f"speedup {legacy_time / heap_time:6.1f}x, "
+          f"mismatched paths {mismatches}")
+
+
+if __name__ == "__main__":
+    setup_benchmark()
+    for num_buildings in [10, 100, 300]:
+        run(num_buildings)
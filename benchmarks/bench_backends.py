@@ -0,0 +1,64 @@
+"""
+Compares the two pathfinding backends, A* on the visibility graph and jump point search on the building grid,
+across village densities
+Prints how long each takes to build and to answer a query, and how long the jump point search paths are in comparison
+
+python -m benchmarks.bench_backends
+"""
+
+import time
+
+from benchmarks.synthetic_village import SyntheticVillage, setup_benchmark
+from villagers.jump_point_search import JumpPointSearch
+
+
+def path_length(path):
+    return sum(((a.x - b.x) ** 2 + (a.y - b.y) ** 2) ** 0.5 for a, b in zip(path, path[1:]))
+
+
+def run(num_buildings, num_queries=100):
+    village = SyntheticVillage(num_buildings)
+    navmesh = village.navmesh
+
+    start_time = time.perf_counter()
+    navmesh.generate_navmesh()
+    navmesh_build_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    jump_point_search = JumpPointSearch(navmesh.obstacle_grid)
+    grid_build_time = time.perf_counter() - start_time
+
+    # Points inside buildings are snapped differently by the two backends, so leave them out
+    def random_free_point():
+        while True:
+            x, y = village.random_point(margin=5)
+            if not navmesh.obstacle_grid.query_rect(x, x, y, y):
+                return x, y
+
+    queries = [(random_free_point(), random_free_point()) for _ in range(num_queries)]
+
+    start_time = time.perf_counter()
+    navmesh_paths = [navmesh.find_path_a_star(start, end, use_cache=False) for start, end in queries]
+    navmesh_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    grid_paths = [jump_point_search.find_path(start, end) for start, end in queries]
+    grid_time = time.perf_counter() - start_time
+
+    mismatches = sum((a is None) != (b is None) for a, b in zip(navmesh_paths, grid_paths))
+    ratios = [path_length(b) / path_length(a) for a, b in zip(navmesh_paths, grid_paths)
+              if a is not None and b is not None and path_length(a) > 0]
+
+    print(f"{num_buildings:5d} buildings, {len(navmesh.graph):5d} nodes, "
+          f"{jump_point_search.width}x{jump_point_search.height} cells: "
+          f"build navmesh {navmesh_build_time * 1000:7.1f} ms, grid {grid_build_time * 1000:6.1f} ms, "
+          f"navmesh {navmesh_time / num_queries * 1000:7.3f} ms/query, "
+          f"jps {grid_time / num_queries * 1000:7.3f} ms/query, "
+          f"jps path length {sum(ratios) / max(len(ratios), 1):.3f}x, "
+          f"reachability mismatches {mismatches}")
+
+
+if __name__ == "__main__":
+    setup_benchmark()
+    for num_buildings in [10, 100, 400, 1000]:
+        run(num_buildings)
@@ -0,0 +1,72 @@
+"""
+Compares hierarchical pathfinding against the flat A* (compiled if numba is installed) on villages big enough to use it
+Prints the time per long trip, how much longer the hierarchical paths are, and how long catching up after one building changed takes
+
+python -m benchmarks.bench_hierarchy
+"""
+
+import time
+
+from benchmarks.synthetic_village import SyntheticVillage, setup_benchmark
+from buildings.building import Building
+
+
+def path_cost(graph, path):
+    return sum(((graph.xs[a] - graph.xs[b]) ** 2 + (graph.ys[a] - graph.ys[b]) ** 2) ** 0.5 for a, b in zip(path, path[1:]))
+
+
+def run(num_buildings, num_queries=200):
+    village = SyntheticVillage(num_buildings)
+    navmesh = village.navmesh
+    navmesh.generate_navmesh()
+    graph = navmesh.graph
+
+    start_time = time.perf_counter()
+    clusters = navmesh.get_hierarchy()
+    build_time = time.perf_counter() - start_time
+
+    # Only the long trips go through the hierarchy
+    queries = []
+    while len(queries) < num_queries:
+        start = navmesh.nodes_quadtree.nearest_neighbors(village.random_point(margin=5), number_of_neighbors=1)[0].item
+        end = navmesh.nodes_quadtree.nearest_neighbors(village.random_point(margin=5), number_of_neighbors=1)[0].item
+        if clusters.is_long_trip(start, end):
+            queries.append((start, end))
+
+    start_time = time.perf_counter()
+    flat_paths = [navmesh.search_path(start, end) for start, end in queries]
+    flat_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    # NavMesh.find_node_path leaves the hierarchy out when the kernels are on, so call it directly
+    hierarchy_paths = [clusters.find_path(start, end) or navmesh.search_path(start, end) for start, end in queries]
+    hierarchy_time = time.perf_counter() - start_time
+
+    fallbacks = sum(clusters.find_path(start, end) is None for start, end in queries)
+    unreachable_mismatches = sum((a is None) != (b is None) for a, b in zip(flat_paths, hierarchy_paths))
+    ratios = [path_cost(graph, b) / path_cost(graph, a) for a, b in zip(flat_paths, hierarchy_paths)
+              if a is not None and b is not None and len(a) > 1]
+
+    # Put one more building in the middle of the village and catch the hierarchy up
+    building = village.buildings[len(village.buildings) // 2]
+    navmesh.remove_obstacle(building)
+    start_time = time.perf_counter()
+    navmesh.get_hierarchy()
+    update_time = time.perf_counter() - start_time
+    navmesh.add_obstacle(Building(village, building.x_cell, building.y_cell, building.name))
+
+    print(f"{num_buildings:5d} buildings, {len(graph):5d} nodes, {len(clusters.members):4d} clusters: "
+          f"build {build_time * 1000:8.1f} ms, update {update_time * 1000:6.1f} ms, "
+          f"flat {flat_time / num_queries * 1000:7.3f} ms/query, "
+          f"hierarchical {hierarchy_time / num_queries * 1000:7.3f} ms/query, "
+          f"speedup {flat_time / hierarchy_time:5.1f}x, "
+          f"mean cost ratio {sum(ratios) / max(len(ratios), 1):.3f}, "
+          f"max {max(ratios, default=1):.3f}, "
+          f"fell back to A* {fallbacks}, "
+          f"reachability mismatches {unreachable_mismatches}")
+
+
+if __name__ == "__main__":
+    setup_benchmark()
+    for num_buildings in [1000, 2000, 4000]:
+        run(num_buildings)
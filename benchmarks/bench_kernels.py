@@ -0,0 +1,86 @@
+"""
+Checks that the numba kernels in villagers/kernels.py give exactly the same results as the numpy and pure Python
+code they replace: the same line of sight answers, nearest neighbors and A* paths, and with numba installed the
+same generated graphs. Prints how long each takes
+Without numba the kernels run as plain Python, so only a sample of each village is checked and the times mean nothing
+
+python -m benchmarks.bench_kernels
+"""
+
+import time
+
+import numpy as np
+
+from benchmarks.synthetic_village import SyntheticVillage, setup_benchmark
+from config import defines
+from villagers import kernels
+from villagers import visibility
+from villagers.graph_search import search_graph
+from villagers.navmesh import NEAREST_NEIGHBORS
+
+
+def timed(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+
+def generate(num_buildings, use_numba):
+    defines.use_numba = use_numba
+    village = SyntheticVillage(num_buildings)
+    village.navmesh.generate_navmesh()
+    return village
+
+
+def run(num_buildings, sample_size):
+    village = generate(num_buildings, False)
+    navmesh = village.navmesh
+    graph = navmesh.graph
+    rng = np.random.default_rng(0)
+    nodes = np.array(graph.nodes())
+    points = np.column_stack((np.take(graph.xs, nodes), np.take(graph.ys, nodes)))
+    results = []
+
+    # Line of sight between random pairs of nodes
+    pairs = rng.choice(nodes, size=(sample_size, 2))
+    segments = np.column_stack((np.take(graph.xs, pairs[:, 0]), np.take(graph.ys, pairs[:, 0]),
+                                np.take(graph.xs, pairs[:, 1]), np.take(graph.ys, pairs[:, 1])))
+    rects = navmesh.get_obstacle_rects()
+    expected, numpy_time = timed(visibility.segments_blocked, segments, rects)
+    actual, kernel_time = timed(kernels.segments_blocked, segments, rects)
+    results.append(f"segments_blocked {numpy_time * 1000:7.2f} / {kernel_time * 1000:7.2f} ms, "
+                   f"{int(np.sum(expected != actual))} mismatches")
+
+    # Nearest neighbors of a sample of the nodes
+    queries = points[rng.choice(len(points), size=min(sample_size, len(points)), replace=False)]
+    (expected_indices, expected_distances), numpy_time = timed(visibility.nearest_neighbors, points, queries,
+                                                               NEAREST_NEIGHBORS)
+    (indices, distances), kernel_time = timed(kernels.nearest_neighbors, points, queries, NEAREST_NEIGHBORS)
+    mismatches = int(np.sum(np.any((indices != expected_indices) | (distances != expected_distances), axis=1)))
+    results.append(f"nearest_neighbors {numpy_time * 1000:7.2f} / {kernel_time * 1000:7.2f} ms, {mismatches} mismatches")
+
+    # A* between random nodes
+    trips = rng.choice(nodes, size=(sample_size // 10, 2)).tolist()
+    expected, python_time = timed(lambda: [search_graph(graph, *trip) for trip in trips])
+    actual, kernel_time = timed(lambda: [kernels.search_graph(graph, *trip) for trip in trips])
+    results.append(f"A* {python_time / len(trips) * 1000:6.3f} / {kernel_time / len(trips) * 1000:6.3f} ms/path, "
+                   f"{sum(a != b for a, b in zip(expected, actual))} mismatches")
+
+    if kernels.numba is not None:
+        # The whole graph built with the kernels
+        other = generate(num_buildings, True).navmesh.graph
+        same = all(bytes(getattr(graph, name)) == bytes(getattr(other, name)) for name in ("xs", "ys", "offsets", "targets", "costs"))
+        results.append(f"graph {'identical' if same else 'DIFFERENT'}")
+
+    print(f"{num_buildings:5d} buildings, {len(graph):5d} nodes (reference / kernel): " + ", ".join(results))
+
+
+if __name__ == "__main__":
+    setup_benchmark()
+    use_numba = defines.use_numba
+    if kernels.numba is None:
+        print("numba isn't installed, checking the kernels as plain Python")
+    sample_size = 2000 if kernels.numba is not None else 300
+    for num_buildings in [10, 100, 1000]:
+        run(num_buildings, sample_size)
+    defines.use_numba = use_numba
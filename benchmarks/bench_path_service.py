@@ -0,0 +1,58 @@
+"""
+Compares finding a burst of villager paths in the game loop against the path service's worker processes
+Checks that the workers return the same paths and prints the time per path, from the first request until every future
+is answered (the pool is started beforehand, so its startup isn't counted)
+
+python -m benchmarks.bench_path_service
+"""
+
+import time
+
+from benchmarks.synthetic_village import SyntheticVillage, setup_benchmark
+from villagers.path_service import PathService
+
+
+def same_path(a, b):
+    if a is None or b is None:
+        return a is b
+    return len(a) == len(b) and all(abs(p.x - q.x) < 1e-6 and abs(p.y - q.y) < 1e-6 for p, q in zip(a, b))
+
+
+def find_all(service, queries):
+    """
+    Requests every path at once like the villagers do at the start of a turn, then updates until they're all answered
+    """
+    service.navmesh.path_cache.entries.clear()
+    start_time = time.perf_counter()
+    futures = [service.request(start, end) for start, end in queries]
+    while not all(future.done() for future in futures):
+        service.update()
+        time.sleep(0.0005)
+    return [future.result()[0] for future in futures], time.perf_counter() - start_time
+
+
+def run(num_buildings, workers_options=(2, 4), num_queries=300):
+    village = SyntheticVillage(num_buildings)
+    navmesh = village.navmesh
+    navmesh.generate_navmesh()
+    queries = [(village.random_point(margin=5), village.random_point(margin=5)) for _ in range(num_queries)]
+
+    # The first pass fills the snap table and hierarchy, which both ways share
+    find_all(PathService(navmesh), queries)
+    paths, local_time = find_all(PathService(navmesh), queries)
+    results = [f"in the game loop {local_time / num_queries * 1000:6.3f} ms/path"]
+    for workers in workers_options:
+        service = PathService(navmesh, workers)
+        find_all(service, queries[:workers * 8])  # Starts the pool
+        pool_paths, pool_time = find_all(service, queries)
+        service.close()
+        mismatches = sum(not same_path(a, b) for a, b in zip(paths, pool_paths))
+        results.append(f"{workers} workers {pool_time / num_queries * 1000:6.3f} ms/path ({mismatches} mismatches)")
+
+    print(f"{num_buildings:5d} buildings, {len(navmesh.graph):5d} nodes: " + ", ".join(results))
+
+
+if __name__ == "__main__":
+    setup_benchmark()
+    for num_buildings in [10, 100, 1000]:
+        run(num_buildings)
@@ -0,0 +1,152 @@
+"""
+Times the navmesh on synthetic villages of 10, 100 and 1000 buildings, each packed tight and with a wall half as big again
+For every village it records node and edge counts, how long generating, incremental updates, can_see and
+batches of path queries take, and the peak memory of generating and querying
+
+Results are written as JSON so runs on different commits can be compared:
+
+python -m benchmarks.bench_suite                          (writes benchmarks/results/<commit>.json)
+python -m benchmarks.bench_suite --compare old.json       (and prints how each number changed)
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from benchmarks.synthetic_village import SyntheticVillage, setup_benchmark
+from buildings.building import Building
+from villagers import kernels
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+
+# Number of buildings, and how much wider and taller than the packed village the wall is
+VILLAGES = [(10, 1), (10, 1.5), (100, 1), (100, 1.5), (1000, 1), (1000, 1.5)]
+
+NUM_UPDATES = 5
+NUM_SIGHT_LINES = 2000
+NUM_QUERIES = 200
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def timed(function, repeat=1):
+    """
+    Returns the result of the last call and the mean time per call in ms
+    """
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result, (time.perf_counter() - start_time) / repeat * 1000
+
+
+def peak_memory(function):
+    """
+    Peak memory allocated by Python while running function, in MB
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def make_village(num_buildings, wall_scale):
+    packed_width = SyntheticVillage(num_buildings).wall.width
+    return SyntheticVillage(num_buildings, wall_width=int(packed_width * wall_scale))
+
+
+def run(num_buildings, wall_scale):
+    village = make_village(num_buildings, wall_scale)
+    navmesh = village.navmesh
+    result = {"buildings": num_buildings, "wall_width": village.wall.width, "wall_height": village.wall.height}
+
+    _, result["generate_ms"] = timed(navmesh.generate_navmesh)
+    result["generate_peak_mb"] = peak_memory(navmesh.generate_navmesh)
+    result["nodes"] = len(navmesh.graph)
+    result["edges"] = len(navmesh.graph.targets) // 2
+
+    # Take buildings out of the middle of the village and put them back one at a time
+    remove_ms = add_ms = 0
+    for building in village.rng.sample(village.buildings, min(NUM_UPDATES, len(village.buildings))):
+        _, elapsed = timed(lambda: navmesh.remove_obstacle(building))
+        remove_ms += elapsed
+        _, elapsed = timed(lambda: navmesh.add_obstacle(Building(village, building.x_cell, building.y_cell, building.name)))
+        add_ms += elapsed
+    updates = min(NUM_UPDATES, len(village.buildings))
+    result["remove_building_ms"] = remove_ms / updates
+    result["add_building_ms"] = add_ms / updates
+
+    sight_lines = [(village.random_point(margin=5), village.random_point(margin=5)) for _ in range(NUM_SIGHT_LINES)]
+    _, elapsed = timed(lambda: [navmesh.can_see(a, b) for a, b in sight_lines])
+    result["can_see_us"] = elapsed / NUM_SIGHT_LINES * 1000
+
+    queries = [(village.random_point(margin=5), village.random_point(margin=5)) for _ in range(NUM_QUERIES)]
+    paths, elapsed = timed(lambda: [navmesh.find_path_a_star(start, end, use_cache=False) for start, end in queries])
+    result["a_star_ms"] = elapsed / NUM_QUERIES
+    result["unreachable"] = sum(path is None for path in paths)
+    # Through the path cache, flow fields and smoothing like the villagers, the second pass is all cache hits
+    _, elapsed = timed(lambda: [navmesh.find_path(start, end) for start, end in queries])
+    result["find_path_ms"] = elapsed / NUM_QUERIES
+    _, elapsed = timed(lambda: [navmesh.find_path(start, end) for start, end in queries])
+    result["find_path_cached_ms"] = elapsed / NUM_QUERIES
+    navmesh.path_cache.entries.clear()
+    result["find_path_peak_mb"] = peak_memory(lambda: [navmesh.find_path(start, end) for start, end in queries])
+
+    print(f"{num_buildings:5d} buildings, wall {village.wall.width:3d}x{village.wall.height:3d}, "
+          f"{result['nodes']:5d} nodes, {result['edges']:6d} edges: "
+          f"generate {result['generate_ms']:8.1f} ms ({result['generate_peak_mb']:5.1f} MB), "
+          f"remove/add {result['remove_building_ms']:6.1f}/{result['add_building_ms']:6.1f} ms, "
+          f"can_see {result['can_see_us']:6.1f} us, a* {result['a_star_ms']:6.2f} ms, "
+          f"find_path {result['find_path_ms']:6.2f} ms ({result['find_path_cached_ms']:5.2f} ms cached)")
+    return result
+
+
+def compare(results, old_results):
+    """
+    Prints the ratio of every number to the same number in an older run
+    """
+    old_cases = {(case["buildings"], case["wall_width"]): case for case in old_results["cases"]}
+    print(f"compared to {old_results['commit']}:")
+    for case in results["cases"]:
+        old_case = old_cases.get((case["buildings"], case["wall_width"]))
+        if old_case is None:
+            continue
+        changes = [f"{key} {value / old_case[key]:.2f}x" for key, value in case.items()
+                   if key.endswith(("_ms", "_us", "_mb")) and old_case.get(key)]
+        print(f"{case['buildings']:5d} buildings, wall {case['wall_width']:3d}: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="where to write the results, benchmarks/results/<commit>.json by default")
+    parser.add_argument("--compare", help="results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    commit = get_commit()
+    results = {"commit": commit, "python": platform.python_version(), "numba": kernels.enabled(),
+               "cases": [run(num_buildings, wall_scale) for num_buildings, wall_scale in VILLAGES]}
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"wrote {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    setup_benchmark()
+    main()
@@ -0,0 +1,199 @@
+"""
+Compares updating every villager on its own (Villager.update) against moving them all at once with the VillagerSystem
+Checks that a lone villager follows exactly the same track both ways, then prints the time per frame for villages
+with a villager in every building, with every villager updated each frame and with the ones off screen left behind
+Also checks that skipping ahead a turn at a time with Villager.advance and VillagerSystem.advance ends up where
+updating every frame does, as do villagers left off screen and then scrolled to, and prints how long the turn change
+catch-up takes both ways
+
+python -m benchmarks.bench_villagers
+"""
+
+import random
+import time
+
+from benchmarks.synthetic_village import SyntheticVillage, setup_benchmark
+from config import defines
+from villagers.villager_system import OFF_SCREEN_TICKS, SIMULATION_MARGIN, VillagerSystem
+
+
+def make_village(num_buildings):
+    village = SyntheticVillage(num_buildings)
+    village.navmesh.generate_navmesh()
+    return village
+
+
+def track(villager, step, frames):
+    positions = []
+    for _ in range(frames):
+        step()
+        villager.village.path_service.update()
+        positions.append((villager.x, villager.y, villager.facing, villager.current_action))
+    return positions
+
+
+def check_track(frames=3000):
+    defines.villager_lod = False
+    random.seed(0)
+    village = make_village(10)
+    villager = village.buildings[0].my_villager
+    expected = track(villager, villager.update, frames)
+
+    random.seed(0)
+    village = make_village(10)
+    villager = village.buildings[0].my_villager
+    village.villager_system.add(villager)
+    actual = track(villager, village.villager_system.update, frames)
+
+    mismatches = sum(a != b for a, b in zip(expected, actual))
+    print(f"lone villager over {frames} frames: {mismatches} frames differ")
+
+
+def get_state(villager):
+    return (villager.current_action, villager.current_time, villager.blurt_tick, villager.blurt_message, villager.facing,
+            villager.destination, len(villager.path), villager.lost)
+
+
+def check_advance(num_buildings, turns=10, ticks=200):
+    """
+    Every villager is run on its own with the random numbers seeded for it, so all the ways draw the same ones.
+    For VillagerSystem.advance each villager gets a system of its own
+    """
+    villages = []
+    for _ in range(3):
+        random.seed(0)
+        villages.append(make_village(num_buildings))
+    mismatches = [0, 0]
+    max_error = [0, 0]
+    for i, buildings in enumerate(zip(*(village.buildings for village in villages))):
+        ticked, advanced, in_system = (building.my_villager for building in buildings)
+        system = VillagerSystem(villages[2])
+        system.add(in_system)
+        for turn in range(turns):
+            random.seed(i * turns + turn)
+            for _ in range(ticks):
+                ticked.update()
+            random.seed(i * turns + turn)
+            advanced.advance(ticks)
+            random.seed(i * turns + turn)
+            system.advance(ticks)
+            for j, villager in enumerate((advanced, in_system)):
+                mismatches[j] += get_state(ticked) != get_state(villager) or ticked.frame_tick != villager.frame_tick
+                max_error[j] = max(max_error[j], abs(ticked.x - villager.x), abs(ticked.y - villager.y))
+    for j, name in enumerate(("Villager.advance", "VillagerSystem.advance")):
+        print(f"{name}({ticks}) against {ticks} updates, {num_buildings} villagers over {turns} turns: "
+              f"{mismatches[j]} differ, positions at most {max_error[j]:.2g} px apart")
+
+
+def check_lod(num_buildings, frames=600):
+    """
+    Villagers left off screen for a while and then scrolled to end up where updating them every frame does.
+    Each one has a system of its own and the random numbers seeded for it, like check_advance
+    """
+    defines.villager_lod = True
+    random.seed(0)
+    tick_village = make_village(num_buildings)
+    random.seed(0)
+    lod_village = make_village(num_buildings)
+    mismatches = 0
+    max_error = 0
+    for i, (ticked, off_screen) in enumerate(zip(tick_village.buildings, lod_village.buildings)):
+        ticked, off_screen = ticked.my_villager, off_screen.my_villager
+        system = VillagerSystem(lod_village)
+        system.add(off_screen)
+
+        random.seed(i)
+        for _ in range(frames + 1):
+            ticked.update()
+        random.seed(i)
+        defines.camera_x = defines.camera_y = -10 ** 6
+        for _ in range(frames):
+            system.update()
+        # Scroll to it, the last frame catches it up
+        defines.camera_x = off_screen.x - defines.DISPLAY_WIDTH / 2
+        defines.camera_y = off_screen.y - defines.DISPLAY_HEIGHT / 2
+        system.update()
+        defines.camera_x = defines.camera_y = 0
+
+        mismatches += get_state(ticked) != get_state(off_screen) or ticked.frame_tick != off_screen.frame_tick
+        max_error = max(max_error, abs(ticked.x - off_screen.x), abs(ticked.y - off_screen.y))
+    print(f"{num_buildings} villagers off screen for {frames} frames then scrolled to: "
+          f"{mismatches} differ, positions at most {max_error:.2g} px apart")
+
+
+def run_turn_change(num_buildings, ticks=200):
+    timings = []
+    for catch_up in ("update", "advance"):
+        random.seed(0)
+        village = make_village(num_buildings)
+        system = village.villager_system
+        for building in village.buildings:
+            system.add(building.my_villager)
+        for _ in range(30):
+            system.update()  # Everyone has set off
+
+        start_time = time.perf_counter()
+        if catch_up == "update":
+            for _ in range(ticks):
+                system.update()
+        else:
+            system.advance(ticks)
+        timings.append(time.perf_counter() - start_time)
+    print(f"{num_buildings:5d} villagers, turn change catch-up: {ticks} updates {timings[0] * 1000:8.1f} ms, "
+          f"advance {timings[1] * 1000:7.1f} ms, speedup {timings[0] / timings[1]:5.1f}x")
+
+
+def timed_frames(update, frames, warm_up):
+    # All the villagers set off on the first frame, the paths they find then aren't what's being timed
+    for _ in range(warm_up):
+        update()
+    start_time = time.perf_counter()
+    for _ in range(frames):
+        update()
+    return time.perf_counter() - start_time
+
+
+def run(num_buildings, frames=300, warm_up=30):
+    random.seed(0)
+    village = make_village(num_buildings)
+    villagers = [building.my_villager for building in village.buildings]
+
+    def update_each():
+        for villager in villagers:
+            villager.update()
+        village.path_service.update()
+
+    each_time = timed_frames(update_each, frames, warm_up)
+
+    system_times = []
+    for villager_lod in (False, True):
+        defines.villager_lod = villager_lod
+        random.seed(0)
+        village = make_village(num_buildings)
+        for building in village.buildings:
+            village.villager_system.add(building.my_villager)
+
+        def update_system():
+            village.villager_system.update()
+            village.path_service.update()
+
+        system_times.append(timed_frames(update_system, frames, warm_up))
+
+    system = village.villager_system
+    on_screen = int(system.get_on_screen(len(system), SIMULATION_MARGIN).sum())
+    print(f"{num_buildings:5d} villagers ({on_screen} near the screen): "
+          f"one by one {each_time / frames * 1000:7.2f} ms/frame, "
+          f"villager system {system_times[0] / frames * 1000:7.2f} ms/frame, "
+          f"off screen ones every {OFF_SCREEN_TICKS} frames {system_times[1] / frames * 1000:7.2f} ms/frame, "
+          f"speedup {each_time / system_times[0]:5.1f}x/{each_time / system_times[1]:5.1f}x")
+
+
+if __name__ == "__main__":
+    setup_benchmark()
+    check_track()
+    for num_buildings in [10, 100, 1000, 3000]:
+        run(num_buildings)
+    check_advance(100)
+    check_lod(100)
+    for num_buildings in [100, 1000]:
+        run_turn_change(num_buildings)
@@ -0,0 +1,105 @@
+"""
+Builds villages for benchmarking the navmesh without opening the game window
+Run the benchmarks from the repository root, e.g. python -m benchmarks.bench_astar
+"""
+
+import os
+
+# Must be set before pygame is first imported (config.defines calls pygame.init())
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import random
+
+from config import defines
+from buildings.building import Building
+from buildings.building_info import BldInfo
+from village.wall import Wall
+from villagers import kernels
+from villagers.dirt_path import DirtPath
+from villagers.navmesh import NavMesh
+from villagers.path_service import PathService
+from villagers.villager_system import VillagerSystem
+
+
+def setup_benchmark():
+    """
+    Called by each benchmark before it runs, the tests set up the same through tests/conftest.py instead
+    """
+    # The benchmarks time generating the navmesh, so never load it from disk (or fill the cache with test villages)
+    defines.use_navmesh_cache = False
+    # The benchmarks time the kernels, not compiling them
+    kernels.warm_up()
+
+
+class SyntheticBuilderManager:
+    def __init__(self):
+        self.construction_queue = []
+
+
+class SyntheticWorld:
+    def get_random_mature_tree(self):
+        return None  # Lumberjacks walk around their own building instead
+
+
+class SyntheticVillage:
+    """
+    Just enough of a village for the navmesh to be generated and queried.
+    Buildings are packed in rows inside the wall, leaving a one cell path between them like the building panel requires.
+    """
+    def __init__(self, num_buildings, wall_width=None, seed=0):
+        self.rng = random.Random(seed)
+        self.turn = 0
+        self.buildings = []
+        self.resources = {"food": 0, "wood": 0, "ore": 0, "weapons": 0, "warriors": 0, "ships": 0}
+        self.builder_manager = SyntheticBuilderManager()
+
+        self.wall = Wall(self)
+        if wall_width is None:
+            # Roughly square, a building and its path take up about 25 cells
+            wall_width = max(self.wall.width, int((num_buildings * 25) ** 0.5 * 1.2))
+        self.wall.width = wall_width
+
+        self.place_buildings(num_buildings)
+
+        self.wall.calculate_walls()
+
+        # Big villages don't fit in the normal world, the quadtrees and filler nodes only cover the world
+        # This changes the world size for everything after it, the tests put it back after each test
+        defines.WORLD_WIDTH = max(defines.WORLD_WIDTH, self.wall.width + 10)
+        defines.WORLD_HEIGHT = max(defines.WORLD_HEIGHT, self.wall.height + 10)
+        self.dirt_path = DirtPath(self)
+        self.navmesh = NavMesh(self)
+        self.path_service = PathService(self.navmesh)
+        self.villager_system = VillagerSystem(self)
+        self.world = SyntheticWorld()
+
+    def place_buildings(self, num_buildings):
+        """
+        Shelf-packs random buildings row by row and grows the wall to fit them
+        """
+        names = BldInfo.get_all_keys()
+        x_cell = 1
+        y_cell = defines.RIVER_BOTTOM_CELL + 1
+        row_height = 0
+        for _ in range(num_buildings):
+            name = self.rng.choice(names)
+            width = BldInfo.get_width(name)
+            height = BldInfo.get_height(name)
+            if x_cell + width + 1 > self.wall.width:
+                x_cell = 1
+                y_cell += row_height + 1
+                row_height = 0
+            self.buildings.append(Building(self, x_cell, y_cell, name))
+            x_cell += width + 1
+            row_height = max(row_height, height)
+
+        self.wall.height = max(self.wall.height, y_cell + row_height + 2)
+
+    def random_point(self, margin=0):
+        """
+        A random point inside the wall, or up to margin cells outside of it
+        """
+        x = self.rng.uniform(-margin, self.wall.width + margin) * defines.GRID_SIZE
+        y = self.rng.uniform(-margin, self.wall.height + margin) * defines.GRID_SIZE
+        return x, y
@@ -12,6 +12,9 @@ class Building(pygame.sprite.Sprite):
     Handles the building's rendering after it has been placed on the map.
     Handles updating the building's state, like how much resources it has produced.
     """
+    # Building size -> grey outline drawn when it is disabled
+    disabled_outlines = {}
+
     def __init__(self, village, x_cell, y_cell, name) -> None:
         """
         Initializes the building's position and image.
@@ -55,11 +58,12 @@ class Building(pygame.sprite.Sprite):
         pygame.draw.rect(surface, (100, 0, 0), (self.x - defines.camera_x - GRID_SIZE, self.y - defines.camera_y - GRID_SIZE,
                                                  self.rect.width + 2 * GRID_SIZE, self.rect.height + 2 * GRID_SIZE), 2)
     
-    def draw(self, surface: pygame.Surface):
+    def draw(self, surface: pygame.Surface, batch):
         """
-        Draws the building on the screen.
+        Draws the building's pad on the screen and adds the building itself to the batch.
 
         :param surface: The surface to draw the building on
+        :param batch: The RenderBatch the building's images go in
         """
         # Get the background color from the world and make it a bit darker for the pad of the building
         background_color = self.village.world.background_color
@@ -78,19 +82,25 @@ class Building(pygame.sprite.Sprite):
 
         # print(camera_x, camera_y)
         if not self.being_demolished:
-            surface.blit(self.image, (self.x - defines.camera_x, self.y - defines.camera_y))
+            batch.add(self.image, (self.x - defines.camera_x, self.y - defines.camera_y))
 
         # Draw a grey rectangle if the building is disabled
         if self.disabled:
-            pygame.draw.rect(surface, (150, 150, 150), (self.x - defines.camera_x, self.y - defines.camera_y, self.rect.width, self.rect.height), 5)
+            batch.add(self.get_disabled_outline(), (self.x - defines.camera_x, self.y - defines.camera_y))
 
         # Draw the icon
-        surface.blit(self.icon, (self.x - defines.camera_x, self.y - defines.camera_y))
-    def update(self):
+        batch.add(self.icon, (self.x - defines.camera_x, self.y - defines.camera_y))
+
+    def get_disabled_outline(self):
         """
-        Updates the building's state. 
+        The grey rectangle drawn around a disabled building, as an image so it can go in the batch with the building
         """
-        self.my_villager.update()
+        size = (self.rect.width, self.rect.height)
+        outline = Building.disabled_outlines.get(size)
+        if outline is None:
+            outline = Building.disabled_outlines[size] = pygame.Surface(size, pygame.SRCALPHA)
+            pygame.draw.rect(outline, (150, 150, 150), (0, 0, *size), 5)
+        return outline
 
     def get_boosted_production(self):
         """
@@ -183,9 +183,13 @@ class BuildingPanel:
         :param selected_height_cell: height of the selected building in cells
         """
 
-        for building in self.village.buildings + [c.building for c in self.village.builder_manager.construction_queue]:
-            if building is self:
-                continue
+        # The navmesh's obstacle grid already holds every building and construction site
+        # A building's blocking bounds sit a row higher than its footprint, so look 2 cells around the selection
+        nearby = self.village.navmesh.obstacle_grid.query_cells(selected_x - 2, selected_x + selected_width_cell + 1,
+                                                                selected_y - 2, selected_y + selected_height_cell + 1)
+        for building in nearby:
+            if building is self or not isinstance(building, Building):
+                continue  # Walls are checked separately
 
             # Check if the selected building overlaps with the building or is too close to allow for a path
             if (selected_x < building.x_cell + building.get_cell_width() + 1 and
@@ -52,6 +52,29 @@ HELP_FONT = pygame.font.Font("assets/fonts/Oldenburg-Regular.ttf", 24)
 
 show_navmesh = False
 
+# How villagers find their paths: "navmesh" for A* on the visibility graph, "jps" for jump point search on the building grid
+pathfinding_backend = "navmesh"
+
+# Worker processes that find villager paths in bulk, 0 finds every path in the game loop as soon as it is asked for
+path_workers = 0
+
+# Run the navmesh's innermost loops as the compiled kernels in villagers/kernels.py when numba is installed
+# They are compiled on a background thread when the game starts and used once they are ready
+use_numba = True
+
+# Villagers away from the camera are only moved every few frames, and caught up exactly as they come back into view
+villager_lod = True
+
+# Generated navmeshes are saved here and loaded again when the village layout is the same
+if platform.system() == "Windows":
+    CACHE_DIR = os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "viking-village-builder")
+elif platform.system() == "Darwin":
+    CACHE_DIR = os.path.join(os.path.expanduser("~"), "Library", "Caches", "viking-village-builder")
+else:
+    CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "viking-village-builder")
+NAVMESH_CACHE_DIR = os.path.join(CACHE_DIR, "navmesh_cache")
+use_navmesh_cache = True
+
 WIN_CONDITION = {
     "warriors": 250,
     "ships": 10,
@@ -7,6 +7,7 @@ from events.announcements import announcement_handler
 from game.start_menu import StartMenu
 from game.lore_scroll import LoreScroll
 from config.defines import FONT_PATH
+from villagers import kernels
 
 pygame.init()
 pygame.font.init()
@@ -49,5 +50,6 @@ class Game:
 
 
 if __name__ == "__main__":
+    kernels.start_warm_up()
     StartMenu().start()
     Game().start()
\ No newline at end of file
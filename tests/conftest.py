@@ -0,0 +1,16 @@
+"""
+Settings every test gets, so one test can't leak changes to config.defines into the next
+"""
+
+import pytest
+
+from config import defines
+
+
+@pytest.fixture(autouse=True)
+def synthetic_village_settings(monkeypatch):
+    # Generating the navmesh is what's being tested, so never load it from disk (or fill the cache with test villages)
+    monkeypatch.setattr(defines, "use_navmesh_cache", False)
+    # SyntheticVillage grows the world to fit big villages, shrink it back afterwards
+    monkeypatch.setattr(defines, "WORLD_WIDTH", defines.WORLD_WIDTH)
+    monkeypatch.setattr(defines, "WORLD_HEIGHT", defines.WORLD_HEIGHT)
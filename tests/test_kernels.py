@@ -0,0 +1,102 @@
+"""
+Checks that the numba kernels give exactly the same results as the numpy and pure Python code they replace
+Without numba the kernels run as plain Python, so the direct checks still run and the whole navmesh ones are skipped
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic_village import SyntheticVillage
+from config import defines
+from villagers import hierarchy
+from villagers import kernels
+from villagers import visibility
+from villagers.graph_search import search_graph
+
+GRAPH_ARRAYS = ("xs", "ys", "offsets", "targets", "costs")
+
+needs_numba = pytest.mark.skipif(kernels.numba is None, reason="numba isn't installed")
+
+
+@pytest.fixture(scope="module", autouse=True)
+def compiled_kernels():
+    # The game compiles them in the background, the tests need them straight away
+    kernels.warm_up()
+
+
+@pytest.fixture(autouse=True)
+def restore_use_numba(monkeypatch):
+    monkeypatch.setattr(defines, "use_numba", defines.use_numba)
+
+
+def generate(use_numba, monkeypatch):
+    monkeypatch.setattr(defines, "use_numba", use_numba)
+    village = SyntheticVillage(60, seed=1)
+    village.navmesh.generate_navmesh()
+    return village.navmesh
+
+
+def get_trips(navmesh, count):
+    rng = random.Random(0)
+    nodes = navmesh.graph.nodes()
+    return [(rng.choice(nodes), rng.choice(nodes)) for _ in range(count)]
+
+
+def test_segments_blocked(monkeypatch):
+    # The visibility functions hand over to the kernels when they are enabled, so turn them off for the reference
+    monkeypatch.setattr(defines, "use_numba", False)
+    rng = np.random.default_rng(0)
+    segments = rng.uniform(0, 1000, (500, 4))
+    corners = rng.uniform(0, 1000, (40, 2))
+    rects = np.column_stack((corners[:, 0], corners[:, 0] + 60, corners[:, 1], corners[:, 1] + 40))
+    assert np.array_equal(kernels.segments_blocked(segments, rects), visibility.segments_blocked(segments, rects))
+
+
+def test_nearest_neighbors(monkeypatch):
+    monkeypatch.setattr(defines, "use_numba", False)
+    rng = np.random.default_rng(0)
+    # On a lattice, so there are plenty of ties
+    points = rng.integers(0, 20, (300, 2)).astype(np.float64) * 24
+    queries = points[:50]
+    indices, distances = kernels.nearest_neighbors(points, queries, 10)
+    expected_indices, expected_distances = visibility.nearest_neighbors(points, queries, 10)
+    assert np.array_equal(indices, expected_indices)
+    assert np.array_equal(distances, expected_distances)
+
+
+@needs_numba
+def test_same_graph(monkeypatch):
+    assert kernels.ready.is_set()
+    reference = generate(False, monkeypatch).graph
+    compiled = generate(True, monkeypatch).graph
+    for name in GRAPH_ARRAYS:
+        assert bytes(getattr(reference, name)) == bytes(getattr(compiled, name))
+    assert list(reference.edges()) == list(compiled.edges())
+
+
+@needs_numba
+def test_same_paths(monkeypatch):
+    navmesh = generate(True, monkeypatch)
+    for start, end in get_trips(navmesh, 200):
+        assert kernels.search_graph(navmesh.graph, start, end) == search_graph(navmesh.graph, start, end)
+
+
+@needs_numba
+def test_same_paths_through_the_navmesh(monkeypatch):
+    navmesh = generate(False, monkeypatch)
+    trips = get_trips(navmesh, 100)
+    reference = [navmesh.search_path(start, end) for start, end in trips]
+    monkeypatch.setattr(defines, "use_numba", True)
+    assert kernels.enabled()
+    assert [navmesh.search_path(start, end) for start, end in trips] == reference
+
+
+@needs_numba
+def test_no_hierarchy_with_the_kernels(monkeypatch):
+    navmesh = generate(True, monkeypatch)
+    monkeypatch.setattr(hierarchy, "MIN_NODES", 0)
+    assert kernels.enabled()
+    for start, end in get_trips(navmesh, 100):
+        assert navmesh.find_node_path(start, end) == search_graph(navmesh.graph, start, end)
@@ -0,0 +1,145 @@
+"""
+Checks the incremental navmesh updates against navmeshes generated from scratch
+
+python -m pytest tests
+"""
+
+import random
+import threading
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic_village import SyntheticVillage
+from buildings.building import Building
+from config import defines
+from villagers import navmesh as navmesh_module
+from villagers import visibility
+
+
+@pytest.fixture(autouse=True)
+def without_numba(monkeypatch):
+    monkeypatch.setattr(defines, "use_numba", False)
+
+
+def get_edges(navmesh):
+    """
+    Every edge of the frozen graph as a pair of end points, so graphs with different node ids can be compared
+    """
+    graph = navmesh.graph
+    edges = set()
+    for a, b in graph.edges():
+        point_a, point_b = (graph.xs[a], graph.ys[a]), (graph.xs[b], graph.ys[b])
+        edges.add((min(point_a, point_b), max(point_a, point_b)))
+    return edges
+
+
+def change_buildings(village, count, seed):
+    """
+    Removes random buildings one at a time, putting every other one back, and updates the navmesh after each change
+    """
+    rng = random.Random(seed)
+    for step in range(count):
+        building = rng.choice(village.buildings)
+        village.buildings.remove(building)
+        village.navmesh.update_obstacles()
+        if step % 2:
+            village.buildings.append(Building(village, building.x_cell, building.y_cell, building.name))
+            village.navmesh.update_obstacles()
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_incremental_edges_are_superset_of_fresh_edges(seed):
+    village = SyntheticVillage(40, wall_width=40, seed=seed)
+    village.navmesh.generate_navmesh()
+    change_buildings(village, 12, seed)
+    assert not village.navmesh.is_building()
+    incremental = get_edges(village.navmesh)
+
+    village.navmesh.generate_navmesh()
+    fresh = get_edges(village.navmesh)
+
+    assert fresh <= incremental
+    # The extra edges still have to be walkable
+    segments = np.array([(a[0], a[1], b[0], b[1]) for a, b in incremental - fresh]).reshape(-1, 4)
+    assert not visibility.segments_blocked(segments, village.navmesh.get_obstacle_rects()).any()
+
+
+def test_rebuilds_after_many_incremental_changes(monkeypatch):
+    monkeypatch.setattr(navmesh_module, "REBUILD_INTERVAL", 4)
+    village = SyntheticVillage(20, seed=0)
+    navmesh = village.navmesh
+    navmesh.generate_navmesh()
+
+    change_buildings(village, 2, 0)
+    assert navmesh.incremental_changes == 3
+    assert not navmesh.is_building()
+
+    change_buildings(village, 2, 1)
+    assert navmesh.is_building()
+    navmesh.build_thread.join()
+    navmesh.check_background_build()
+    # The building put back while the build was running is caught up on incrementally
+    assert navmesh.incremental_changes == 1
+    assert navmesh.rebuilt_version == navmesh.version
+
+
+def test_failed_background_build_falls_back_to_generating(monkeypatch, caplog):
+    village = SyntheticVillage(20, seed=0)
+    navmesh = village.navmesh
+    navmesh.generate_navmesh()
+    version = navmesh.version
+
+    generate_obstacle_grid = navmesh_module.NavMesh.generate_obstacle_grid
+
+    def fail_off_main_thread(self, layout):
+        if threading.current_thread() is not threading.main_thread():
+            raise RuntimeError("build failed")
+        generate_obstacle_grid(self, layout)
+
+    monkeypatch.setattr(navmesh_module.NavMesh, "generate_obstacle_grid", fail_off_main_thread)
+    navmesh.start_background_build()
+    navmesh.build_thread.join()
+    navmesh.check_background_build()
+
+    assert not navmesh.is_building()
+    assert navmesh.version > version
+    assert navmesh.rebuilt_version == navmesh.version
+    assert "build failed" in caplog.text
+
+
+def test_no_path_without_any_nodes():
+    village = SyntheticVillage(10, seed=0)
+    navmesh = village.navmesh
+    navmesh.generate_navmesh()
+    # As if every node were walled in
+    navmesh.graph.active = bytearray(len(navmesh.graph.active))
+
+    start, end = village.random_point(), village.random_point()
+    assert navmesh.snap_to_graph(start) is None
+    assert navmesh.find_path(start, end) is None
+    assert navmesh.failure_reason == navmesh_module.NO_PATH
+    assert village.path_service.request(start, end).result() == (None, navmesh_module.NO_PATH)
+
+
+def test_smoothed_paths_are_cached(monkeypatch):
+    village = SyntheticVillage(40, wall_width=40, seed=0)
+    navmesh = village.navmesh
+    navmesh.generate_navmesh()
+    rng = random.Random(0)
+    queries = [(village.random_point(margin=5), village.random_point(margin=5)) for _ in range(50)]
+    queries += [(village.random_point(margin=5), rng.choice(navmesh.get_hub_points())) for _ in range(50)]
+    paths = [navmesh.find_path(start, end) for start, end in queries]
+
+    def smooth_again(self, node_path, graph=None):
+        raise AssertionError("smoothed a cached path again")
+
+    # Cache and flow field hits alike come back smoothed without line of sight tests between graph nodes
+    monkeypatch.setattr(navmesh_module.NavMesh, "smooth_node_path", smooth_again)
+    for (start, end), path in zip(queries, paths):
+        again = navmesh.find_path(start, end)
+        assert (again is None) == (path is None)
+        if path is not None:
+            assert [(node.x, node.y) for node in again] == [(node.x, node.y) for node in path]
+            segments = np.array([(a.x, a.y, b.x, b.y) for a, b in zip(list(path)[1:-2], list(path)[2:-1])]).reshape(-1, 4)
+            assert not visibility.segments_blocked(segments, navmesh.get_obstacle_rects()).any()
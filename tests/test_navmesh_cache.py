@@ -0,0 +1,63 @@
+"""
+Checks that cached navmeshes are only loaded back for the same layout and settings
+"""
+
+import pytest
+
+from benchmarks.synthetic_village import SyntheticVillage
+from config import defines
+from villagers import navmesh as navmesh_module
+from villagers import navmesh_cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(defines, "NAVMESH_CACHE_DIR", str(tmp_path / "navmesh_cache"))
+    monkeypatch.setattr(defines, "use_navmesh_cache", True)
+    monkeypatch.setattr(defines, "use_numba", False)
+
+
+def get_key(navmesh):
+    return navmesh_cache.layout_key(navmesh.get_layout(), navmesh.get_blocking_bounds, navmesh.get_cache_settings())
+
+
+def test_loads_the_same_graph_back(monkeypatch):
+    village = SyntheticVillage(20, seed=0)
+    village.navmesh.generate_navmesh()
+    assert navmesh_cache.load(get_key(village.navmesh)) is not None
+
+    # Nothing is connected on a cache hit
+    def fail(self, nodes):
+        raise AssertionError("the navmesh was generated instead of loaded")
+
+    monkeypatch.setattr(navmesh_module.NavMesh, "connect_nodes", fail)
+    other = SyntheticVillage(20, seed=0)
+    other.buildings = village.buildings
+    other.navmesh.generate_navmesh()
+    for name in ("xs", "ys", "offsets", "targets", "costs"):
+        assert bytes(getattr(village.navmesh.graph, name)) == bytes(getattr(other.navmesh.graph, name))
+
+
+def test_settings_are_part_of_the_key(monkeypatch):
+    navmesh = SyntheticVillage(20, seed=0).navmesh
+    key = get_key(navmesh)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(navmesh_module, "NEAREST_NEIGHBORS", navmesh_module.NEAREST_NEIGHBORS + 1)
+        assert get_key(navmesh) != key
+    with monkeypatch.context() as patch:
+        patch.setattr(navmesh_module, "FILLER_NODE_SPACING", navmesh_module.FILLER_NODE_SPACING + 1)
+        assert get_key(navmesh) != key
+    assert get_key(navmesh) == key
+
+
+def test_unwritable_cache_dir_is_ignored(monkeypatch, tmp_path):
+    # A file where the directory should be
+    blocker = tmp_path / "not_a_dir"
+    blocker.write_text("")
+    monkeypatch.setattr(defines, "NAVMESH_CACHE_DIR", str(blocker / "navmesh_cache"))
+
+    village = SyntheticVillage(20, seed=0)
+    village.navmesh.generate_navmesh()
+    assert len(village.navmesh.graph) > 0
+    assert navmesh_cache.load(get_key(village.navmesh)) is None
@@ -0,0 +1,147 @@
+"""
+Checks that moving villagers with the VillagerSystem, through its timer wheel, level of detail and advance,
+gives exactly what calling Villager.update on each of them every tick does
+Each villager gets a system of its own and the random numbers seeded for it, so both ways draw the same ones
+"""
+
+import random
+
+import pytest
+
+from benchmarks.synthetic_village import SyntheticVillage
+from config import defines
+from villagers.path_service import PathService
+from villagers.paths import Node
+from villagers.villager_system import VillagerSystem, WHEEL_SIZE
+
+NUM_VILLAGERS = 4
+
+
+@pytest.fixture(autouse=True)
+def restore_defines(monkeypatch):
+    monkeypatch.setattr(defines, "use_numba", False)
+    for name in ("villager_lod", "camera_x", "camera_y"):
+        monkeypatch.setattr(defines, name, getattr(defines, name))
+
+
+def make_villagers():
+    """
+    The villagers of the same village built twice, as pairs of (villager to tick, villager to put in a system)
+    """
+    villages = []
+    for _ in range(2):
+        random.seed(0)
+        village = SyntheticVillage(10)
+        village.navmesh.generate_navmesh()
+        villages.append(village)
+    return [(ticked.my_villager, in_system.my_villager)
+            for ticked, in_system in list(zip(villages[0].buildings, villages[1].buildings))[:NUM_VILLAGERS]]
+
+
+def get_state(villager):
+    return (villager.x, villager.y, villager.current_action, villager.current_time, villager.blurt_tick,
+            villager.blurt_message, villager.facing, villager.frame_tick, villager.destination, len(villager.path), villager.lost)
+
+
+def assert_same(state, expected, message):
+    """
+    Everything but the position has to be exactly the same, numpy rounds the steps a little differently
+    """
+    assert state[2:] == expected[2:], message
+    assert state[:2] == pytest.approx(expected[:2], abs=1e-6), message
+
+
+def tick(villager, frames):
+    """
+    Updates a villager on its own for frames ticks, returns its state after each one
+    """
+    states = []
+    for _ in range(frames):
+        villager.update()
+        states.append(get_state(villager))
+    return states
+
+
+def look_at(point):
+    """
+    Centres the camera on a Node
+    """
+    defines.camera_x = point.x - defines.DISPLAY_WIDTH / 2
+    defines.camera_y = point.y - defines.DISPLAY_HEIGHT / 2
+
+
+def look_away():
+    defines.camera_x = defines.camera_y = -10 ** 6
+
+
+@pytest.mark.parametrize("villager_lod", [False, True])
+def test_update_matches_ticking(villager_lod):
+    defines.villager_lod = villager_lod
+    # Long enough for timers due further ahead than one round of the wheel
+    frames = WHEEL_SIZE * 8
+    for i, (ticked, in_system) in enumerate(make_villagers()):
+        system = VillagerSystem(in_system.village)
+        system.add(in_system)
+        random.seed(i)
+        expected = tick(ticked, frames)
+        random.seed(i)
+        for frame in range(frames):
+            look_at(Node(*expected[frame][:2]))  # On screen, so the level of detail never leaves it behind
+            system.update()
+            assert_same(get_state(in_system), expected[frame], f"villager {i} differs on frame {frame}")
+
+
+def test_off_screen_villagers_catch_up():
+    defines.villager_lod = True
+    frames = WHEEL_SIZE * 6
+    for i, (ticked, in_system) in enumerate(make_villagers()):
+        system = VillagerSystem(in_system.village)
+        system.add(in_system)
+        random.seed(i)
+        expected = tick(ticked, frames)
+        random.seed(i)
+        for frame in range(frames):
+            # Off screen for a varying while, then back in view for a bit
+            on_screen = frame % 97 > 70
+            if on_screen:
+                look_at(Node(*expected[frame][:2]))
+            else:
+                look_away()
+            system.update()
+            if on_screen:
+                assert_same(get_state(in_system), expected[frame], f"villager {i} differs on frame {frame}")
+
+
+def test_advance_matches_ticking():
+    defines.villager_lod = False
+    turns, ticks = 8, 200
+    for i, (ticked, in_system) in enumerate(make_villagers()):
+        system = VillagerSystem(in_system.village)
+        system.add(in_system)
+        for turn in range(turns):
+            random.seed(i * turns + turn)
+            for _ in range(ticks):
+                ticked.update()
+            random.seed(i * turns + turn)
+            system.advance(ticks)
+            assert_same(get_state(in_system), get_state(ticked), f"villager {i} differs after turn {turn}")
+
+
+def test_advance_finds_paths_without_waiting_for_the_workers():
+    defines.villager_lod = False
+    turns, ticks = 4, 200
+    for i, (ticked, in_system) in enumerate(make_villagers()[:2]):
+        village = in_system.village
+        village.path_service = PathService(village.navmesh, workers=2)
+        system = VillagerSystem(village)
+        system.add(in_system)
+        try:
+            for turn in range(turns):
+                random.seed(i * turns + turn)
+                for _ in range(ticks):
+                    ticked.update()
+                random.seed(i * turns + turn)
+                system.advance(ticks)
+                assert_same(get_state(in_system), get_state(ticked), f"villager {i} differs after turn {turn}")
+        finally:
+            village.path_service.close()
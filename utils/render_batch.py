@@ -0,0 +1,27 @@
+"""
+Collects the sprites of a layer so they can all be drawn with one Surface.blits call instead of a blit each
+"""
+import pygame
+
+
+class RenderBatch:
+    """
+    Sprites are drawn in the order they were added. Anything drawn straight onto the surface (rects, lines, text)
+    ends up under the sprites still waiting, so flush first if it has to go on top of them
+    """
+    def __init__(self):
+        self.sprites = []  # (surface, position)
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def add(self, image: pygame.Surface, position):
+        self.sprites.append((image, position))
+
+    def flush(self, surface: pygame.Surface):
+        """
+        Draws everything added since the last flush
+        """
+        if self.sprites:
+            surface.blits(self.sprites, doreturn=False)
+            self.sprites.clear()
@@ -74,4 +74,25 @@ def long_text(surface, coor, newLinedtext, text_color, font, maxchar,
     for p in range(len(parts)):
         surface.blit(partsrendertext[p], (x + 2, y + r.height * p + 2))
 
-    return len(parts) * r.height
\ No newline at end of file
+    return len(parts) * r.height
+
+def render_long_text(newLinedtext, text_color, font, rect_color=(0,0,0,0), border_color=(0,0,0,0)):
+    """
+    Renders what long_text draws onto a surface of its own, so it can be kept and blitted again
+
+    :return: The surface and where its top left goes relative to the point long_text centers on
+    """
+    parts = newLinedtext.split("~")
+    partsrendertext = [font.render(part, True, text_color) for part in parts]
+
+    r = partsrendertext[0].get_rect()
+    width = max(p.get_width() for p in partsrendertext) + 4
+    height = r.height * len(parts) + 4
+
+    new_surface = pygame.Surface((width, height), pygame.SRCALPHA)
+    new_surface.fill(rect_color)
+    pygame.draw.rect(new_surface, border_color, (0, 0, width, height), 1)
+    for p in range(len(parts)):
+        new_surface.blit(partsrendertext[p], (2, r.height * p + 2))
+
+    return new_surface, (-r.width / 2, -r.height / 2)
@@ -8,6 +8,8 @@ from game.main_panel import MainPanel
 from events.random_event_handler import RandomEventHandler
 from effects.effect import Effect
 from villagers.navmesh import NavMesh
+from villagers.path_service import PathService
+from villagers.villager_system import VillagerSystem
 from game.initial_village import add_initial_buildings
 from village.wall import Wall
 from buildings.construction import Construction, BuilderManager
@@ -15,6 +17,7 @@ from world.world import World
 from villagers.dirt_path import DirtPath
 from village.war_power import WarPower
 from world.cloud import CloudHandler
+from utils.render_batch import RenderBatch
 
 class Village:
     """
@@ -42,6 +45,10 @@ class Village:
         self.dirt_path = DirtPath(self)
 
         self.navmesh = NavMesh(self)
+        self.path_service = PathService(self.navmesh, defines.path_workers)
+        self.villager_system = VillagerSystem(self)
+        # Sprites are collected here while drawing and blitted a layer at a time
+        self.render_batch = RenderBatch()
 
         self.building_demolish_queue = []
         self.world = World(self)
@@ -102,7 +109,8 @@ class Village:
         self.production_multipliers = {"food": 1, "wood": 1, "ore": 1, "weapons": 1, "warriors": 1, "ships": 1}
 
         if self.need_to_regen_navmesh:
-            self.navmesh.generate_navmesh()
+            # Only the buildings that changed are added to or removed from the navmesh
+            self.navmesh.update_obstacles()
             self.need_to_regen_navmesh = False
 
         # Call the on_new_turn method of all buildings
@@ -123,10 +131,8 @@ class Village:
         self.world.on_new_turn()
         self.cloud_handler.on_new_turn()
 
-        # Update all the villagers 100 times, to show a lot of time has passed
-        for _ in range(200):
-            for building in self.buildings:
-                building.my_villager.update()
+        # Move all the villagers on 200 frames, to show a lot of time has passed
+        self.villager_system.advance(200)
 
         if self.turn == 75:
             pygame.mixer.music.load("assets/audio/scary.mp3")
@@ -141,6 +147,8 @@ class Village:
             self.resources[resource] -= amount
 
         self.builder_manager.start_construction(building)
+        # Blocks the spot right away, the navmesh's graph catches up next turn
+        self.navmesh.register_obstacle(building)
         self.need_to_regen_navmesh = True
 
     def add_building(self, building: Building):
@@ -150,8 +158,10 @@ class Village:
         """
 
         self.buildings.append(building)
+        self.villager_system.add(building.my_villager)
 
         # Update the Villager's navmesh
+        self.navmesh.register_obstacle(building)
         self.need_to_regen_navmesh = True
 
         for building in self.buildings:
@@ -163,6 +173,7 @@ class Village:
         """
         try:
             self.buildings.remove(building)
+            self.villager_system.remove(building.my_villager)
 
             # make sure it's removed from the construction queue
             self.builder_manager.cancel(building)
@@ -170,6 +181,7 @@ class Village:
             pass 
 
         # Update the Villager's navmesh
+        self.navmesh.unregister_obstacle(building)
         self.need_to_regen_navmesh = True
 
         for building in self.buildings:
@@ -178,8 +190,13 @@ class Village:
     def update(self):
         mouse_pos = pygame.mouse.get_pos()
 
-        for building in self.buildings:
-            building.update()
+        self.navmesh.check_background_build()
+
+        # The buildings' villagers are all moved together
+        self.villager_system.update()
+
+        # Paths the villagers asked for this frame are found together
+        self.path_service.update()
 
         if self.turn == 100:
             return 
@@ -191,24 +208,24 @@ class Village:
 
 
     def draw(self, surface: pygame.Surface):
-        self.world.draw(surface, self.turn)
+        self.world.draw(surface, self.turn, self.render_batch)
         
         # self.dirt_path.draw(surface)
         self.wall.draw(surface)
         for building in self.buildings:
-            building.draw(surface)
+            building.draw(surface, self.render_batch)
+        self.render_batch.flush(surface)
 
-        self.war_power.draw(surface)
+        self.war_power.draw(surface, self.render_batch)
 
-        for building in self.buildings:
-            building.my_villager.draw(surface)
+        self.villager_system.draw(surface, self.render_batch)
 
         for construction in self.builder_manager.construction_queue:
             construction.draw(surface)
 
         self.random_events.draw(surface)
 
-        self.cloud_handler.draw(surface)
+        self.cloud_handler.draw(surface, self.render_batch)
 
         if defines.show_navmesh:    
             self.navmesh.draw(surface)
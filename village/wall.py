@@ -138,7 +138,8 @@ class Wall(pygame.sprite.Sprite):
             self.upgrade_cost[item] *= self.wall_cost_multiplier
             self.upgrade_cost[item] = int(self.upgrade_cost[item])
 
-        self.village.navmesh.generate_navmesh()
+        # Villagers keep walking the old navmesh until the new one is ready
+        self.village.navmesh.start_background_build()
         self.village.world.on_wall_upgrade()
 
     def can_build(self, x, y, width, height):
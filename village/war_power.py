@@ -48,7 +48,7 @@ class WarPower:
     def sway_function(x):
         return WarPower.SWAY_MAGNITUDE * (1 + math.sin(x / WarPower.SWAY_DURATION))
     
-    def draw(self, surface):
+    def draw(self, surface, batch):
         self.draw_tick += 1
         self.draw_tick %= int(WarPower.SWAY_DURATION * math.pi * 2)
 
@@ -62,7 +62,8 @@ class WarPower:
 
         for i in range(num_boats):
             sway = WarPower.sway_function(self.draw_tick + i * 10)
-            surface.blit(WarPower.ship_image, (start_x - defines.camera_x + i * boat_spacing + sway, start_y - defines.camera_y))
+            batch.add(WarPower.ship_image, (start_x - defines.camera_x + i * boat_spacing + sway, start_y - defines.camera_y))
+        batch.flush(surface)
 
         max_num_soldiers_width = int((self.village.wall.width * GRID_SIZE) / (WarPower.warrior_spacing) - 2)
         max_num_soldiers_width = 50
@@ -84,7 +85,8 @@ class WarPower:
             y = start_y + (GRID_SIZE * 1) - GRID_SIZE * 1.0 * (1 + rank)
 
             my_tick = (self.draw_tick + self.tick_offsets[i % 300]) // 8
-            surface.blit(WarPower.warrior_images[my_tick % 8], (x - defines.camera_x, y - defines.camera_y))
+            batch.add(WarPower.warrior_images[my_tick % 8], (x - defines.camera_x, y - defines.camera_y))
+        batch.flush(surface)
 
         if self.village.turn >= 100:
             self.draw_end_game(surface)
@@ -0,0 +1,38 @@
+"""
+Keeps the rendered speech bubbles of recent blurts so they are only rendered once, not on every frame they are shown
+"""
+
+from collections import OrderedDict
+
+from utils.utils import render_long_text
+
+# How many bubbles are kept before the least recently used one is dropped
+BLURT_CACHE_SIZE = 128
+
+
+class BlurtCache:
+    """
+    Maps a blurt message (with ~ where the lines break) to its bubble and the offset it is drawn at
+    Shared by all the villagers, so the same message is only rendered once however many of them say it
+    """
+    def __init__(self, font, max_size=BLURT_CACHE_SIZE):
+        self.font = font
+        self.max_size = max_size
+        self.entries = OrderedDict()  # message -> (surface, (dx, dy))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, message):
+        entry = self.entries.get(message)
+        if entry is None:
+            entry = self.entries[message] = render_long_text(message, (0, 0, 0), self.font,
+                                                             rect_color=(128, 128, 128, 255), border_color=(0, 0, 0, 255))
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(message)
+        return entry
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,34 @@
+"""
+Connected components of the navmesh's graph
+Worked out once per version of the graph, so a path query between two parts of the world that can't
+reach each other fails straight away instead of searching everything reachable from the start
+"""
+
+from array import array
+
+
+def find_components(graph):
+    """
+    Labels every node id of a NavGraph with the root of its component, using union-find over the edges
+    Two nodes can reach each other exactly when their labels are the same, ids that aren't in use get -1
+    """
+    size = len(graph.active)
+    parent = list(range(size))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]  # Path halving, keeps the trees flat
+            node = parent[node]
+        return node
+
+    for a, b in graph.edges():
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    labels = array("l", [-1]) * size
+    active = graph.active
+    for node in range(size):
+        if active[node]:
+            labels[node] = find(node)
+    return labels
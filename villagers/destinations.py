@@ -0,0 +1,32 @@
+"""
+The spots villagers walk to, shared by Villager.choose_destination and the navmesh's flow fields
+so the flow fields always cover the destinations the villagers actually pick
+"""
+
+from config import defines
+
+# Villagers from all over the village walk to the edges of these buildings
+HUB_BUILDINGS = ("lumbermill", "mine")
+
+
+def get_ore_exit():
+    """
+    Where the miners take their ore
+    """
+    return 0, defines.WORLD_HEIGHT * defines.GRID_SIZE
+
+
+def get_river():
+    """
+    Where the shipwrights go to the river
+    """
+    return defines.WORLD_WIDTH / 2 * defines.GRID_SIZE, defines.GRID_SIZE * 4
+
+
+def get_building_edges(building):
+    """
+    The 4 spots around a building a villager can walk to
+    If a building is 3x3 from (0, 0) to (2, 2) these are (-1, -1), (3, -1), (-1, 2) and (3, 2) (but multiplied by GRID_SIZE)
+    """
+    return [(building.x + x * defines.GRID_SIZE, building.y + y * defines.GRID_SIZE)
+            for x in (-1, building.get_cell_width()) for y in (-1, building.get_cell_height() - 1)]
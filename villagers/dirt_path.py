@@ -8,9 +8,9 @@ class DirtPath:
         self.village = village
         self.surface = pygame.Surface((village.wall.width * GRID_SIZE, village.wall.height * GRID_SIZE), pygame.SRCALPHA)
 
-    def on_navmesh_change(self, nodes_to_neighbors):
+    def on_navmesh_change(self, graph):
         """
-        When the navmesh changes, give me a dictionary of nodes to neighbors and I will draw the dirt path between them
+        When the navmesh changes, give me the new NavGraph and I will draw the dirt path along its edges
         """
 
         # Walking location conversion (Do this in reverse)
@@ -20,11 +20,11 @@ class DirtPath:
         # ymax = building.y + building.rect.height - 2 - defines.GRID_SIZE
 
         self.surface.fill((0, 0, 0, 0))
-        for node, neighbors in nodes_to_neighbors.items():
-            for neighbor in neighbors:
-                pygame.draw.line(self.surface, (100, 100, 100),
-                                  (node.x + defines.GRID_SIZE, node.y + defines.GRID_SIZE * 2), (neighbor.node.x + defines.GRID_SIZE, neighbor.node.y + defines.GRID_SIZE * 2),
-                                    8)
+        xs, ys = graph.xs, graph.ys
+        for a, b in graph.edges():
+            pygame.draw.line(self.surface, (100, 100, 100),
+                              (xs[a] + defines.GRID_SIZE, ys[a] + defines.GRID_SIZE * 2), (xs[b] + defines.GRID_SIZE, ys[b] + defines.GRID_SIZE * 2),
+                                8)
 
     def draw(self, surface):
         """
@@ -0,0 +1,59 @@
+"""
+Flow fields for destinations that a lot of villagers walk to
+A single Dijkstra search out from the target gives every node of the graph the next node to walk to,
+so any villager heading there just follows the pointers instead of running its own search
+"""
+
+import heapq
+from array import array
+
+
+class FlowField:
+    """
+    next_hop[i] is the neighbor node i should walk to next to reach the target
+    It is -1 for the target itself and for nodes that can't reach it
+    """
+    __slots__ = ("target", "next_hop", "distance")
+
+    def __init__(self, graph, target):
+        """
+        :param graph: the NavGraph to build the field on, it is undirected so searching out from the target works
+        :param target: node id every path leads to
+        """
+        self.target = target
+        size = len(graph.active)
+        self.next_hop = array("l", [-1]) * size
+        self.distance = array("d", [float("inf")]) * size
+
+        offsets, targets, costs = graph.offsets, graph.targets, graph.costs
+        next_hop, distance = self.next_hop, self.distance
+        distance[target] = 0
+        open_heap = [(0, target)]
+        while open_heap:
+            current_distance, current = heapq.heappop(open_heap)
+            if current_distance > distance[current]:
+                continue  # Stale heap entry
+
+            for k in range(offsets[current], offsets[current + 1]):
+                node = targets[k]
+                new_distance = current_distance + costs[k]
+                if new_distance < distance[node]:
+                    distance[node] = new_distance
+                    next_hop[node] = current
+                    heapq.heappush(open_heap, (new_distance, node))
+
+    def can_reach(self, start):
+        return self.distance[start] != float("inf")
+
+    def path_from(self, start):
+        """
+        Node ids from start to the target by following the next hops, or None if the target can't be reached
+        """
+        if not self.can_reach(start):
+            return None
+
+        path = [start]
+        next_hop = self.next_hop
+        while path[-1] != self.target:
+            path.append(next_hop[path[-1]])
+        return tuple(path)
@@ -0,0 +1,64 @@
+"""
+A* over a frozen navigation graph
+Only needs the CSR arrays of the graph (xs, ys, offsets, targets, costs) and nothing from pygame,
+so the path service's worker processes can run it on a copy of the graph in shared memory
+"""
+
+import heapq
+
+
+def search_graph(graph, start, end):
+    """
+    A* between two node ids of the graph
+    Returns a tuple of the node ids on the path, or None if end can't be reached
+    """
+    xs, ys = graph.xs, graph.ys
+    offsets, targets, costs = graph.offsets, graph.targets, graph.costs
+    end_x, end_y = xs[end], ys[end]
+
+    # The open set is a binary heap of (f_score, discovery order, node)
+    # Ties on the f_score go to the node that was discovered first, the same as a linear scan of an open list
+    # Scores are only created for nodes the search actually reaches
+    start_h = ((xs[start] - end_x) ** 2 + (ys[start] - end_y) ** 2) ** 0.5
+    open_heap = [(start_h, 0, start)]
+    discovery_order = {start: 0}
+    closed = set()
+    came_from = {start: None}  # Dictionary to store the parent of each node
+    g_score = {start: 0}  # Dictionary to store the cost of the cheapest path from start to node
+
+    while open_heap:
+        _, _, current = heapq.heappop(open_heap)
+        if current in closed:
+            continue  # Stale heap entry, this node was already reached with a better score
+
+        if current == end:  # Path found
+
+            # Build the path using the came_from dictionary
+            path = []
+            while current is not None:
+                path.append(current)
+                current = came_from[current]
+            return tuple(reversed(path))
+
+        closed.add(current)
+        current_g = g_score[current]
+
+        for k in range(offsets[current], offsets[current + 1]):
+            node = targets[k]
+            if node in closed:
+                continue
+            tentative_g_score = current_g + costs[k]  # Get the potential g_score for this node
+            order = discovery_order.get(node)
+            if order is None:  # First time seeing this node
+                order = len(discovery_order)
+                discovery_order[node] = order
+            elif tentative_g_score >= g_score[node]:  # Don't use the g_score if it's worse than the current one
+                continue
+
+            # If the g_score is better, than update the came_from and g_score dictionaries
+            came_from[node] = current
+            g_score[node] = tentative_g_score
+            h = ((xs[node] - end_x) ** 2 + (ys[node] - end_y) ** 2) ** 0.5
+            heapq.heappush(open_heap, (tentative_g_score + h, order, node))
+
+    return None  # No path found
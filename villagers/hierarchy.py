@@ -0,0 +1,252 @@
+"""
+Hierarchical pathfinding (HPA*) on top of the navmesh's graph
+The world is split into square clusters. A few of the edges between each pair of clusters are kept as
+transitions, their nodes are the entrances, and the cheapest paths between the entrances of each cluster
+are worked out ahead of time. Long trips are searched on the much smaller graph of entrances first,
+then filled back in with the stored paths.
+"""
+
+import heapq
+
+import numpy as np
+
+from config.defines import GRID_SIZE
+
+# Width and height of a cluster in cells
+CLUSTER_SIZE = 30
+
+# How many edges between two clusters are kept as transitions
+MAX_TRANSITIONS = 3
+
+# Graphs smaller than this are always searched directly
+MIN_NODES = 1500
+
+# Trips between clusters closer than this (in clusters) are searched directly
+MIN_CLUSTER_DISTANCE = 2
+
+
+class ClusterHierarchy:
+    """
+    The abstract graph over a NavGraph, clusters are only worked out again when something inside them changed
+    Paths found on it can be a little longer than the best path, and find_path gives up (returns None)
+    when the start or end can't get to an entrance of its cluster, so the caller has to fall back to a plain search
+    """
+    def __init__(self, cluster_size=CLUSTER_SIZE * GRID_SIZE):
+        self.cluster_size = cluster_size
+        self.graph = None
+        self.version = -1  # Version of the navmesh this was last updated for
+        self.cluster_of = []  # Node id -> (cluster x, cluster y), None for ids that aren't in use
+        self.members = {}  # Cluster -> node ids in it
+        self.entrances = {}  # Cluster -> {entrance: [(node in the other cluster, cost), ...]}
+        # Entrance -> list of (entrance, cost, whether the step stays inside the cluster)
+        # Inside a cluster an entrance only links to the entrances it can reach without passing another one
+        self.links = {}
+        self.parents = {}  # Entrance -> parent of each node on its paths inside the cluster
+
+    def update(self, graph, changed_nodes):
+        """
+        Moves the hierarchy to a new graph, only the clusters holding a changed node are abstracted again
+        :param changed_nodes: ids of the nodes that gained or lost edges since the last update
+        """
+        old_cluster_of = self.cluster_of
+        first = self.graph is None
+        self.graph = graph
+
+        size = self.cluster_size
+        active = np.frombuffer(graph.active, dtype=np.uint8).astype(bool)
+        cluster_xs = np.floor(np.frombuffer(graph.xs) / size).astype(np.int64).tolist()
+        cluster_ys = np.floor(np.frombuffer(graph.ys) / size).astype(np.int64).tolist()
+        self.cluster_of = [(cx, cy) if is_active else None for cx, cy, is_active in zip(cluster_xs, cluster_ys, active.tolist())]
+
+        self.members = {}
+        for node, cluster in enumerate(self.cluster_of):
+            if cluster is not None:
+                self.members.setdefault(cluster, []).append(node)
+
+        if first:
+            dirty = set(self.members)
+        else:
+            dirty = set()
+            for node in changed_nodes:
+                if node < len(old_cluster_of):
+                    dirty.add(old_cluster_of[node])
+                if node < len(self.cluster_of):
+                    dirty.add(self.cluster_of[node])
+            dirty.discard(None)
+
+        for cluster in dirty:
+            for entrance in self.entrances.pop(cluster, ()):
+                del self.links[entrance]
+                del self.parents[entrance]
+        # Entrances have to be known in every dirty cluster before the paths between them are worked out
+        dirty = [cluster for cluster in dirty if cluster in self.members]
+        for cluster in dirty:
+            self.find_entrances(cluster)
+        for cluster in dirty:
+            self.abstract_cluster(cluster)
+
+    def find_entrances(self, cluster):
+        """
+        Picks the transitions out of the cluster: for each other cluster it has edges to, the cheapest edge
+        and then up to MAX_TRANSITIONS - 1 more that don't start or end close to one already picked
+        Both clusters of an edge pick from the same edges in the same order, so they always agree
+        """
+        graph, cluster_of = self.graph, self.cluster_of
+        xs, ys = graph.xs, graph.ys
+        offsets, targets, costs = graph.offsets, graph.targets, graph.costs
+
+        crossing = {}  # Other cluster -> edges to it as (cost, lower id, higher id)
+        for node in self.members[cluster]:
+            for k in range(offsets[node], offsets[node + 1]):
+                other = targets[k]
+                if cluster_of[other] != cluster:
+                    crossing.setdefault(cluster_of[other], []).append((costs[k], min(node, other), max(node, other)))
+
+        spacing = (self.cluster_size / 4) ** 2
+        entrances = {}
+        for edges in crossing.values():
+            picked = []
+            for cost, a, b in sorted(edges):
+                if any((xs[a] - xs[c]) ** 2 + (ys[a] - ys[c]) ** 2 < spacing or
+                       (xs[b] - xs[d]) ** 2 + (ys[b] - ys[d]) ** 2 < spacing for c, d in picked):
+                    continue
+                picked.append((a, b))
+                node, other = (a, b) if cluster_of[a] == cluster else (b, a)
+                entrances.setdefault(node, []).append((other, cost))
+                if len(picked) == MAX_TRANSITIONS:
+                    break
+        self.entrances[cluster] = entrances
+
+    def abstract_cluster(self, cluster):
+        """
+        Works out the links of every entrance of the cluster
+        """
+        for entrance, transitions in self.entrances[cluster].items():
+            links, parents = self.search_cluster(entrance)
+            links.extend((other, cost, False) for other, cost in transitions)
+            self.links[entrance] = links
+            self.parents[entrance] = parents
+
+    def search_cluster(self, source):
+        """
+        Dijkstra from source that doesn't leave its cluster or go past the cluster's entrances
+        Returns (list of (entrance, cost, True) for every entrance reached, parent of each reached node)
+        """
+        graph, cluster_of = self.graph, self.cluster_of
+        offsets, targets, costs = graph.offsets, graph.targets, graph.costs
+        cluster = cluster_of[source]
+        entrances = self.entrances.get(cluster, {})
+
+        distance = {source: 0}
+        parents = {source: None}
+        links = []
+        open_heap = [(0, source)]
+        while open_heap:
+            current_distance, current = heapq.heappop(open_heap)
+            if current_distance > distance[current]:
+                continue  # Stale heap entry
+            if current != source and current in entrances:
+                links.append((current, current_distance, True))
+                continue  # Anything past here is reached through this entrance's own links
+
+            for k in range(offsets[current], offsets[current + 1]):
+                node = targets[k]
+                if cluster_of[node] != cluster:
+                    continue
+                new_distance = current_distance + costs[k]
+                if new_distance < distance.get(node, float("inf")):
+                    distance[node] = new_distance
+                    parents[node] = current
+                    heapq.heappush(open_heap, (new_distance, node))
+
+        return links, parents
+
+    def is_long_trip(self, start, end):
+        (start_x, start_y), (end_x, end_y) = self.cluster_of[start], self.cluster_of[end]
+        return max(abs(start_x - end_x), abs(start_y - end_y)) >= MIN_CLUSTER_DISTANCE
+
+    def find_path(self, start, end):
+        """
+        A* over the entrances, then each step is filled back in with the nodes it stands for
+        Returns a tuple of node ids from start to end, or None if no path was found on the abstract graph
+        """
+        xs, ys = self.graph.xs, self.graph.ys
+        end_x, end_y = xs[end], ys[end]
+
+        # Hook the start and end into the abstract graph through the entrances of their clusters
+        if start in self.links:
+            start_links, start_parents = self.links[start], self.parents[start]
+        else:
+            start_links, start_parents = self.search_cluster(start)
+        end_links, end_parents = self.search_cluster(end)
+        end_links = {entrance: cost for entrance, cost, _ in end_links}
+        if not start_links or not end_links and end not in self.links:
+            return None
+
+        open_heap = [(0, 0, start)]
+        discovery_order = {start: 0}
+        closed = set()
+        came_from = {start: None}  # Node -> (previous node, whether the step stays inside a cluster)
+        g_score = {start: 0}
+
+        while open_heap:
+            _, _, current = heapq.heappop(open_heap)
+            if current in closed:
+                continue
+            if current == end:
+                return self.refine(start, end, came_from, start_parents, end_parents)
+            closed.add(current)
+            current_g = g_score[current]
+
+            links = start_links if current == start else self.links[current]
+            if current in end_links:
+                links = links + [(end, end_links[current], True)]
+
+            for node, cost, inside in links:
+                if node in closed:
+                    continue
+                tentative_g_score = current_g + cost
+                order = discovery_order.get(node)
+                if order is None:
+                    order = len(discovery_order)
+                    discovery_order[node] = order
+                elif tentative_g_score >= g_score[node]:
+                    continue
+                came_from[node] = (current, inside)
+                g_score[node] = tentative_g_score
+                h = ((xs[node] - end_x) ** 2 + (ys[node] - end_y) ** 2) ** 0.5
+                heapq.heappush(open_heap, (tentative_g_score + h, order, node))
+
+        return None
+
+    def refine(self, start, end, came_from, start_parents, end_parents):
+        """
+        Turns the path over the abstract graph back into every node of the real graph along it
+        """
+        steps = []
+        node = end
+        while came_from[node] is not None:
+            previous, inside = came_from[node]
+            steps.append((previous, node, inside))
+            node = previous
+        steps.reverse()
+
+        path = [start]
+        for previous, node, inside in steps:
+            if not inside:
+                path.append(node)  # A single edge between two clusters
+            elif node == end:
+                # The search out from the end has parents that lead toward the end
+                current = end_parents[previous]
+                while current is not None:
+                    path.append(current)
+                    current = end_parents[current]
+            else:
+                parents = start_parents if previous == start else self.parents[previous]
+                between = []
+                current = node
+                while current != previous:
+                    between.append(current)
+                    current = parents[current]
+                path.extend(reversed(between))
+        return tuple(path)
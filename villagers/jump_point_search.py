@@ -0,0 +1,300 @@
+"""
+The jump point search pathfinding backend, picked with defines.pathfinding_backend = "jps"
+Instead of the visibility graph it searches the world's grid of cells, built again whenever the navmesh changes
+"""
+
+import heapq
+import math
+from array import array
+
+import numpy as np
+
+from config import defines
+from config.defines import GRID_SIZE
+from villagers.paths import Node, WALLED_OFF, NO_PATH
+
+
+class JumpPointSearch:
+    """
+    The other pathfinding backend: jump point search on the world's grid of GRID_SIZE cells
+    The cells under buildings and the wall are blocked, paths move in 8 directions but never cut the corner of a blocked cell
+
+    Navmesh points are where a villager is drawn from, its feet are at (x + GRID_SIZE, y + GRID_SIZE * 2),
+    and the blocking bounds of a building are its cells shifted to match. The grid works on the feet instead,
+    so a one cell gap between two buildings stays a free cell.
+    """
+    def __init__(self, obstacle_grid):
+        self.min_x = int(-defines.WORLD_WIDTH * .25)
+        self.min_y = int(-defines.WORLD_HEIGHT * .25)
+        self.width = defines.WORLD_WIDTH - self.min_x
+        self.height = defines.WORLD_HEIGHT - self.min_y
+        self.failure_reason = None
+
+        # 1 for every free cell, indexed by y * width + x from the top left of the grid
+        self.free = bytearray([1]) * (self.width * self.height)
+        for xmin, xmax, ymin, ymax in obstacle_grid.bounds.values():
+            # Undo NavMesh.get_blocking_bounds to get back the cells the obstacle stands on
+            # Buildings line up with the cells, the thin wall blocks every cell it touches
+            x0 = math.floor((xmin + GRID_SIZE - 2) / GRID_SIZE) - self.min_x
+            x1 = math.ceil((xmax + 2) / GRID_SIZE) - self.min_x
+            y0 = math.floor((ymin + GRID_SIZE * 2 - 2) / GRID_SIZE) - self.min_y
+            y1 = math.ceil((ymax + 2 + GRID_SIZE) / GRID_SIZE) - self.min_y
+            for y in range(max(y0, 0), min(y1, self.height)):
+                for x in range(max(x0, 0), min(x1, self.width)):
+                    self.free[y * self.width + x] = 0
+
+        self.components = self.find_components()
+
+        # Straight jumps are looked up instead of stepped through, for each direction and cell:
+        # how many free cells there are in a row from it, and how far away the first cell with a forced neighbor is (-1 if none)
+        self.runs = {}
+        self.stops = {}
+        for direction in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            self.runs[direction], self.stops[direction] = self.find_straight_jumps(direction)
+
+    def find_straight_jumps(self, direction):
+        """
+        The free run length and distance to the next forced neighbor of every cell going in one straight direction
+        """
+        dx, dy = direction
+        free = np.frombuffer(self.free, dtype=np.uint8).reshape(self.height, self.width).astype(bool)
+        # Turn the grid so the direction is always along +x
+        if dy:
+            free = free.T
+        if dx < 0 or dy < 0:
+            free = free[:, ::-1]
+
+        # A cell has a forced neighbor if the cell beside it is free but the one beside the cell behind it isn't
+        padded = np.pad(free, 1)
+        forced = free & ((padded[:-2, 1:-1] & ~padded[:-2, :-2]) | (padded[2:, 1:-1] & ~padded[2:, :-2]))
+
+        length = free.shape[1]
+        columns = np.arange(length)
+        next_blocked = np.minimum.accumulate(np.where(free, length, columns)[:, ::-1], axis=1)[:, ::-1]
+        next_forced = np.minimum.accumulate(np.where(forced, columns, length)[:, ::-1], axis=1)[:, ::-1]
+        runs = next_blocked - columns
+        stops = np.where(next_forced < next_blocked, next_forced - columns, -1)
+
+        # And back again
+        if dx < 0 or dy < 0:
+            runs, stops = runs[:, ::-1], stops[:, ::-1]
+        if dy:
+            runs, stops = runs.T, stops.T
+        return array("l", runs.ravel().tolist()), array("l", stops.ravel().tolist())
+
+    def is_free(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height and self.free[y * self.width + x]
+
+    def find_components(self):
+        """
+        Flood fills the free cells, two cells can reach each other exactly when their labels are the same
+        Diagonal steps need both cells beside them free, so 4 way connectivity is enough
+        """
+        width, free = self.width, self.free
+        labels = array("l", [-1]) * len(free)
+        for seed in range(len(free)):
+            if not free[seed] or labels[seed] != -1:
+                continue
+            labels[seed] = seed
+            stack = [seed]
+            while stack:
+                cell = stack.pop()
+                x = cell % width
+                for other in (cell - width, cell + width, cell - 1 if x > 0 else -1, cell + 1 if x < width - 1 else -1):
+                    if 0 <= other < len(free) and free[other] and labels[other] == -1:
+                        labels[other] = seed
+                        stack.append(other)
+        return labels
+
+    def get_cell(self, point):
+        """
+        The free cell nearest to point, in grid coordinates
+        Points on the edge of a building are usually in one of its blocked cells, so the cells around it are searched
+        """
+        px, py = point[0] / GRID_SIZE + 1 - self.min_x, point[1] / GRID_SIZE + 2 - self.min_y
+        x = min(max(math.floor(px), 0), self.width - 1)
+        y = min(max(math.floor(py), 0), self.height - 1)
+        if self.free[y * self.width + x]:
+            return x, y
+
+        best, best_distance = None, math.inf
+        for radius in range(1, max(self.width, self.height)):
+            for cx in range(x - radius, x + radius + 1):
+                for cy in (y - radius, y + radius) if abs(cx - x) < radius else range(y - radius, y + radius + 1):
+                    if self.is_free(cx, cy):
+                        distance = (cx + .5 - px) ** 2 + (cy + .5 - py) ** 2
+                        if distance < best_distance:
+                            best, best_distance = (cx, cy), distance
+            if best is not None:
+                return best
+        return x, y
+
+    def find_path(self, start_pnt, end_pnt):
+        """
+        Same as NavMesh.find_path_a_star, the path goes through the centres of the cells where it turns
+        """
+        if not self.can_reach(start_pnt, end_pnt):
+            self.failure_reason = WALLED_OFF
+            return None
+
+        start, end = self.get_cell(start_pnt), self.get_cell(end_pnt)
+
+        cells = self.search(start, end)
+        if cells is None:
+            self.failure_reason = NO_PATH
+            return None
+
+        path = [Node((x + self.min_x - .5) * GRID_SIZE, (y + self.min_y - 1.5) * GRID_SIZE) for x, y in cells]
+        path.insert(0, Node(start_pnt[0], start_pnt[1]))
+        path.append(Node(end_pnt[0], end_pnt[1]))
+        return path
+
+    def can_reach(self, start_pnt, end_pnt):
+        """
+        Whether there is any path between the free cells nearest two points, without searching for it
+        """
+        (start_x, start_y), (end_x, end_y) = self.get_cell(start_pnt), self.get_cell(end_pnt)
+        return self.components[start_y * self.width + start_x] == self.components[end_y * self.width + end_x]
+
+    def search(self, start, end):
+        """
+        A* over the jump points between two free cells, returns the list of cells where the path turns
+        """
+        end_x, end_y = end
+
+        def octile(x, y):
+            dx, dy = abs(x - end_x), abs(y - end_y)
+            return (max(dx, dy) + (2 ** 0.5 - 1) * min(dx, dy)) * GRID_SIZE
+
+        open_heap = [(octile(*start), 0, start)]
+        discovery_order = {start: 0}
+        closed = set()
+        came_from = {start: None}
+        g_score = {start: 0}
+
+        while open_heap:
+            _, _, current = heapq.heappop(open_heap)
+            if current in closed:
+                continue
+            if current == end:
+                path = []
+                while current is not None:
+                    path.append(current)
+                    current = came_from[current]
+                return path[::-1]
+
+            closed.add(current)
+            x, y = current
+            for dx, dy in self.get_directions(current, came_from[current]):
+                jump_point = self.jump(x + dx, y + dy, dx, dy, end)
+                if jump_point is None or jump_point in closed:
+                    continue
+                steps = max(abs(jump_point[0] - x), abs(jump_point[1] - y))
+                tentative_g_score = g_score[current] + steps * GRID_SIZE * (2 ** 0.5 if dx and dy else 1)
+                order = discovery_order.get(jump_point)
+                if order is None:
+                    order = len(discovery_order)
+                    discovery_order[jump_point] = order
+                elif tentative_g_score >= g_score[jump_point]:
+                    continue
+                came_from[jump_point] = current
+                g_score[jump_point] = tentative_g_score
+                heapq.heappush(open_heap, (tentative_g_score + octile(*jump_point), order, jump_point))
+
+        return None
+
+    def get_directions(self, cell, parent):
+        """
+        The directions worth jumping in from cell, everything else is reached as well or better through the parent
+        """
+        x, y = cell
+        is_free = self.is_free
+        if parent is None:
+            directions = []
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    if (dx or dy) and is_free(x + dx, y + dy) and (not dx or not dy or is_free(x + dx, y) and is_free(x, y + dy)):
+                        directions.append((dx, dy))
+            return directions
+
+        dx = (x > parent[0]) - (x < parent[0])
+        dy = (y > parent[1]) - (y < parent[1])
+        directions = []
+        if dx and dy:
+            if is_free(x, y + dy):
+                directions.append((0, dy))
+            if is_free(x + dx, y):
+                directions.append((dx, 0))
+            if is_free(x, y + dy) and is_free(x + dx, y):
+                directions.append((dx, dy))
+        elif dx:
+            ahead, up, down = is_free(x + dx, y), is_free(x, y - 1), is_free(x, y + 1)
+            if ahead:
+                directions.append((dx, 0))
+                if up:
+                    directions.append((dx, -1))
+                if down:
+                    directions.append((dx, 1))
+            if up:
+                directions.append((0, -1))
+            if down:
+                directions.append((0, 1))
+        else:
+            ahead, left, right = is_free(x, y + dy), is_free(x - 1, y), is_free(x + 1, y)
+            if ahead:
+                directions.append((0, dy))
+                if left:
+                    directions.append((-1, dy))
+                if right:
+                    directions.append((1, dy))
+            if left:
+                directions.append((-1, 0))
+            if right:
+                directions.append((1, 0))
+        return directions
+
+    def jump(self, x, y, dx, dy, end):
+        """
+        Steps from (x, y) in direction (dx, dy) until reaching a cell the path might have to turn at
+        Returns that cell, or None if a blocked cell comes first
+        """
+        if not (dx and dy):
+            return self.jump_straight(x, y, dx, dy, end)
+
+        is_free = self.is_free
+        while is_free(x, y):
+            if (x, y) == end:
+                return x, y
+            # A diagonal stops wherever one of its two straight parts would find something
+            if self.jump_straight(x + dx, y, dx, 0, end) is not None or self.jump_straight(x, y + dy, 0, dy, end) is not None:
+                return x, y
+            if not (is_free(x + dx, y) and is_free(x, y + dy)):
+                return None  # Can't cut the corner
+            x += dx
+            y += dy
+        return None
+
+    def jump_straight(self, x, y, dx, dy, end):
+        """
+        Jumps along a row or column with the run and stop tables
+        A cell has a forced neighbor when a wall beside the cell just behind it ends there, so the path may need to turn
+        """
+        if not self.is_free(x, y):
+            return None
+        cell = y * self.width + x
+        run, stop = self.runs[(dx, dy)][cell], self.stops[(dx, dy)][cell]
+
+        # Distance to the end if it is straight ahead
+        end_x, end_y = end
+        if dx and end_y == y and (end_x - x) * dx >= 0:
+            to_end = (end_x - x) * dx
+        elif dy and end_x == x and (end_y - y) * dy >= 0:
+            to_end = (end_y - y) * dy
+        else:
+            to_end = None
+
+        if to_end is not None and to_end < run and (stop < 0 or to_end <= stop):
+            return end
+        if stop < 0:
+            return None
+        return x + dx * stop, y + dy * stop
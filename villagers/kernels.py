@@ -0,0 +1,213 @@
+"""
+Compiled versions of the navmesh's innermost loops, used when numba is installed and defines.use_numba is on
+Each kernel returns exactly what the numpy or pure Python version it replaces does, which
+tests/test_kernels.py checks. Without numba the kernels are left as plain Python, that is
+far too slow to play with but still runs, so the checks can be done anywhere
+
+Compiling the kernels takes a few seconds the first time (numba caches them on disk after that), so the game
+compiles them on a background thread with start_warm_up and keeps using the numpy and Python code until they are ready
+"""
+
+import heapq
+import threading
+from array import array
+
+import numpy as np
+
+from config import defines
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# Set once every kernel has been compiled, a process forked before that never uses them
+ready = threading.Event()
+
+
+def enabled():
+    return numba is not None and defines.use_numba and ready.is_set()
+
+
+def jit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+@jit
+def liang_barsky(x0, y0, x1, y1, xmin, xmax, ymin, ymax):
+    """
+    NavMesh.liang_barsky without the lists
+    """
+    dx = x1 - x0
+    dy = y1 - y0
+    u1, u2 = 0.0, 1.0
+    for pi, qi in ((-dx, x0 - xmin), (dx, xmax - x0), (-dy, y0 - ymin), (dy, ymax - y0)):
+        if pi == 0:
+            if qi < 0:
+                return False  # Line is parallel and outside the rectangle
+            continue
+        u = qi / pi
+        if pi < 0:
+            if u > u2:
+                return False
+            if u > u1:
+                u1 = u
+        else:
+            if u < u1:
+                return False
+            if u < u2:
+                u2 = u
+    return True
+
+
+@jit
+def find_blocked(segments, rects):
+    blocked = np.zeros(len(segments), dtype=np.bool_)
+    for i in range(len(segments)):
+        x0, y0, x1, y1 = segments[i, 0], segments[i, 1], segments[i, 2], segments[i, 3]
+        seg_xmin, seg_xmax = min(x0, x1), max(x0, x1)
+        seg_ymin, seg_ymax = min(y0, y1), max(y0, y1)
+        for j in range(len(rects)):
+            xmin, xmax, ymin, ymax = rects[j, 0], rects[j, 1], rects[j, 2], rects[j, 3]
+            if seg_xmin > xmax or seg_xmax < xmin or seg_ymin > ymax or seg_ymax < ymin:
+                continue
+            if liang_barsky(x0, y0, x1, y1, xmin, xmax, ymin, ymax):
+                blocked[i] = True
+                break
+    return blocked
+
+
+def segments_blocked(segments, rects):
+    """
+    visibility.segments_blocked, one segment at a time with a bounding box check before each Liang-Barsky test
+    """
+    segments = np.ascontiguousarray(segments, dtype=np.float64).reshape(-1, 4)
+    rects = np.ascontiguousarray(rects, dtype=np.float64).reshape(-1, 4)
+    return find_blocked(segments, rects)
+
+
+@jit
+def find_nearest(points, queries, k, indices, distances):
+    # Keeps the k nearest seen so far sorted by (distance, index), points are visited in index order so a tie
+    # never replaces one that is already kept
+    for q in range(len(queries)):
+        qx, qy = queries[q, 0], queries[q, 1]
+        kept_sq = np.full(k, np.inf)
+        kept = np.zeros(k, dtype=np.int64)
+        for i in range(len(points)):
+            dx = qx - points[i, 0]
+            dy = qy - points[i, 1]
+            distance_sq = dx * dx + dy * dy
+            if distance_sq >= kept_sq[k - 1]:
+                continue
+            slot = k - 1
+            while slot > 0 and kept_sq[slot - 1] > distance_sq:
+                kept_sq[slot] = kept_sq[slot - 1]
+                kept[slot] = kept[slot - 1]
+                slot -= 1
+            kept_sq[slot] = distance_sq
+            kept[slot] = i
+        indices[q] = kept
+        distances[q] = np.sqrt(kept_sq)
+
+
+def nearest_neighbors(points, queries, k):
+    """
+    visibility.nearest_neighbors with a running insertion sort per query instead of partitioning a distance matrix
+    """
+    points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2)
+    queries = np.ascontiguousarray(queries, dtype=np.float64).reshape(-1, 2)
+    k = min(k, len(points))
+    indices = np.empty((len(queries), k), dtype=np.int64)
+    distances = np.empty((len(queries), k))
+    if k > 0:
+        find_nearest(points, queries, k, indices, distances)
+    return indices, distances
+
+
+@jit
+def a_star(xs, ys, offsets, targets, costs, start, end):
+    # graph_search.search_graph on the CSR arrays, the heap entries and the order edges are relaxed in are the same
+    # so ties go the same way. Returns the node ids of the path, empty if there isn't one
+    size = len(xs)
+    discovery_order = np.full(size, -1, dtype=np.int64)
+    came_from = np.full(size, -1, dtype=np.int64)
+    g_score = np.zeros(size)
+    closed = np.zeros(size, dtype=np.bool_)
+    end_x, end_y = xs[end], ys[end]
+
+    open_heap = [(((xs[start] - end_x) ** 2 + (ys[start] - end_y) ** 2) ** 0.5, 0, start)]
+    discovery_order[start] = 0
+    discovered = 1
+
+    while open_heap:
+        _, _, current = heapq.heappop(open_heap)
+        if closed[current]:
+            continue
+        if current == end:
+            length = 1
+            node = current
+            while node != start:
+                node = came_from[node]
+                length += 1
+            path = np.empty(length, dtype=np.int64)
+            for i in range(length - 1, -1, -1):
+                path[i] = current
+                current = came_from[current]
+            return path
+
+        closed[current] = True
+        current_g = g_score[current]
+
+        for k in range(offsets[current], offsets[current + 1]):
+            node = targets[k]
+            if closed[node]:
+                continue
+            tentative_g_score = current_g + costs[k]
+            order = discovery_order[node]
+            if order < 0:
+                order = discovered
+                discovery_order[node] = order
+                discovered += 1
+            elif tentative_g_score >= g_score[node]:
+                continue
+            came_from[node] = current
+            g_score[node] = tentative_g_score
+            h = ((xs[node] - end_x) ** 2 + (ys[node] - end_y) ** 2) ** 0.5
+            heapq.heappush(open_heap, (tentative_g_score + h, order, node))
+
+    return np.empty(0, dtype=np.int64)
+
+
+def search_graph(graph, start, end):
+    """
+    graph_search.search_graph run by the a_star kernel, takes and returns the same things
+    """
+    path = a_star(np.asarray(graph.xs), np.asarray(graph.ys), np.asarray(graph.offsets), np.asarray(graph.targets),
+                  np.asarray(graph.costs), start, end)
+    if len(path) == 0:
+        return None
+    return tuple(path.tolist())
+
+
+def warm_up():
+    """
+    Compiles every kernel by running it on a tiny input, with the same argument types the navmesh passes
+    """
+    if numba is not None and not ready.is_set():
+        segments_blocked(np.zeros((1, 4)), np.ones((1, 4)))
+        nearest_neighbors(np.zeros((2, 2)), np.zeros((1, 2)), 1)
+        # The graph's CSR arrays are array.array, whose "l" isn't int64 everywhere
+        a_star(np.zeros(2), np.zeros(2), np.asarray(array("l", [0, 1, 2])), np.asarray(array("l", [1, 0])),
+               np.ones(2), 0, 1)
+    ready.set()
+
+
+def start_warm_up():
+    """
+    Runs warm_up on a background thread, so the first navmesh build doesn't wait for the compiler
+    """
+    threading.Thread(target=warm_up, daemon=True).start()
@@ -2,9 +2,52 @@ import pygame
 from config import defines
 from config.defines import GRID_SIZE
 import random
+import math
+import logging
+import threading
+from array import array
+from collections import deque
 
 from pyquadtree import QuadTree
-import copy
+import numpy as np
+
+from villagers import visibility
+from villagers import kernels
+from villagers.obstacle_grid import ObstacleGrid
+from villagers.path_cache import PathCache
+from villagers.flow_field import FlowField
+from villagers.components import find_components
+from villagers.graph_search import search_graph
+from villagers import hierarchy
+from villagers import navmesh_cache
+from villagers import destinations
+from villagers.paths import Node, WALLED_OFF, NO_PATH
+from villagers.jump_point_search import JumpPointSearch
+
+logger = logging.getLogger(__name__)
+
+# When more buildings than this changed in one turn, the navmesh is rebuilt in the background instead
+MAX_INCREMENTAL_CHANGES = 10
+
+# Incremental updates keep every edge a fresh build would have, but also some that a fresh build would leave out
+# After this many buildings have been added or removed since the last full build, the navmesh is rebuilt in the background
+REBUILD_INTERVAL = 50
+
+# How many of the nearest nodes each node tries to connect to
+NEAREST_NEIGHBORS = 10
+
+# Cells between the filler nodes laid out over the whole world, so there is always somewhere to walk in the open
+FILLER_NODE_SPACING = 15
+
+# How many of the nodes closest to a cell are checked for being in sight of it, and how many of those are kept
+SNAP_SEARCH_SIZE = 16
+SNAP_CANDIDATES = 4
+
+# How many waypoints ahead smooth_path looks for one it can walk straight to
+SMOOTHING_LOOKAHEAD = 8
+
+# How far (in pixels) the corner nodes from get_corner_points are outside the blocking bounds
+CORNER_OFFSET = 3
 
 
 class CollisionRect:
@@ -15,51 +58,151 @@ class CollisionRect:
         self.height = height
         self.rect = pygame.Rect(x, y, width, height)
 
-class Neighbor:
-    def __init__(self, node, cost):
-        self.node = node
-        self.cost = cost
+class NavGraph:
+    """
+    The navigation graph frozen into compressed sparse row (CSR) arrays
+    Node i is at (xs[i], ys[i]) and its neighbors are targets[offsets[i]:offsets[i + 1]] with the matching costs
+    Ids of removed nodes stay in the arrays with no neighbors and active[i] == 0
+    """
+    __slots__ = ("xs", "ys", "offsets", "targets", "costs", "active", "node_count")
 
-class Node:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        self.neighbors = []
+    def __init__(self, xs, ys, adjacency):
+        """
+        :param xs: x coordinate of each node id
+        :param ys: y coordinate of each node id
+        :param adjacency: for each node id a dict of neighbor id to cost, or None if the id is not in use
+        """
+        self.xs = array("d", xs)
+        self.ys = array("d", ys)
+        self.offsets = array("l", [0])
+        self.targets = array("l")
+        self.costs = array("d")
+        self.active = bytearray(len(adjacency))
+        self.node_count = 0
+
+        for i, neighbors in enumerate(adjacency):
+            if neighbors:
+                self.active[i] = 1
+                self.node_count += 1
+                self.targets.extend(neighbors.keys())
+                self.costs.extend(neighbors.values())
+            self.offsets.append(len(self.targets))
+
+    def __len__(self):
+        return self.node_count
+
+    def neighbors(self, i):
+        """
+        Returns a list of (neighbor id, cost) for node i
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return list(zip(self.targets[start:end], self.costs[start:end]))
+
+    def nodes(self):
+        """
+        Ids of all the nodes in use
+        """
+        return [i for i in range(len(self.active)) if self.active[i]]
 
-    def add_neighbor(self, node, cost):
-        self.neighbors.append(Neighbor(node, cost))
+    def edges(self):
+        """
+        Every edge once as (from id, to id), the graph is undirected so only from < to is returned
+        """
+        offsets, targets = self.offsets, self.targets
+        for i in range(len(self.active)):
+            for k in range(offsets[i], offsets[i + 1]):
+                if i < targets[k]:
+                    yield i, targets[k]
+
+class NavLayout:
+    """
+    A copy of everything generate_navmesh needs from the village, so the navmesh can be built off the main thread
+    """
+    __slots__ = ("buildings", "wall_rects", "wall_nodes")
+
+    def __init__(self, buildings, wall):
+        self.buildings = list(buildings)
+        self.wall_rects = list(wall.get_collision_rects())
+        # The outer corners and the hole in the wall
+        self.wall_nodes = [(node.x, node.y) for node in wall.outer_corner_nodes] + [(wall.hole_node.x, wall.hole_node.y)]
 
 class NavMesh:
 
     def __init__(self, village):
         self.village = village
-        self.nodes = None
 
-        # Quadtree that holds all the buildings for can_see
-        self.building_quadtree = None 
+        # The graph the villagers walk on, frozen after every change
+        self.graph = None
+        # Goes up by one every time the graph is frozen, cached paths from an older version are ignored
+        self.version = 0
+        self.path_cache = PathCache()
+
+        # Flow fields toward the destinations lots of villagers share, built when first needed
+        # Both are thrown away when the version changes
+        self.flow_fields = {}  # Target node id -> FlowField
+        self.hub_nodes = None
+        self.hubs_version = -1
+
+        # Connected component of each node id, worked out again when the version changes
+        self.components = None
+        self.components_version = -1
+        self.failure_reason = None  # Why the last path query returned None
+
+        # The grid for the jump point search backend, built again when the version changes
+        self.jump_point_search = None
+        self.jump_point_search_version = -1
+
+        # Grid cell -> nodes seen from its centre, nearest first, filled in as villagers walk from and to the cell
+        self.snap_table = {}
+        self.snap_version = -1
+
+        # Version the graph had when it was last built from scratch, villagers with older paths find new ones
+        self.rebuilt_version = 0
+        # Buildings added or removed incrementally since the graph was last built from scratch
+        self.incremental_changes = 0
+
+        # A full rebuild running on another thread, the villagers keep using this navmesh until it's done
+        self.build_thread = None
+        self.builder = None  # The NavMesh the thread is building
+        self.build_error = None
+        self.rebuild_pending = False  # Something changed after the running build took its snapshot
+
+        # Clusters for hierarchical pathfinding on big graphs, caught up to the graph when first needed
+        self.hierarchy = None
+        self.changed_nodes = set()  # Nodes whose edges changed since the graph was last frozen
+        self.unabstracted_nodes = set()  # Changed nodes in the frozen graph that the hierarchy hasn't caught up on
+
+        # While building the graph each node id has a position and a dict of neighbor id to cost
+        # Removed ids are reused from free_ids
+        self.nodes = None  # Ids of the nodes in the graph, used as an ordered set
+        self.node_x = []
+        self.node_y = []
+        self.node_reach = []  # Distance to the furthest of the nearest neighbors checked when connecting
+        self.adjacency = []
+        self.free_ids = []
+
+        # Spatial hash of the building and wall rectangles for can_see
+        # Buildings are registered as soon as they are placed, the graph itself only catches up on the next turn
+        self.obstacle_grid = ObstacleGrid()
+
+        # Every building the navmesh routes around, mapped to its 4 corner node ids
+        self.obstacles = {}
+
+        # Nodes that were dropped for having no neighbors (e.g. inside a building)
+        # They are brought back if the building on top of them is removed
+        self.dormant_nodes = set()
+
+        # Upper bounds used to find which nodes an incremental update can affect
+        self.max_edge_length = 0
+        self.max_reach = 0
 
     def can_see(self, point1, point2):
         x0, y0 = point1[0], point1[1]
         x1, y1 = point2[0], point2[1]
 
-        buildings_to_check = self.building_quadtree.query((min(x0, x1) - 2 * GRID_SIZE,
-                                                           min(y0, y1) -  2 * GRID_SIZE,
-                                                           max(x0, x1) +  2 * GRID_SIZE,
-                                                           max(y0, y1) +  2 * GRID_SIZE))
-        # Add in the 5 nearest buildings to the query
-        # buildings_to_check = self.building_quadtree.nearest_neighbors(point1, number_of_neighbors=5)
-        # buildings_to_check += self.building_quadtree.nearest_neighbors(point2, number_of_neighbors=5)
-
-        buildings_to_check = [e.item[0] for e in buildings_to_check]
-
-        buildings_to_check = list(set(buildings_to_check))
-
-        for building in buildings_to_check + self.village.wall.get_collision_rects():
-            # print(building.x, building.y, building.rect.width, building.rect.height, type(building))
-            xmin = building.x - defines.GRID_SIZE + 2
-            xmax = building.x + building.rect.width - 2
-            ymin = building.y - defines.GRID_SIZE * 2 + 2
-            ymax = building.y + building.rect.height - 2 - defines.GRID_SIZE
+        bounds = self.obstacle_grid.bounds
+        for obstacle in self.obstacle_grid.query_segment(x0, y0, x1, y1):
+            xmin, xmax, ymin, ymax = bounds[obstacle]
 
             if self.liang_barsky(x0, y0, x1, y1, xmin, xmax, ymin, ymax):
                 return False  # Line of sight is blocked by this building
@@ -96,169 +239,777 @@ class NavMesh:
 
         return True  # Line segment intersects the rectangle
 
-    def generate_building_quadtree(self):
+    def get_obstacle_buildings(self):
+        """
+        All the buildings the villagers have to walk around, including the ones under construction
+        A building being demolished is in both lists, so duplicates are removed
+        """
+        return list(dict.fromkeys(self.village.buildings + [c.building for c in self.village.builder_manager.construction_queue]))
+
+    def get_blocking_bounds(self, building):
+        """
+        The rectangle (xmin, xmax, ymin, ymax) that a building blocks line of sight in
         """
-        Generates a quadtree which holds all the buildings for
+        xmin = building.x - defines.GRID_SIZE + 2
+        xmax = building.x + building.rect.width - 2
+        ymin = building.y - defines.GRID_SIZE * 2 + 2
+        ymax = building.y + building.rect.height - 2 - defines.GRID_SIZE
+        return xmin, xmax, ymin, ymax
+
+    def register_obstacle(self, building):
+        """
+        Adds a building to the obstacle grid right away, e.g. so the building panel can't place anything on top of it
+        """
+        self.obstacle_grid.add(building, self.get_blocking_bounds(building))
+
+    def unregister_obstacle(self, building):
+        self.obstacle_grid.remove(building)
+
+    def generate_obstacle_grid(self, layout):
+        """
+        Generates a spatial hash which holds all the buildings and walls for
         quick lookup for can_see 
         """
-        self.building_quadtree = QuadTree((-defines.WORLD_WIDTH * .25 * defines.GRID_SIZE,
-                                           -defines.WORLD_HEIGHT * .25 * defines.GRID_SIZE,
-                                           defines.WORLD_WIDTH * defines.GRID_SIZE, defines.WORLD_HEIGHT * defines.GRID_SIZE))
+        self.obstacle_grid = ObstacleGrid()
+        for wall in layout.wall_rects:
+            self.obstacle_grid.add(wall, self.get_blocking_bounds(wall))
+
+        for building in layout.buildings:
+            self.register_obstacle(building)
+
+    def get_corner_points(self, building):
+        """
+        The 4 points just outside the corners of the area a building blocks
+        """
+        x, y = building.x, building.y
+        return [(x - 1 - defines.GRID_SIZE, y - 1 - defines.GRID_SIZE * 2),
+                (x + building.rect.width + 1, y - 1 - defines.GRID_SIZE * 2),
+                (x - 1 - defines.GRID_SIZE, y + building.rect.height + 1 - defines.GRID_SIZE),
+                (x + building.rect.width + 1, y + building.rect.height + 1 - defines.GRID_SIZE)]
+
+    def create_node(self, x, y):
+        """
+        Creates a node and adds it to the graph, returns its id
+        """
+        if self.free_ids:
+            node = self.free_ids.pop()
+            self.node_x[node] = x
+            self.node_y[node] = y
+            self.node_reach[node] = 0
+            self.adjacency[node] = {}
+        else:
+            node = len(self.adjacency)
+            self.node_x.append(x)
+            self.node_y.append(y)
+            self.node_reach.append(0)
+            self.adjacency.append({})
+        self.add_node(node)
+        return node
+
+    def add_node(self, node):
+        self.nodes[node] = None
+        self.nodes_quadtree.add(node, (self.node_x[node], self.node_y[node]))
+
+    def unlink_node(self, node):
+        """
+        Takes a node out of the graph and removes every edge that uses it, the id stays reserved
+        """
+        for other in self.adjacency[node]:
+            del self.adjacency[other][node]
+            self.changed_nodes.add(other)
+        self.changed_nodes.add(node)
+        self.adjacency[node] = {}
+        if node in self.nodes:
+            del self.nodes[node]
+            self.nodes_quadtree.delete(node)
+
+    def delete_node(self, node):
+        """
+        Removes a node for good and frees its id
+        """
+        self.unlink_node(node)
+        self.dormant_nodes.discard(node)
+        self.adjacency[node] = None
+        self.free_ids.append(node)
+
+    def connect(self, a, b, cost):
+        # Ensuring all neighbors are recriprocal
+        self.adjacency[a][b] = cost
+        self.adjacency[b][a] = cost
+        self.changed_nodes.add(a)
+        self.changed_nodes.add(b)
+
+    def disconnect(self, a, b):
+        del self.adjacency[a][b]
+        del self.adjacency[b][a]
+        self.changed_nodes.add(a)
+        self.changed_nodes.add(b)
+
+    def get_obstacle_rects(self):
+        """
+        The blocking bounds of every building and wall as an (n, 4) array of xmin, xmax, ymin, ymax
+        """
+        return self.obstacle_grid.get_rects()
 
-        for building in self.village.buildings + [c.building for c in self.village.builder_manager.construction_queue]:
-            # Add each corner of the building to the quadtree
-            # Turning each building a tuple because the quadtree can't store duplicates
-            self.building_quadtree.add((building, 1), (building.x - GRID_SIZE, building.y - GRID_SIZE))
-            self.building_quadtree.add((building, 2), (building.x + building.rect.width + GRID_SIZE, building.y - GRID_SIZE))
-            self.building_quadtree.add((building, 3), (building.x - GRID_SIZE, building.y + building.rect.height + GRID_SIZE))
-            self.building_quadtree.add((building, 4), (building.x + building.rect.width + GRID_SIZE, building.y + building.rect.height + GRID_SIZE))
+    def get_node_points(self, nodes):
+        return np.column_stack((np.take(self.node_x, nodes), np.take(self.node_y, nodes))).astype(np.float64)
+
+    def connect_nodes(self, nodes):
+        """
+        Adds every node each of the given nodes can see, out of its NEAREST_NEIGHBORS nearest, as a neighbor
+        All the candidate edges are line of sight tested in one batch
+        Returns the number of new edges
+        """
+        nodes = np.array([node for node in nodes if node in self.nodes], dtype=np.int64)
+        if len(nodes) == 0:
+            return 0
+
+        all_nodes = np.fromiter(self.nodes, dtype=np.int64, count=len(self.nodes))
+        nearest, distances = visibility.nearest_neighbors(self.get_node_points(all_nodes), self.get_node_points(nodes), NEAREST_NEIGHBORS)
+
+        reach = distances.max(axis=1)
+        for node, node_reach in zip(nodes.tolist(), reach.tolist()):
+            self.node_reach[node] = node_reach
+        self.max_reach = max(self.max_reach, float(reach.max()))
+
+        # Every (node, nearest node) pair once, skipping the node itself and edges that already exist
+        a = np.repeat(nodes, nearest.shape[1])
+        b = all_nodes[nearest.ravel()]
+        distance = distances.ravel()
+        pairs = np.sort(np.column_stack((a, b)), axis=1)
+        _, first = np.unique(pairs, axis=0, return_index=True)
+        first.sort()
+        candidates = [(x, y, d) for x, y, d in zip(a[first].tolist(), b[first].tolist(), distance[first].tolist())
+                      if x != y and y not in self.adjacency[x]]
+        if not candidates:
+            return 0
+
+        a, b, distance = (np.array(column) for column in zip(*candidates))
+        segments = np.column_stack((np.take(self.node_x, a), np.take(self.node_y, a),
+                                    np.take(self.node_x, b), np.take(self.node_y, b)))
+        visible = ~visibility.segments_blocked(segments, self.get_obstacle_rects())
+
+        new_edges = 0
+        for x, y, d in zip(a[visible].tolist(), b[visible].tolist(), distance[visible].tolist()):
+            self.connect(x, y, d)
+            self.max_edge_length = max(self.max_edge_length, d)
+            new_edges += 1
+        return new_edges
+
+    def prune_isolated_nodes(self, nodes):
+        """
+        If a node has no neighbors, remove it and keep it around in case it becomes reachable again
+        """
+        for node in nodes:
+            if node in self.nodes and len(self.adjacency[node]) == 0:
+                self.unlink_node(node)
+                self.dormant_nodes.add(node)
 
-            # Add points in the middle
-            self.building_quadtree.add((building, 5), (building.x + building.rect.width // 2, building.y - GRID_SIZE))
-            self.building_quadtree.add((building, 6), (building.x + building.rect.width // 2, building.y + building.rect.height + GRID_SIZE))
-            self.building_quadtree.add((building, 7), (building.x - GRID_SIZE, building.y + building.rect.height // 2))
-            self.building_quadtree.add((building, 8), (building.x + building.rect.width + GRID_SIZE, building.y + building.rect.height // 2))
+    def query_nodes(self, xmin, xmax, ymin, ymax):
+        return [e.item for e in self.nodes_quadtree.query((xmin, ymin, xmax, ymax))]
 
+    def get_layout(self):
+        return NavLayout(self.get_obstacle_buildings(), self.village.wall)
 
-    def generate_navmesh(self):
+    def generate_navmesh(self, layout=None, publish=True):
         """
-        Generates/updates a navigation mesh for the village
+        Generates a navigation mesh for the village from scratch
+        Use update_obstacles when only buildings have changed
+        :param layout: what to build around, a snapshot of the village as it is now by default
+        :param publish: False leaves the graph unfrozen and the dirt paths alone, for building off the main thread
         """
+        if layout is None:
+            layout = self.get_layout()
 
-        self.generate_building_quadtree()
+        self.generate_obstacle_grid(layout)
 
-        self.nodes = []
+        self.nodes = {}
+        self.node_x = []
+        self.node_y = []
+        self.node_reach = []
+        self.adjacency = []
+        self.free_ids = []
         self.nodes_quadtree = QuadTree((-defines.WORLD_WIDTH * .25 * defines.GRID_SIZE,
                                          -defines.WORLD_HEIGHT * .25 * defines.GRID_SIZE,
                                          defines.WORLD_WIDTH * defines.GRID_SIZE, defines.WORLD_HEIGHT * defines.GRID_SIZE))
+        self.obstacles = {}
+        self.dormant_nodes = set()
+        self.hierarchy = hierarchy.ClusterHierarchy()
+        self.changed_nodes = set()
+        self.unabstracted_nodes = set()
+        self.max_edge_length = 0
+        self.max_reach = 0
+        self.incremental_changes = 0
+
+        # The same layout always makes the same navmesh, so it might already be on disk
+        key = None
+        if defines.use_navmesh_cache:
+            key = navmesh_cache.layout_key(layout, self.get_blocking_bounds, self.get_cache_settings())
+            state = navmesh_cache.load(key)
+            if state is not None:
+                self.restore_state(state, layout)
+                if publish:
+                    self.on_navmesh_change()
+                    self.rebuilt_version = self.version
+                return
 
         # Adds some basic nodes to the navmesh
         for x in range(int(-defines.WORLD_WIDTH * defines.GRID_SIZE * .25),
-                        defines.WORLD_WIDTH * defines.GRID_SIZE, defines.GRID_SIZE * 15):
+                        defines.WORLD_WIDTH * defines.GRID_SIZE, defines.GRID_SIZE * FILLER_NODE_SPACING):
             for y in range(int(-defines.WORLD_HEIGHT * defines.GRID_SIZE * .25),
-                            defines.WORLD_HEIGHT * defines.GRID_SIZE, defines.GRID_SIZE * 15):
-                new_node = Node(x, y)
-                self.nodes.append(new_node)
-                self.nodes_quadtree.add(new_node, (x, y))
+                            defines.WORLD_HEIGHT * defines.GRID_SIZE, defines.GRID_SIZE * FILLER_NODE_SPACING):
+                self.create_node(x, y)
 
         # Add the wall nodes
-        for node in self.village.wall.outer_corner_nodes:
-            n = copy.deepcopy(node)
-            self.nodes.append(n)
-            self.nodes_quadtree.add(n, (n.x, n.y))
-        wall_node = copy.deepcopy(self.village.wall.hole_node)
-        self.nodes.append(wall_node)
-        self.nodes_quadtree.add(wall_node, (wall_node.x, wall_node.y))
-
-        
+        for x, y in layout.wall_nodes:
+            self.create_node(x, y)
+
         # For every building, add the 4 corners as nodes
-        for building in self.village.buildings + [c.building for c in self.village.builder_manager.construction_queue]:
-            x, y = building.x, building.y
-            n1 = Node(x - 1 - defines.GRID_SIZE, y - 1 - defines.GRID_SIZE * 2)
-            n2 = Node(x + building.rect.width + 1, y - 1 - defines.GRID_SIZE * 2)
-            n3 = Node(x - 1 - defines.GRID_SIZE, y + building.rect.height + 1 - defines.GRID_SIZE)
-            n4 = Node(x + building.rect.width + 1, y + building.rect.height + 1 - defines.GRID_SIZE)
-            for n in [n1, n2, n3, n4]:
-                self.nodes_quadtree.add(n, (n.x, n.y))
-                self.nodes.append(n)
+        for building in layout.buildings:
+            self.obstacles[building] = [self.create_node(x, y) for x, y in self.get_corner_points(building)]
 
         # For every node, add all the nodes it can see as neighbors
-        total_neighbors = 0
-        for i, node in enumerate(self.nodes):
-            for other_element in self.nodes_quadtree.nearest_neighbors((node.x, node.y), number_of_neighbors=10):
-                other_node = other_element.item
-                other_point = other_element.point
-                if node == other_node:
-                    continue
-                distance_sq = (node.x - other_point[0]) ** 2 + (node.y - other_point[1]) ** 2
-                if self.can_see((node.x, node.y), other_point):
-                    other_node_index = self.nodes.index(other_node)
-                    distance = distance_sq ** 0.5
-
-                    # Ensuring all neighbors are recriprocal
-                    self.nodes[i].add_neighbor(self.nodes[other_node_index], distance)
-                    self.nodes[other_node_index].add_neighbor(self.nodes[i], distance)
-                    total_neighbors += 1
-
-        # If a node has no neighbors, remove it
-        nodes_to_remove = [node for node in self.nodes if len(node.neighbors) == 0]
-        for node in nodes_to_remove:
-            self.nodes.remove(node)
-            self.nodes_quadtree.delete(node)
+        self.connect_nodes(list(self.nodes))
+
+        self.prune_isolated_nodes(list(self.nodes))
 
-        self.village.dirt_path.on_navmesh_change({node: node.neighbors for node in self.nodes})
+        if key is not None:
+            navmesh_cache.save(key, self, layout)
 
-    def find_path_a_star(self, start_pnt, end_pnt):
+        if publish:
+            self.on_navmesh_change()
+            self.rebuilt_version = self.version
+
+    def get_cache_settings(self):
         """
-        Finds a path from start to end using the A* algorithm
+        Everything besides the layout that changes the generated navmesh, part of the cache key so changing any
+        of them never loads a navmesh generated with the old values
+        """
+        return NEAREST_NEIGHBORS, CORNER_OFFSET, FILLER_NODE_SPACING
+
+    def restore_state(self, state, layout):
+        """
+        Fills in the navmesh from a state loaded by navmesh_cache, the obstacle grid has to be generated already
+        """
+        offsets, targets, costs = state["offsets"], state["targets"], state["costs"]
+        self.node_x = state["node_x"]
+        self.node_y = state["node_y"]
+        self.node_reach = state["node_reach"]
+        self.adjacency = [dict(zip(targets[offsets[i]:offsets[i + 1]], costs[offsets[i]:offsets[i + 1]])) if used else None
+                          for i, used in enumerate(state["used"])]
+        self.free_ids = state["free_ids"]
+        self.dormant_nodes = set(state["dormant_nodes"])
+        self.max_edge_length = state["max_edge_length"]
+        self.max_reach = state["max_reach"]
+
+        for node in state["nodes"]:
+            self.add_node(node)
+
+        corners = state["corners"]
+        self.obstacles = {building: corners[i * 4:i * 4 + 4] for i, building in enumerate(layout.buildings)}
+
+    def build_in_background(self, layout):
+        """
+        Runs on the build thread, any error is kept for the main thread to report
         """
+        try:
+            self.generate_navmesh(layout, publish=False)
+        except Exception as error:
+            self.build_error = error
+
+    def start_background_build(self):
+        """
+        Rebuilds the navmesh from scratch on another thread, from a snapshot of the buildings and wall taken now
+        The current graph keeps answering path requests until check_background_build swaps the new one in
+        """
+        if self.build_thread is not None:
+            self.rebuild_pending = True  # Start again once this one is done
+            return
+
+        self.builder = NavMesh(self.village)
+        self.build_thread = threading.Thread(target=self.builder.build_in_background, args=(self.get_layout(),), daemon=True)
+        self.build_thread.start()
+
+    def is_building(self):
+        return self.build_thread is not None
+
+    def check_background_build(self):
+        """
+        Called every frame, swaps in the navmesh from the build thread once it is done
+        If the build failed the error is logged and the navmesh is generated again here instead
+        """
+        if self.build_thread is None or self.build_thread.is_alive():
+            return
+
+        self.build_thread.join()
+        builder = self.builder
+        self.build_thread = None
+        self.builder = None
+        if builder.build_error is not None:
+            error = builder.build_error
+            logger.error("Building the navmesh in the background failed, generating it in the game loop instead",
+                         exc_info=(type(error), error, error.__traceback__))
+            self.rebuild_pending = False
+            self.generate_navmesh()
+            return
+
+        # Take over everything the build made, the graph isn't frozen until the swap below
+        for name in ("nodes", "node_x", "node_y", "node_reach", "adjacency", "free_ids", "nodes_quadtree",
+                     "obstacle_grid", "obstacles", "dormant_nodes", "max_edge_length", "max_reach"):
+            setattr(self, name, getattr(builder, name))
+        self.hierarchy = hierarchy.ClusterHierarchy()
+        self.changed_nodes = set()
+        self.unabstracted_nodes = set()
+        self.incremental_changes = 0
+
+        # Buildings placed or removed while the thread was running
+        self.update_obstacles(publish=False)
+
+        # The graph and the dirt paths change together, in between two frames
+        self.on_navmesh_change()
+        self.rebuilt_version = self.version
+
+        if self.rebuild_pending:
+            self.rebuild_pending = False
+            self.start_background_build()
+
+    def add_obstacle(self, building, publish=True):
+        """
+        Adds a building to the navmesh without regenerating it
+        Only the edges passing through the building are cut and only the nodes around it are reconnected
+
+        :param publish: Freeze the graph and redraw the dirt path afterwards, pass False when batching changes
+        """
+        if building in self.obstacles:
+            return
 
+        self.register_obstacle(building)
+        xmin, xmax, ymin, ymax = self.get_blocking_bounds(building)
+
+        # Any edge crossing the building has both of its nodes within max_edge_length of it
+        affected_nodes = set()
+        reach = self.max_edge_length
+        for node in self.query_nodes(xmin - reach, xmax + reach, ymin - reach, ymax + reach):
+            x, y = self.node_x[node], self.node_y[node]
+            for other in list(self.adjacency[node]):
+                if self.liang_barsky(x, y, self.node_x[other], self.node_y[other], xmin, xmax, ymin, ymax):
+                    self.disconnect(node, other)
+                    affected_nodes.add(node)
+                    affected_nodes.add(other)
+
+        corners = [self.create_node(x, y) for x, y in self.get_corner_points(building)]
+        self.obstacles[building] = corners
+
+        # The nodes near the new corners might now have them as one of their nearest neighbors, or be one of theirs
+        all_nodes = np.fromiter(self.nodes, dtype=np.int64, count=len(self.nodes))
+        nearest, _ = visibility.nearest_neighbors(self.get_node_points(all_nodes), self.get_node_points(corners), NEAREST_NEIGHBORS)
+        affected_nodes.update(all_nodes[nearest.ravel()].tolist())
+        affected_nodes.update(self.get_nodes_reaching(corners))
+
+        self.connect_nodes(corners + list(affected_nodes))
+
+        self.prune_isolated_nodes(corners + list(affected_nodes))
+
+        if publish:
+            self.on_navmesh_change()
+
+    def remove_obstacle(self, building, publish=True):
+        """
+        Removes a building from the navmesh without regenerating it
+        Only the nodes that could have been looking through the building are reconnected
+
+        :param publish: Freeze the graph and redraw the dirt path afterwards, pass False when batching changes
+        """
+        corners = self.obstacles.pop(building, None)
+        if corners is None:
+            return
+
+        self.unregister_obstacle(building)
+        xmin, xmax, ymin, ymax = self.get_blocking_bounds(building)
+
+        affected_nodes = set()
+        for corner in corners:
+            affected_nodes.update(self.adjacency[corner])
+            self.delete_node(corner)
+        affected_nodes.difference_update(corners)
+
+        # A node could only have been blocked by the building, or had one of its corners as a nearest neighbor,
+        # if the building and its corners are within its reach
+        xmin, ymin = xmin - CORNER_OFFSET, ymin - CORNER_OFFSET
+        xmax, ymax = xmax + CORNER_OFFSET, ymax + CORNER_OFFSET
+        reach = self.max_reach
+        for node in self.query_nodes(xmin - reach, xmax + reach, ymin - reach, ymax + reach):
+            x, y = self.node_x[node], self.node_y[node]
+            dx = max(xmin - x, 0, x - xmax)
+            dy = max(ymin - y, 0, y - ymax)
+            if dx ** 2 + dy ** 2 <= (self.node_reach[node] + 1e-6) ** 2:
+                affected_nodes.add(node)
+
+        # Bring back the nodes that were covered by the building
+        for node in list(self.dormant_nodes):
+            if xmin <= self.node_x[node] <= xmax and ymin <= self.node_y[node] <= ymax:
+                self.dormant_nodes.remove(node)
+                self.add_node(node)
+                affected_nodes.add(node)
+
+        self.connect_nodes(affected_nodes)
+
+        self.prune_isolated_nodes(affected_nodes)
+
+        if publish:
+            self.on_navmesh_change()
+
+    def get_nodes_reaching(self, points):
+        """
+        The nodes that have one of points within their reach, so it would be one of their nearest neighbors
+        """
+        nodes = set()
+        reach = self.max_reach
+        for node in points:
+            px, py = self.node_x[node], self.node_y[node]
+            for other in self.query_nodes(px - reach, px + reach, py - reach, py + reach):
+                if (self.node_x[other] - px) ** 2 + (self.node_y[other] - py) ** 2 <= (self.node_reach[other] + 1e-6) ** 2:
+                    nodes.add(other)
+        return nodes
+
+    def update_obstacles(self, publish=True):
+        """
+        Brings the navmesh up to date with the village's buildings, only adding and removing what changed
+        Lots of changes at once, or every REBUILD_INTERVAL changes, are left to a rebuild in the background
+        """
+        if self.nodes is None:
+            self.generate_navmesh()
+            return
+
+        if publish and self.is_building():
+            return  # The swap catches up on these when the build is done
+
+        current_buildings = self.get_obstacle_buildings()
+        current_set = set(current_buildings)
+        removed = [building for building in self.obstacles if building not in current_set]
+        added = [building for building in current_buildings if building not in self.obstacles]
+
+        changes = len(removed) + len(added)
+        if publish and (changes > MAX_INCREMENTAL_CHANGES or self.incremental_changes + changes > REBUILD_INTERVAL):
+            self.start_background_build()
+            return
+
+        for building in removed:
+            self.remove_obstacle(building, publish=False)
+        for building in added:
+            self.add_obstacle(building, publish=False)
+        self.incremental_changes += changes
+
+        if publish and (removed or added):
+            self.on_navmesh_change()
+
+    def freeze_graph(self):
+        """
+        Packs the graph into a NavGraph for the villagers to walk on
+        """
+        self.graph = NavGraph(self.node_x, self.node_y, self.adjacency)
+        self.version += 1
+        self.unabstracted_nodes |= self.changed_nodes
+        self.changed_nodes = set()
+
+    def on_navmesh_change(self):
+        self.freeze_graph()
+        self.village.dirt_path.on_navmesh_change(self.graph)
+
+    def get_hub_points(self):
+        """
+        Destinations shared by many villagers: the ore exit, the river, the hole in the wall
+        and every edge of the lumbermills and mines (the spots Villager.get_random_building_edge picks from)
+        """
+        points = [destinations.get_ore_exit(), destinations.get_river(),
+                  (self.village.wall.hole_node.x, self.village.wall.hole_node.y)]
+        for building in self.village.buildings:
+            if building.name in destinations.HUB_BUILDINGS:
+                points.extend(destinations.get_building_edges(building))
+        return points
+
+    def get_hub_nodes(self):
+        """
+        The graph nodes the hub points snap to
+        """
+        if self.hubs_version != self.version:
+            self.flow_fields = {}
+            self.hub_nodes = {self.snap_to_graph(point) for point in self.get_hub_points()}
+            self.hub_nodes.discard(None)
+            self.hubs_version = self.version
+        return self.hub_nodes
+
+    def get_flow_field(self, target):
+        """
+        The flow field toward a node, built the first time it is needed for the current version of the graph
+        """
+        if self.hubs_version != self.version:
+            self.get_hub_nodes()
+        field = self.flow_fields.get(target)
+        if field is None:
+            field = self.flow_fields[target] = FlowField(self.graph, target)
+        return field
+
+    def get_nearest_nodes(self, x, y, count):
+        """
+        Ids of the count nodes of the frozen graph closest to (x, y), nearest first
+        """
+        graph = self.graph
+        distances = (np.frombuffer(graph.xs) - x) ** 2 + (np.frombuffer(graph.ys) - y) ** 2
+        distances[np.frombuffer(graph.active, dtype=np.uint8) == 0] = np.inf
+        count = min(count, len(distances))
+        if count == 0:
+            return []
+        nearest = np.argpartition(distances, count - 1)[:count]
+        nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+        return nearest[np.isfinite(distances[nearest])].tolist()
+
+    def get_cell_nodes(self, cell):
+        """
+        The nodes seen from the centre of a grid cell, nearest first, looked up once per cell for each version of the graph
+        """
+        if self.snap_version != self.version:
+            self.snap_table = {}
+            self.snap_version = self.version
+
+        nodes = self.snap_table.get(cell)
+        if nodes is None:
+            graph = self.graph
+            center = ((cell[0] + .5) * GRID_SIZE, (cell[1] + .5) * GRID_SIZE)
+            nodes = self.snap_table[cell] = [node for node in self.get_nearest_nodes(center[0], center[1], SNAP_SEARCH_SIZE)
+                                             if self.can_see(center, (graph.xs[node], graph.ys[node]))][:SNAP_CANDIDATES]
+        return nodes
+
+    def snap_to_graph(self, point):
+        """
+        The graph node a path from or to point starts or ends at: the nearest one that point can see
+        Usually one of the nodes stored for its cell, cells are only filled in as they are first used.
+        When none of those are in sight the nodes nearest the point itself are checked, and failing that it falls
+        back to the nearest node, e.g. for a point inside a building. Returns None if the graph has no nodes at all
+        """
+        graph = self.graph
+        nodes = self.get_cell_nodes((math.floor(point[0] / GRID_SIZE), math.floor(point[1] / GRID_SIZE)))
+        for node in nodes:
+            if self.can_see(point, (graph.xs[node], graph.ys[node])):
+                return node
+        # The point is tucked away somewhere the centre of its cell can't see, look around the point itself
+        nearest = self.get_nearest_nodes(point[0], point[1], SNAP_SEARCH_SIZE)
+        for node in nearest:
+            if self.can_see(point, (graph.xs[node], graph.ys[node])):
+                return node
+        return nearest[0] if nearest else None
+
+    def get_components(self):
+        """
+        The component label of every node id for the current version of the graph
+        """
+        if self.components_version != self.version:
+            self.components = find_components(self.graph)
+            self.components_version = self.version
+        return self.components
+
+    def can_reach(self, start, end):
+        """
+        Whether there is any path between two nodes, without searching for it
+        """
+        components = self.get_components()
+        return components[start] == components[end]
+
+    def find_path(self, start_pnt, end_pnt):
+        """
+        Finds a path from start to end with the backend picked in defines.pathfinding_backend
+        Either way it is smoothed into a deque of Nodes from start to end, or None with failure_reason saying why
+        """
+        if defines.pathfinding_backend == "jps":
+            backend = self.get_jump_point_search()
+            path = backend.find_path(start_pnt, end_pnt)
+            self.failure_reason = backend.failure_reason
+            return self.smooth_path(path) if path is not None else None
+        path = self.find_path_a_star(start_pnt, end_pnt)
+        return self.smooth_ends(path) if path is not None else None
+
+    def smooth_path(self, path):
+        """
+        String pulls a path down to the waypoints it can't walk straight past
+        Returns a deque, villagers take the waypoints off the front as they reach them
+        """
+        return deque(path[i] for i in self.get_smoothed_indices(path))
+
+    def smooth_node_path(self, node_path, graph=None):
+        """
+        smooth_path for the node ids of a path on graph (the current one by default), None stays None
+        """
+        if node_path is None:
+            return None
+        if graph is None:
+            graph = self.graph
+        path = [Node(graph.xs[node], graph.ys[node]) for node in node_path]
+        return tuple(node_path[i] for i in self.get_smoothed_indices(path))
+
+    def smooth_ends(self, path):
+        """
+        smooth_path for a path whose graph part is smoothed already, only the start and end points are joined on
+        """
+        last = len(path) - 1
+        if last < 2:
+            return deque(path)
+        first = self.get_furthest_in_sight(path, 0)
+        if first == last:
+            return deque((path[0], path[last]))
+
+        # The earliest of the waypoints before the end that can walk straight to it
+        end = (path[last].x, path[last].y)
+        join = last - 1
+        for behind in range(max(last - SMOOTHING_LOOKAHEAD, first), last - 1):
+            if self.can_see((path[behind].x, path[behind].y), end):
+                join = behind
+                break
+        return deque([path[0]] + path[first:join + 1] + [path[last]])
+
+    def get_smoothed_indices(self, path):
+        """
+        Indices of the waypoints smooth_path keeps, each one is the furthest in sight of the one before
+        """
+        indices = [0]
+        while indices[-1] < len(path) - 1:
+            indices.append(self.get_furthest_in_sight(path, indices[-1]))
+        return indices
+
+    def get_furthest_in_sight(self, path, current):
+        """
+        Index of the furthest of the next SMOOTHING_LOOKAHEAD waypoints that the one at current can walk straight to
+        Only the obstacles in the grid cells along each line are tested, the next waypoint is joined by the path already
+        """
+        point = (path[current].x, path[current].y)
+        for ahead in range(min(current + SMOOTHING_LOOKAHEAD, len(path) - 1), current + 1, -1):
+            if self.can_see(point, (path[ahead].x, path[ahead].y)):
+                return ahead
+        return current + 1
+
+    def get_jump_point_search(self):
+        if self.jump_point_search_version != self.version:
+            self.jump_point_search = JumpPointSearch(self.obstacle_grid)
+            self.jump_point_search_version = self.version
+        return self.jump_point_search
+
+    def find_path_a_star(self, start_pnt, end_pnt, use_cache=True):
+        """
+        Finds a path from start to end using the A* algorithm
+        The graph part of the path is smoothed and cached until the navmesh changes, see find_known_path
+        Returns None if there is no path, failure_reason then says why
+        """
         # Find the nodes closest to the start and end points that can be seen
-        start = self.nodes_quadtree.nearest_neighbors(start_pnt, number_of_neighbors=1)[0].item
-        end = self.nodes_quadtree.nearest_neighbors(end_pnt, number_of_neighbors=1)[0].item
-
-        open_list = [start]
-        closed_list = []
-        came_from = {start: None}  # Dictionary to store the parent of each node
-        g_score = {node: float('inf') for node in self.nodes}  # Dictionary to store the cost of the cheapest path from start to node
-        g_score[start] = 0
-        h_score = {node: ((node.x - end.x) ** 2 + (node.y - end.y) ** 2) ** 0.5 for node in self.nodes}  # Dictionary to store the heuristic cost from node to end
-
-        while open_list:
-            current = min(open_list, key=lambda node: g_score[node] + h_score[node])
-            if current == end:  # Path found
-
-                # Build the path using the came_from dictionary
-                path = []
-                while current is not None:
-                    path.append(current)
-                    current = came_from[current]
-                path = path[::-1]
-                # Add the true end point to the path
-                path.append(Node(end_pnt[0], end_pnt[1]))
-                
-                # Add the true start point to the path
-                path.insert(0, Node(start_pnt[0], start_pnt[1]))
-                return path
-
-            open_list.remove(current)
-            closed_list.append(current)
-
-            for neighbor in current.neighbors:
-                if neighbor.node in closed_list:
-                    continue
-                tentative_g_score = g_score[current] + neighbor.cost  # Get the potential g_score for this node
-                if neighbor.node not in open_list:  # If the neighbor is not in the open list, add it
-                    open_list.append(neighbor.node)
-                elif tentative_g_score >= g_score[neighbor.node]:  # Don't use the g_score if it's worse than the current one
-                    continue
-                
-                # If the g_score is better, than update the came_from and g_score dictionaries
-                came_from[neighbor.node] = current
-                g_score[neighbor.node] = tentative_g_score
-
-        return None  # No path found
+        start = self.snap_to_graph(start_pnt)
+        end = self.snap_to_graph(end_pnt)
+
+        if start is None or end is None:
+            self.failure_reason = NO_PATH
+            return None
+        if not self.can_reach(start, end):
+            self.failure_reason = WALLED_OFF
+            return None
+
+        if use_cache:
+            found, node_path = self.find_known_path(start, end)
+            if not found:
+                node_path = self.remember_path(start, end, self.find_node_path(start, end))
+        else:
+            node_path = self.smooth_node_path(self.find_node_path(start, end))
+
+        return self.to_path(node_path, start_pnt, end_pnt)
+
+    def find_known_path(self, start, end):
+        """
+        Paths that don't need a search: the path cache, or the shared flow field when going to a hub
+        Returns (True, smoothed node ids or None) if the path is known, otherwise (False, None)
+        """
+        found, node_path = self.path_cache.get(start, end, self.version)
+        if not found and end in self.get_hub_nodes():
+            # Lots of villagers walk here, follow the shared flow field instead of searching
+            return True, self.remember_path(start, end, self.get_flow_field(end).path_from(start))
+        return found, node_path
+
+    def remember_path(self, start, end, node_path):
+        """
+        Smooths the node ids of a path on the current graph and caches them, returns the smoothed ids
+        """
+        node_path = self.smooth_node_path(node_path)
+        self.path_cache.put(start, end, self.version, node_path)
+        return node_path
+
+    def to_path(self, node_path, start_pnt, end_pnt, graph=None):
+        """
+        Turns node ids from graph (the current one by default) into a list of Nodes from start_pnt to end_pnt
+        Returns None if node_path is None
+        """
+        if node_path is None:
+            self.failure_reason = NO_PATH
+            return None
+        if graph is None:
+            graph = self.graph
+
+        # A fresh list every time, the villagers pop nodes off of their paths
+        path = [Node(graph.xs[node], graph.ys[node]) for node in node_path]
+        # Add the true start and end points to the path
+        path.insert(0, Node(start_pnt[0], start_pnt[1]))
+        path.append(Node(end_pnt[0], end_pnt[1]))
+        return path
+
+    def get_hierarchy(self):
+        """
+        The cluster hierarchy, only the clusters that changed since it was last used are worked out again
+        """
+        if self.hierarchy.version != self.version:
+            self.hierarchy.update(self.graph, self.unabstracted_nodes)
+            self.hierarchy.version = self.version
+            self.unabstracted_nodes = set()
+        return self.hierarchy
+
+    def find_node_path(self, start, end):
+        """
+        Long trips on big graphs are searched hierarchically, everything else with a plain A*
+        """
+        return self.search_hierarchy(start, end) or self.search_path(start, end)
+
+    def search_hierarchy(self, start, end):
+        """
+        Returns the node ids of a path through the cluster hierarchy, or None if the trip is too short for it,
+        the hierarchy couldn't find one or the compiled A* is in use
+        """
+        # The compiled A* is several times faster than the hierarchy and finds shorter paths
+        if not kernels.enabled() and len(self.graph) >= hierarchy.MIN_NODES:
+            clusters = self.get_hierarchy()
+            if clusters.is_long_trip(start, end):
+                # The few transitions kept between clusters don't always connect everything, None means check properly
+                return clusters.find_path(start, end)
+        return None
+
+    def search_path(self, start, end):
+        """
+        A* between two node ids of the graph
+        Returns a tuple of the node ids on the path, or None if end can't be reached
+        """
+        search = kernels.search_graph if kernels.enabled() else search_graph
+        return search(self.graph, start, end)
 
     def draw(self, surface):
         """
         Draws the navigation mesh on the screen
         """
-        if self.nodes is None:
+        if self.graph is None:
             return
 
-        # all_bbox = self.nodes_quadtree.get_all_bbox()
-        all_bbox = self.building_quadtree.get_all_bbox()
-        for bbox in all_bbox:
-            pygame.draw.rect(surface, (255, 0, 0), (bbox[0] - defines.camera_x, bbox[1] - defines.camera_y, bbox[2] - bbox[0], bbox[3] - bbox[1]), 2)
+        # Draw the area each building and wall blocks
+        for xmin, xmax, ymin, ymax in self.obstacle_grid.bounds.values():
+            pygame.draw.rect(surface, (255, 0, 0), (xmin - defines.camera_x, ymin - defines.camera_y, xmax - xmin, ymax - ymin), 2)
 
         # Draw the villager routes
-        for node in self.nodes:
-            for neighbor in node.neighbors:
-                pygame.draw.line(surface, (0, 255, 0), (node.x - defines.camera_x, node.y - defines.camera_y), (neighbor.node.x - defines.camera_x, neighbor.node.y - defines.camera_y))
-            pygame.draw.circle(surface, (0, 255, 0), (node.x - defines.camera_x, node.y - defines.camera_y), 5)
+        xs, ys = self.graph.xs, self.graph.ys
+        for a, b in self.graph.edges():
+            pygame.draw.line(surface, (0, 255, 0), (xs[a] - defines.camera_x, ys[a] - defines.camera_y), (xs[b] - defines.camera_x, ys[b] - defines.camera_y))
+        for node in self.graph.nodes():
+            pygame.draw.circle(surface, (0, 255, 0), (xs[node] - defines.camera_x, ys[node] - defines.camera_y), 5)
         # Draw the building corners  
-        for point in [v.point for v in self.building_quadtree.get_all_elements()]:
-            node = Node(point[0], point[1])
-            pygame.draw.circle(surface, (0, 255, 255), (node.x - defines.camera_x, node.y - defines.camera_y), 5)
-            for neighbor in node.neighbors:
-                pygame.draw.line(surface, (0, 0, 255), (node.x - defines.camera_x, node.y - defines.camera_y), (neighbor.node.x - defines.camera_x, neighbor.node.y - defines.camera_y))
+        for corners in self.obstacles.values():
+            for node in corners:
+                pygame.draw.circle(surface, (0, 255, 255), (self.node_x[node] - defines.camera_x, self.node_y[node] - defines.camera_y), 5)
@@ -0,0 +1,174 @@
+"""
+Saves generated navmeshes to disk so the same village layout never has to be generated twice
+Files are named after a hash of the layout and the navmesh's settings, and read back with mmap
+
+File layout, all little endian:
+    header: magic, format version, id count, edge count, free id count, dormant count, active count, obstacle count,
+            max edge length, max reach
+    float64 x, y and reach of every node id
+    int64 CSR offsets (id count + 1) and targets, float64 costs
+    int64 free ids, dormant ids, active ids in order, 4 corner ids per obstacle
+    uint8 1 for every id that is in use
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+
+from config import defines
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"VNAV"
+
+# Bump whenever the file layout or the way the navmesh is generated changes, older files are then rebuilt
+# Changes to the navmesh's constants and defines don't need a bump, they are part of the key
+FORMAT_VERSION = 4
+
+HEADER = struct.Struct("<4sI6Q2d")
+
+# Only the most recently used files are kept
+MAX_CACHE_FILES = 32
+
+
+def layout_key(layout, get_blocking_bounds, settings):
+    """
+    Hash of everything the generated navmesh depends on
+    :param settings: the numbers that change how the navmesh is generated, see NavMesh.get_cache_settings
+    """
+    numbers = [FORMAT_VERSION, defines.GRID_SIZE, defines.WORLD_WIDTH, defines.WORLD_HEIGHT, len(settings)]
+    numbers.extend(settings)
+    numbers.extend((len(layout.wall_rects), len(layout.buildings)))
+    for rect in layout.wall_rects:
+        numbers.extend((rect.x, rect.y, rect.width, rect.height))
+        numbers.extend(get_blocking_bounds(rect))
+    for x, y in layout.wall_nodes:
+        numbers.extend((x, y))
+    for building in layout.buildings:
+        numbers.extend((building.x, building.y, building.rect.width, building.rect.height))
+        numbers.extend(get_blocking_bounds(building))
+    return hashlib.sha256(np.array(numbers, dtype=np.float64).tobytes()).hexdigest()[:32]
+
+
+def get_path(key):
+    return os.path.join(defines.NAVMESH_CACHE_DIR, f"navmesh_{key}.bin")
+
+
+def save(key, navmesh, layout):
+    """
+    Writes the navmesh's build state to the cache, the file is swapped in whole so readers never see half of it
+    The navmesh works the same without the cache, so a cache directory that can't be written to is only logged
+    """
+    adjacency = navmesh.adjacency
+    used = np.array([neighbors is not None for neighbors in adjacency], dtype=np.uint8)
+    offsets = [0]
+    targets = []
+    costs = []
+    for neighbors in adjacency:
+        if neighbors:
+            targets.extend(neighbors.keys())
+            costs.extend(neighbors.values())
+        offsets.append(len(targets))
+
+    corners = [node for building in layout.buildings for node in navmesh.obstacles[building]]
+    active = list(navmesh.nodes)
+    dormant = sorted(navmesh.dormant_nodes)
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(adjacency), len(targets), len(navmesh.free_ids), len(dormant),
+                         len(active), len(layout.buildings), navmesh.max_edge_length, navmesh.max_reach)
+    chunks = [header,
+              np.array(navmesh.node_x, dtype="<f8").tobytes(),
+              np.array(navmesh.node_y, dtype="<f8").tobytes(),
+              np.array(navmesh.node_reach, dtype="<f8").tobytes(),
+              np.array(offsets, dtype="<i8").tobytes(),
+              np.array(targets, dtype="<i8").tobytes(),
+              np.array(costs, dtype="<f8").tobytes(),
+              np.array(navmesh.free_ids, dtype="<i8").tobytes(),
+              np.array(dormant, dtype="<i8").tobytes(),
+              np.array(active, dtype="<i8").tobytes(),
+              np.array(corners, dtype="<i8").tobytes(),
+              used.tobytes()]
+
+    path = get_path(key)
+    # The build thread and the game loop can both be saving at once
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(defines.NAVMESH_CACHE_DIR, exist_ok=True)
+        with open(temp_path, "wb") as file:
+            file.write(b"".join(chunks))
+        os.replace(temp_path, path)
+    except OSError as error:
+        logger.warning("Couldn't save the navmesh to %s: %s", defines.NAVMESH_CACHE_DIR, error)
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return
+
+    prune()
+
+
+def load(key):
+    """
+    Reads a cached navmesh, returns None if there isn't one or it is from an older format
+    The arrays are copied out of the mapping so the file is closed again straight away
+    """
+    try:
+        file = open(get_path(key), "rb")
+    except OSError:
+        return None
+
+    with file:
+        size = os.fstat(file.fileno()).st_size
+        if size < HEADER.size:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            magic, version, id_count, edge_count, free_count, dormant_count, active_count, obstacle_count, \
+                max_edge_length, max_reach = HEADER.unpack_from(buffer)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                return None
+
+            sections = [("node_x", "<f8", id_count), ("node_y", "<f8", id_count), ("node_reach", "<f8", id_count),
+                        ("offsets", "<i8", id_count + 1), ("targets", "<i8", edge_count), ("costs", "<f8", edge_count),
+                        ("free_ids", "<i8", free_count), ("dormant_nodes", "<i8", dormant_count),
+                        ("nodes", "<i8", active_count), ("corners", "<i8", obstacle_count * 4), ("used", "<u1", id_count)]
+            expected_size = HEADER.size + sum(np.dtype(dtype).itemsize * count for _, dtype, count in sections)
+            if size != expected_size:
+                return None  # Cut short or written by something else
+
+            state = {"max_edge_length": max_edge_length, "max_reach": max_reach}
+            offset = HEADER.size
+            for name, dtype, count in sections:
+                state[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).tolist()
+                offset += np.dtype(dtype).itemsize * count
+
+    # Touch the file so pruning keeps the layouts that are actually used
+    try:
+        os.utime(get_path(key))
+    except OSError:
+        pass
+    return state
+
+
+def prune():
+    """
+    Deletes the least recently used files once there are more than MAX_CACHE_FILES
+    """
+    try:
+        names = [name for name in os.listdir(defines.NAVMESH_CACHE_DIR) if name.startswith("navmesh_") and name.endswith(".bin")]
+    except OSError:
+        return
+    if len(names) <= MAX_CACHE_FILES:
+        return
+
+    paths = sorted((os.path.join(defines.NAVMESH_CACHE_DIR, name) for name in names), key=os.path.getmtime)
+    for path in paths[:-MAX_CACHE_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,146 @@
+"""
+A uniform grid spatial hash for everything villagers have to walk around
+The cells line up with the GRID_SIZE building grid, so each building only covers a handful of cells
+"""
+
+import math
+
+import numpy as np
+
+from config.defines import GRID_SIZE
+
+
+class ObstacleGrid:
+    """
+    Each obstacle is stored once with its blocking bounds (xmin, xmax, ymin, ymax)
+    and referenced from every cell those bounds cover
+    """
+    def __init__(self, cell_size=GRID_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}  # (cell x, cell y) -> list of obstacles
+        self.bounds = {}  # obstacle -> (xmin, xmax, ymin, ymax)
+        self.rects_array = None  # Cached (n, 4) array of all the bounds
+
+    def __contains__(self, obstacle):
+        return obstacle in self.bounds
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def cell_range(self, xmin, xmax, ymin, ymax):
+        """
+        The inclusive range of cells (cx0, cx1, cy0, cy1) a rectangle covers
+        """
+        size = self.cell_size
+        return math.floor(xmin / size), math.floor(xmax / size), math.floor(ymin / size), math.floor(ymax / size)
+
+    def add(self, obstacle, bounds):
+        if obstacle in self.bounds:
+            return
+        self.bounds[obstacle] = bounds
+        cx0, cx1, cy0, cy1 = self.cell_range(*bounds)
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                self.cells.setdefault((cx, cy), []).append(obstacle)
+        self.rects_array = None
+
+    def remove(self, obstacle):
+        bounds = self.bounds.pop(obstacle, None)
+        if bounds is None:
+            return
+        cx0, cx1, cy0, cy1 = self.cell_range(*bounds)
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self.cells[(cx, cy)]
+                cell.remove(obstacle)
+                if not cell:
+                    del self.cells[(cx, cy)]
+        self.rects_array = None
+
+    def get_rects(self):
+        """
+        The bounds of every obstacle as an (n, 4) array for the batched visibility tests
+        """
+        if self.rects_array is None:
+            self.rects_array = np.array(list(self.bounds.values()), dtype=np.float64).reshape(-1, 4)
+        return self.rects_array
+
+    def query_cells(self, cx0, cx1, cy0, cy1):
+        """
+        Every obstacle that covers any cell in the inclusive range, in the order they were added
+        """
+        found = {}
+        cells = self.cells
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                for obstacle in cells.get((cx, cy), ()):
+                    found[obstacle] = None
+        return list(found)
+
+    def query_rect(self, xmin, xmax, ymin, ymax):
+        """
+        Every obstacle whose bounds overlap the rectangle
+        """
+        result = []
+        for obstacle in self.query_cells(*self.cell_range(xmin, xmax, ymin, ymax)):
+            oxmin, oxmax, oymin, oymax = self.bounds[obstacle]
+            if oxmin <= xmax and oxmax >= xmin and oymin <= ymax and oymax >= ymin:
+                result.append(obstacle)
+        return result
+
+    def query_segment(self, x0, y0, x1, y1):
+        """
+        The obstacles in the cells a segment passes through, found by walking the grid (DDA)
+        These are only candidates, the caller still has to test the segment against their bounds
+        """
+        cells = self.cells
+        size = self.cell_size
+        found = {}
+
+        cx, cy = math.floor(x0 / size), math.floor(y0 / size)
+        end_cx, end_cy = math.floor(x1 / size), math.floor(y1 / size)
+        dx, dy = x1 - x0, y1 - y0
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+
+        # How far along the segment (0 to 1) the next vertical and horizontal cell borders are
+        if dx != 0:
+            t_max_x = ((cx + (step_x > 0)) * size - x0) / dx
+            t_delta_x = size / abs(dx)
+        else:
+            t_max_x = t_delta_x = math.inf
+        if dy != 0:
+            t_max_y = ((cy + (step_y > 0)) * size - y0) / dy
+            t_delta_y = size / abs(dy)
+        else:
+            t_max_y = t_delta_y = math.inf
+
+        for obstacle in cells.get((cx, cy), ()):
+            found[obstacle] = None
+
+        steps_left = abs(end_cx - cx) + abs(end_cy - cy)
+        while steps_left > 0:
+            if t_max_x < t_max_y:
+                cx += step_x
+                t_max_x += t_delta_x
+                steps_left -= 1
+            elif t_max_y < t_max_x:
+                cy += step_y
+                t_max_y += t_delta_y
+                steps_left -= 1
+            else:
+                # Passing exactly through a corner, the two cells beside it are touched too
+                for obstacle in cells.get((cx + step_x, cy), ()):
+                    found[obstacle] = None
+                for obstacle in cells.get((cx, cy + step_y), ()):
+                    found[obstacle] = None
+                cx += step_x
+                cy += step_y
+                t_max_x += t_delta_x
+                t_max_y += t_delta_y
+                steps_left -= 2
+
+            for obstacle in cells.get((cx, cy), ()):
+                found[obstacle] = None
+
+        return list(found)
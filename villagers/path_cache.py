@@ -0,0 +1,48 @@
+"""
+Remembers the graph part of recently found paths so villagers walking the same routes don't redo the A* search
+or the smoothing
+"""
+
+from collections import OrderedDict
+
+# How many routes are kept before the least recently used one is dropped
+PATH_CACHE_SIZE = 1024
+
+
+class PathCache:
+    """
+    Maps (start node id, end node id) to the smoothed node ids of the path between them, or None if there is no path
+    Each entry remembers the navmesh version it was found on, entries from an older version are treated as missing
+    """
+    def __init__(self, max_size=PATH_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # (start, end) -> (version, node ids)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, start, end, version):
+        """
+        Returns (True, node ids) if the route is cached for this version, otherwise (False, None)
+        """
+        entry = self.entries.get((start, end))
+        if entry is None or entry[0] != version:
+            if entry is not None:
+                del self.entries[(start, end)]  # Stale, the navmesh changed since
+            self.misses += 1
+            return False, None
+
+        self.entries.move_to_end((start, end))
+        self.hits += 1
+        return True, entry[1]
+
+    def put(self, start, end, version, path):
+        self.entries[(start, end)] = (version, path)
+        self.entries.move_to_end((start, end))
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
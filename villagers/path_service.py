@@ -0,0 +1,251 @@
+"""
+Finds villager paths in bulk on a pool of worker processes
+Villagers ask for a path and get a future back. The requests made during a frame are sent to the pool together,
+and the workers search a copy of the navmesh's graph in shared memory that is only written once per version.
+Snapping, the path cache, flow fields and the cluster hierarchy are all quick and stay in the game loop,
+only the plain A* searches go to the workers.
+"""
+
+import atexit
+import multiprocessing
+from array import array
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from config import defines
+from villagers import kernels
+from villagers.graph_search import search_graph
+from villagers.navmesh import WALLED_OFF, NO_PATH
+
+# The CSR arrays of a NavGraph in the order they are laid out in shared memory, with their array typecodes
+GRAPH_ARRAYS = (("xs", "d"), ("ys", "d"), ("offsets", "l"), ("targets", "l"), ("costs", "d"))
+
+
+class SharedGraph:
+    """
+    The CSR arrays of a NavGraph read straight out of a shared memory block, enough for search_graph
+    """
+    __slots__ = ("memory", "xs", "ys", "offsets", "targets", "costs")
+
+    def __init__(self, memory, sizes):
+        self.memory = memory
+        offset = 0
+        for (name, typecode), size in zip(GRAPH_ARRAYS, sizes):
+            size *= array(typecode).itemsize
+            setattr(self, name, memory.buf[offset:offset + size].cast(typecode))
+            offset += size
+
+    def close(self):
+        # The views have to go before the block can be closed
+        for name, _ in GRAPH_ARRAYS:
+            getattr(self, name).release()
+        self.memory.close()
+
+
+def publish_graph(graph):
+    """
+    Copies the CSR arrays of a NavGraph into a new shared memory block
+    Returns the block and the length of each array, the workers need both to read it
+    """
+    arrays = [getattr(graph, name) for name, _ in GRAPH_ARRAYS]
+    memory = shared_memory.SharedMemory(create=True, size=max(sum(len(a) * a.itemsize for a in arrays), 1))
+    offset = 0
+    for a in arrays:
+        data = a.tobytes()
+        memory.buf[offset:offset + len(data)] = data
+        offset += len(data)
+    return memory, tuple(len(a) for a in arrays)
+
+
+# Graph the worker process last attached to, batches almost always come in for the same version one after another
+_attached = {}  # Block name -> SharedGraph
+
+
+def find_paths(name, sizes, queries):
+    """
+    Runs in a worker process: search_graph for every (start, end) on the graph in the named block
+    """
+    graph = _attached.get(name)
+    if graph is None:
+        for old_graph in _attached.values():
+            old_graph.close()
+        _attached.clear()
+        graph = _attached[name] = SharedGraph(shared_memory.SharedMemory(name=name), sizes)
+    search = kernels.search_graph if kernels.enabled() else search_graph
+    return [search(graph, *query) for query in queries]
+
+
+class PathService:
+    """
+    Hands out futures for paths, each one ends up holding (deque of Nodes, None) or (None, reason there's no path)
+    With no workers, when the jps backend is picked or while in_process is set, every future is answered straight away
+    by NavMesh.find_path
+    """
+    def __init__(self, navmesh, workers=0):
+        self.navmesh = navmesh
+        # The game's modules set up pygame when they are imported, so the workers are forked rather than spawned
+        if "fork" not in multiprocessing.get_all_start_methods():
+            workers = 0
+        self.workers = workers
+        self.pool = None
+
+        self.pending = []  # (future, start point, end point, start node, end node, version) waiting for update()
+        self.running = []  # (pool future, its requests, version, graph, block name)
+
+        # The graph of the latest version in shared memory, blocks of older versions are freed once no batch reads them
+        self.memory = None
+        self.sizes = None
+        self.memory_version = -1
+        self.retired = []
+
+        # Set while the villagers are moved on several ticks at once, there's no next frame to wait for the workers in
+        self.in_process = False
+
+    def request(self, start_pnt, end_pnt):
+        """
+        Returns a Future for the path from start to end
+        """
+        future = Future()
+        if self.workers and not self.in_process and defines.pathfinding_backend == "navmesh":
+            self.find(future, start_pnt, end_pnt)
+        else:
+            self.answer(future, start_pnt, end_pnt)
+        return future
+
+    def answer(self, future, start_pnt, end_pnt):
+        """
+        Finds the path in the game loop
+        """
+        path = self.navmesh.find_path(start_pnt, end_pnt)
+        future.set_result((path, None if path is not None else self.navmesh.failure_reason))
+
+    def find(self, future, start_pnt, end_pnt):
+        """
+        Answers the request if it doesn't need a search, otherwise queues it for the pool
+        """
+        navmesh = self.navmesh
+        start = navmesh.snap_to_graph(start_pnt)
+        end = navmesh.snap_to_graph(end_pnt)
+
+        if start is None or end is None:
+            future.set_result((None, NO_PATH))
+            return
+        if not navmesh.can_reach(start, end):
+            future.set_result((None, WALLED_OFF))
+            return
+
+        found, node_path = navmesh.find_known_path(start, end)
+        if not found:
+            node_path = navmesh.search_hierarchy(start, end)
+            if node_path is None:
+                self.pending.append((future, start_pnt, end_pnt, start, end, navmesh.version))
+                return
+            node_path = navmesh.remember_path(start, end, node_path)
+        future.set_result(self.finish(node_path, start_pnt, end_pnt, navmesh.graph))
+
+    def finish(self, node_path, start_pnt, end_pnt, graph):
+        """
+        Turns the smoothed node ids of a path on graph into the (path, failure reason) a future holds
+        """
+        path = self.navmesh.to_path(node_path, start_pnt, end_pnt, graph)
+        if path is None:
+            return None, self.navmesh.failure_reason
+        return self.navmesh.smooth_ends(path), None
+
+    def update(self):
+        """
+        Called once a frame: sends the requests made since the last call to the pool and answers the batches that are done
+        """
+        if self.pending:
+            self.submit()
+
+        running = []
+        for batch in self.running:
+            if batch[0].done():
+                self.finish_batch(batch)
+            else:
+                running.append(batch)
+        self.running = running
+
+        in_use = {batch[4] for batch in self.running}
+        for memory in [memory for memory in self.retired if memory.name not in in_use]:
+            memory.close()
+            memory.unlink()
+            self.retired.remove(memory)
+
+    def flush(self):
+        """
+        Answers every request made so far: the ones not sent to the pool yet are found in the game loop,
+        the batches already sent are waited for
+        """
+        requests, self.pending = self.pending, []
+        for future, start_pnt, end_pnt, _, _, _ in requests:
+            self.answer(future, start_pnt, end_pnt)
+        running, self.running = self.running, []
+        for batch in running:
+            self.finish_batch(batch)
+
+    def submit(self):
+        navmesh = self.navmesh
+        requests, self.pending = self.pending, []
+        stale = [request for request in requests if request[5] != navmesh.version]
+        requests = [request for request in requests if request[5] == navmesh.version]
+        # Snapped on a graph that has changed since, snap them again
+        for future, start_pnt, end_pnt, _, _, _ in stale:
+            self.find(future, start_pnt, end_pnt)
+        requests += self.pending
+        self.pending = []
+        if not requests:
+            return
+
+        if self.memory_version != navmesh.version:
+            if self.memory is not None:
+                self.retired.append(self.memory)
+            self.memory, self.sizes = publish_graph(navmesh.graph)
+            self.memory_version = navmesh.version
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("fork"))
+            atexit.register(self.close)
+
+        # One batch per worker, small batches aren't worth splitting
+        batch_size = max(-(-len(requests) // self.workers), 8)
+        for i in range(0, len(requests), batch_size):
+            batch = requests[i:i + batch_size]
+            queries = [(start, end) for _, _, _, start, end, _ in batch]
+            pool_future = self.pool.submit(find_paths, self.memory.name, self.sizes, queries)
+            self.running.append((pool_future, batch, navmesh.version, navmesh.graph, self.memory.name))
+
+    def finish_batch(self, batch):
+        pool_future, requests, version, graph, _ = batch
+        navmesh = self.navmesh
+        try:
+            node_paths = pool_future.result()
+        except Exception:
+            # A worker died, find these paths and any later ones in the game loop instead
+            self.workers = 0
+            for future, start_pnt, end_pnt, _, _, _ in requests:
+                self.answer(future, start_pnt, end_pnt)
+            return
+
+        for (future, start_pnt, end_pnt, start, end, _), node_path in zip(requests, node_paths):
+            if version == navmesh.version:
+                node_path = navmesh.remember_path(start, end, node_path)
+            else:
+                node_path = navmesh.smooth_node_path(node_path, graph)
+            future.set_result(self.finish(node_path, start_pnt, end_pnt, graph))
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory
+        """
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+        self.running = []
+        for memory in self.retired + ([self.memory] if self.memory is not None else []):
+            memory.close()
+            memory.unlink()
+        self.retired = []
+        self.memory = None
+        self.memory_version = -1
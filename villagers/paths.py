@@ -0,0 +1,18 @@
+"""
+The waypoints villager paths are made of, and the reasons a path can't be found
+"""
+
+# Why find_path couldn't find a path, lost villagers show this
+WALLED_OFF = "Walled off"
+NO_PATH = "Can't find a way"
+
+
+class Node:
+    """
+    A point on a path or a fixed spot (like the hole in the wall) that the navmesh should include
+    """
+    __slots__ = ("x", "y")
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
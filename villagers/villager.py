@@ -2,15 +2,22 @@ import pygame
 import random
 from config import defines 
 from .navmesh import Node
+from .villager_system import SystemAttribute
 import json 
-from utils.utils import long_text, longTextnewLines
+from collections import deque
+from utils.utils import longTextnewLines
+from .blurt_cache import BlurtCache
+from . import destinations
 
 ALL_VILLAGERS = ["farmer", "miner", "lumberjack", "blacksmith", "shipwright", "builder", "hersir"]
+# Frames in each action's sprite sheet
+FRAME_COUNTS = {"idle": 4, "walk": 6}
 
 class Villager(pygame.sprite.Sprite):
 
     blurts = json.load(open("villagers/blurts.json", "r"))
     blurt_font = pygame.font.Font(defines.FONT_PATH, 10)
+    blurt_cache = BlurtCache(blurt_font)
 
     idle_ss = {name: pygame.image.load(f"assets/villagers/{name}/idle.png") for name in ALL_VILLAGERS}
     walk_ss = {name: pygame.image.load(f"assets/villagers/{name}/walk.png") for name in ALL_VILLAGERS}
@@ -20,11 +27,27 @@ class Villager(pygame.sprite.Sprite):
 
     # Scale all the images by 2x 
     for name in ALL_VILLAGERS:
-        idle_ss[name] = pygame.transform.scale(idle_ss[name], (frame_width * 4, frame_height))
-        walk_ss[name] = pygame.transform.scale(walk_ss[name], (frame_width * 6, frame_height))
+        idle_ss[name] = pygame.transform.scale(idle_ss[name], (frame_width * FRAME_COUNTS["idle"], frame_height))
+        walk_ss[name] = pygame.transform.scale(walk_ss[name], (frame_width * FRAME_COUNTS["walk"], frame_height))
+
+    # (name, action, facing, frame) -> frame, see load_frames
+    frames = None
+    # Drawn for a villager that hasn't been given a job yet
+    blank_image = pygame.Surface((frame_width, frame_height))
+
+    # Kept in the village's VillagerSystem arrays once the villager is in it
+    x = SystemAttribute()
+    y = SystemAttribute()
+    speed = SystemAttribute()
+    current_time = SystemAttribute(count=-1)  # These count a tick at a time by themselves in there
+    blurt_tick = SystemAttribute(count=-1)
+    frame_tick = SystemAttribute(count=1)
+    facing = SystemAttribute()
 
     def __init__(self, my_building) -> None:
         super().__init__()
+        self.system = None  # The VillagerSystem moving this villager, and its row in there
+        self.index = -1
         self.building = my_building
         self.village = self.building.village
 
@@ -37,95 +60,184 @@ class Villager(pygame.sprite.Sprite):
         self.walk_time = 600  # How long to spend walking (frames)
         self.idle_time = 100
         self.current_time = 0 # Counts down to zero and then switches actions
-        self.frame_tick = 0
+        self.frame_tick = 0  # Ticks the villager has been animated for, the animation moves on a frame every 10
 
         self.blurt_tick = random.randint(500, 2000)
         self.blurt_message = None
+        self.blurt_bubble = None  # Rendered blurt_message and its offset, from blurt_cache
 
         self.destination = None
         self.facing = 0  # 0 = right, 1 = left
 
         self.current_destination_index = 0
-        self.path = [] # Sequence of points to walk to
+        self.path = deque() # Sequence of points to walk to, reached ones are taken off the front
+        self.path_version = 0  # Version of the navmesh the path was found on
+        self.path_request = None  # Future from the village's path service while the path is being found
 
         self.speed = 1
         self.lost = False
+        self.lost_label = None  # Rendered reason the villager couldn't find a path
 
     def handle_blurt(self):
-        self.blurt_tick -= 1
         if self.blurt_tick == 0:
             self.blurt_message = random.choice(Villager.blurts[self.name])
             self.blurt_message = longTextnewLines(self.blurt_message, 20)
+            self.blurt_bubble = None  # Rendered when it is first drawn, villagers off screen never need it
 
             
         if self.blurt_tick < -100:
             self.blurt_tick = random.randint(500, 2000)
 
     def draw_blurt(self, surface):
-        # Add a light gray rectangle behind the text (opacity 128)
+        # The text on a light gray rectangle, rendered once per message
         if self.blurt_message is not None:
-            long_text(surface, (self.x - defines.camera_x, self.y - 20 - defines.camera_y), self.blurt_message, (0, 0, 0), self.blurt_font, 20, align="center",
-                      rect_color=(128, 128, 128, 255),
-                      border_color=(0, 0, 0, 255))
+            if self.blurt_bubble is None:
+                self.blurt_bubble = Villager.blurt_cache.get(self.blurt_message)
+            bubble, (dx, dy) = self.blurt_bubble
+            surface.blit(bubble, (self.x - defines.camera_x + dx, self.y - 20 - defines.camera_y + dy))
 
     def get_image(self):
         if self.name is None:
-            return pygame.Surface((Villager.frame_width, Villager.frame_height))
-        if self.current_action == "idle":
-            base_image = Villager.idle_ss[self.name]
-            x = (int(self.frame_tick) % 4) * Villager.frame_width
-            y = 0
-            width = Villager.frame_width
-            # When facing left, flip the image
-            if self.facing == 1:
-                base_image = pygame.transform.flip(base_image, True, False)
-                x += Villager.frame_width / 2
-                width /= 2
-                
-            return base_image.subsurface((x, y, width, Villager.frame_height))
-
-        elif self.current_action == "walk":
-            # (50x50) with 6 frames
-            base_image = Villager.walk_ss[self.name]
-            x = (int(self.frame_tick) % 6) * Villager.frame_width
-            y = 0
-            width = Villager.frame_width
-            # When facing left, flip the image
-            if self.facing == 1:
-                base_image = pygame.transform.flip(base_image, True, False)
-                x += Villager.frame_width / 2
-                width /= 2
-            return base_image.subsurface((x, y, width, Villager.frame_height))
+            return Villager.blank_image
+        frames = Villager.frames or Villager.load_frames()
+        return frames[self.name, self.current_action, self.facing, self.frame_tick // 10 % FRAME_COUNTS[self.current_action]]
+
+    @classmethod
+    def load_frames(cls):
+        """
+        Cuts every animation frame out of the sprite sheets, the left facing ones out of a flipped sheet
+        Done on the first draw rather than at import, converting to the display's pixel format needs the display
+        """
+        frames = {}
+        for name in ALL_VILLAGERS:
+            for action, sheets in (("idle", cls.idle_ss), ("walk", cls.walk_ss)):
+                sheet = sheets[name]
+                flipped_sheet = pygame.transform.flip(sheet, True, False)
+                for i in range(FRAME_COUNTS[action]):
+                    x = i * cls.frame_width
+                    frames[name, action, 0, i] = sheet.subsurface((x, 0, cls.frame_width, cls.frame_height))
+                    frames[name, action, 1, i] = flipped_sheet.subsurface((x + cls.frame_width / 2, 0, cls.frame_width / 2, cls.frame_height))
+        if pygame.display.get_surface() is not None:
+            frames = {key: frame.convert_alpha() for key, frame in frames.items()}
+        cls.frames = frames
+        return frames
+
+    def find_path(self):
+        """
+        Asks the path service for a path to the destination on the current navmesh
+        Returns False and stops walking if there isn't one, True if there is or it's still being found
+        """
+        navmesh = self.village.navmesh
+        self.path = deque()
+        self.path_request = self.village.path_service.request((self.x, self.y), self.destination)
+        self.path_version = navmesh.version
+        return self.take_path()
+
+    def take_path(self):
+        """
+        Picks up the path once the path service has found it, returns False and stops walking if there isn't one
+        """
+        if not self.path_request.done():
+            return True
+        path, failure_reason = self.path_request.result()
+        self.path_request = None
+        if path is None:
+            self.lost = True
+            self.lost_label = Villager.blurt_font.render(failure_reason, True, (255, 0, 0))
+            self.current_action = "idle"
+            self.current_time = self.idle_time
+            self.destination = None
+            return False
+        path.append(Node(self.destination[0], self.destination[1]))
+        self.path = path
+        return True
 
-        
     def start_walking(self):
         self.current_action = "walk"
         if self.destination is None:
             self.destination = self.choose_destination()
-            self.path = self.village.navmesh.find_path_a_star((self.x, self.y), self.destination)
-            if self.path is None:
-                self.lost = True
-                self.current_action = "idle"
-                self.current_time = self.idle_time
-                self.destination = None
+            if not self.find_path():
                 return
-            self.path.append(Node(self.destination[0], self.destination[1]))
         self.lost = False
-        if self.path is None:
-            self.lost = True
-            self.current_action = "idle"
-            self.current_time = self.idle_time
-            self.destination = None
-        
+
     def update(self):
+        """
+        One frame for a villager on its own, the villagers of a village are all moved together by its VillagerSystem
+        """
+        self.frame_tick += 1
+        self.current_time -= 1
+        self.blurt_tick -= 1
+        self.update_state()
+        if self.current_action == "walk" and self.path:
+            self.walk()
+
+    def advance(self, ticks):
+        """
+        The same as calling update ticks times, except the ticks in between changes of state are skipped over in one go
+        Paths are found straight away like VillagerSystem.advance_rows does
+        """
+        path_service = self.village.path_service
+        if self.path_request is not None:
+            path_service.flush()
+        path_service.in_process = True
+        while ticks > 0:
+            quiet_ticks = min(self.get_quiet_ticks(), ticks)
+            self.skip(quiet_ticks)
+            ticks -= quiet_ticks
+            if ticks > 0:
+                self.update()  # The tick something happens on is run for real
+                ticks -= 1
+        path_service.in_process = False
+
+    def get_quiet_ticks(self):
+        """
+        How many of the coming ticks only count the timers down and walk straight on, without reaching a waypoint
+        """
+        if self.name is None:
+            return 0
+        # The blurt starts when blurt_tick gets to 0 and ends when it drops below -100
+        next_blurt = self.blurt_tick if self.blurt_tick > 0 else self.blurt_tick + 101
+        quiet_ticks = min(next_blurt, self.current_time + 1) - 1
+
+        if self.current_action == "walk":
+            if self.destination is None or self.path_request is not None or not self.path or self.speed > 2 or \
+                    self.path_version < self.village.navmesh.rebuilt_version:
+                return 0
+            waypoint = self.path[0]
+            distance = ((waypoint.x - self.x) ** 2 + (waypoint.y - self.y) ** 2) ** 0.5
+            # The last step or two before the waypoint are left to update so it's reached on the same tick
+            quiet_ticks = min(quiet_ticks, int((distance - 2) / self.speed) - 1)
+        return max(quiet_ticks, 0)
+
+    def skip(self, ticks):
+        """
+        Runs ticks quiet ticks (see get_quiet_ticks) at once
+        """
+        if ticks == 0:
+            return
+        self.current_time -= ticks
+        self.blurt_tick -= ticks
+        self.frame_tick += ticks
+
+        if self.current_action == "walk":
+            # Straight towards the waypoint, the direction doesn't change along the way
+            dx = self.path[0].x - self.x
+            dy = self.path[0].y - self.y
+            self.facing = 1 if dx < 0 else 0
+            step = self.speed * ticks / (dx ** 2 + dy ** 2) ** 0.5
+            self.x += dx * step
+            self.y += dy * step
+
+    def update_state(self):
+        """
+        Everything a frame does besides counting the timers down and walking
+        Only needed when a timer ran out or the villager is walking without a waypoint to walk to
+        """
         if self.name is None:
             self.name = self.building.get_villager_name()
 
         self.handle_blurt()
 
-        self.frame_tick += 0.1
-        self.current_time -= 1
-
         if self.current_time < 0:
             if self.current_action == "idle":
                 self.current_action = "walk"
@@ -138,31 +250,38 @@ class Villager(pygame.sprite.Sprite):
         if self.current_action == "walk":
             if self.destination is None:
                 self.start_walking()
-            # Move towards the next point in the path
-            dx = self.path[0].x - self.x
-            dy = self.path[0].y - self.y
-            if dx < 0:
-                self.facing = 1
-            else:
-                self.facing = 0
-            dist = (dx ** 2 + dy ** 2) ** 0.5
-            if dist < 2:
-                self.path.pop(0)
-                if len(self.path) == 0:
-                    self.current_action = "idle"
-                    self.current_time = self.idle_time
-                    self.destination = None
-            else:
-                dx /= dist
-                dy /= dist
-                self.x += dx * self.speed
-                self.y += dy * self.speed
+            elif self.path_version < self.village.navmesh.rebuilt_version and not self.find_path():
+                return  # The navmesh was rebuilt (e.g. the wall moved) and there's no way there anymore
+            if self.path_request is not None:
+                self.take_path()
+
+    def walk(self):
+        # Move towards the next point in the path
+        dx = self.path[0].x - self.x
+        dy = self.path[0].y - self.y
+        if dx < 0:
+            self.facing = 1
+        else:
+            self.facing = 0
+        dist_sq = dx ** 2 + dy ** 2
+        if dist_sq < 4:
+            self.reach_waypoint()
+        else:
+            dist = dist_sq ** 0.5
+            dx /= dist
+            dy /= dist
+            self.x += dx * self.speed
+            self.y += dy * self.speed
+
+    def reach_waypoint(self):
+        self.path.popleft()
+        if len(self.path) == 0:
+            self.current_action = "idle"
+            self.current_time = self.idle_time
+            self.destination = None
 
     def draw_path(self, surface):
-        if self.path is None:
-            return
-
-        path = [Node(self.x, self.y)] + self.path
+        path = [Node(self.x, self.y)] + list(self.path)
         for i in range(len(path) - 1):
             pygame.draw.line(surface, (255, 0, 0), (path[i].x - defines.camera_x, path[i].y - defines.camera_y), (path[i + 1].x - defines.camera_x, path[i + 1].y - defines.camera_y), 8)
 
@@ -174,23 +293,26 @@ class Villager(pygame.sprite.Sprite):
     def draw(self, surface):
         surface.blit(self.get_image(), (self.x - defines.camera_x, self.y - defines.camera_y))
         # self.draw_path(surface)
+        self.draw_overlays(surface)
 
+    def draw_overlays(self, surface):
+        """
+        What goes on top of the villager: the lost marker and the blurt
+        """
         if self.lost:
-            # Draw a red X over the villager
+            # Draw a red X over the villager, and why it is lost underneath
             pygame.draw.line(surface, (255, 0, 0), (self.x - 10 - defines.camera_x, self.y - 10 - defines.camera_y), (self.x + 10 - defines.camera_x, self.y + 10 - defines.camera_y), 3)
+            if self.lost_label is not None:
+                surface.blit(self.lost_label, (self.x - self.lost_label.get_width() / 2 - defines.camera_x, self.y + 12 - defines.camera_y))
 
         if self.blurt_tick < 0:
             self.draw_blurt(surface)
 
     def get_random_building_edge(self, building):
         """
-        If a building is 3x3 from (0, 0) to (2, 2) this function could return (0, 1) or (2, 0) etc. (but multiplied by GRID_SIZE)
+        One of the 4 spots from destinations.get_building_edges
         """
-        x = random.choice([-1, building.get_cell_width()]) * defines.GRID_SIZE
-        y = random.choice([-1, building.get_cell_height() - 1]) * defines.GRID_SIZE
-        x += building.x
-        y += building.y
-        return x, y
+        return random.choice(destinations.get_building_edges(building))
     
     def get_random_building_by_type(self, building_type):
         """
@@ -215,7 +337,7 @@ class Villager(pygame.sprite.Sprite):
             if self.current_destination_index == 0:
                 return self.get_random_building_edge(self.building)
             elif self.current_destination_index == 1:
-                return 0, defines.WORLD_HEIGHT * defines.GRID_SIZE
+                return destinations.get_ore_exit()
             
         elif self.name == "lumberjack":
             self.current_destination_index %= 2
@@ -256,7 +378,7 @@ class Villager(pygame.sprite.Sprite):
                     return self.get_random_building_edge(self.building)
                 return self.get_random_building_edge(lumbermill)
             elif self.current_destination_index == 2:
-                return defines.WORLD_WIDTH / 2 * defines.GRID_SIZE, defines.GRID_SIZE * 4
+                return destinations.get_river()
             
         else:
             self.current_destination_index %= 1
@@ -0,0 +1,375 @@
+"""
+Moves all of a village's villagers at once
+The per frame state of every villager (position, velocity, timers, animation tick and the waypoint it is walking to)
+lives in numpy arrays, one row per villager, and the walking villagers all take their step in one go.
+The timers aren't counted down every frame, they are kept as the tick of the villager's clock they run out on and
+the villager is put in a timer wheel for the frame something happens to it. It only goes back to Python
+(Villager.update_state) on that frame, when it reaches a waypoint or while it is waiting on a path.
+Villagers far from the camera aren't updated every frame, they build up ticks that advance runs all at once
+"""
+
+import numpy as np
+
+from config import defines
+
+# Rows the arrays start with, they double when they fill up
+INITIAL_CAPACITY = 64
+
+# How far off the screen (px) a villager's position can be and still have something to draw: its sprite, blurt or lost label
+DRAW_MARGIN = 150
+# Villagers further off the screen than this are only caught up every OFF_SCREEN_TICKS frames. It is kept well
+# past DRAW_MARGIN so a villager is caught up before any of it can be seen
+SIMULATION_MARGIN = 300
+OFF_SCREEN_TICKS = 10
+
+# Slots in the timer wheel, one per frame. Villagers due further ahead than that stay in their slot for another round
+WHEEL_SIZE = 256
+
+
+class SystemAttribute:
+    """
+    A villager attribute that is kept in the VillagerSystem array of the same name while the villager is in one
+    A counter that goes up or down by one every tick (count 1 or -1) is kept as its value at tick 0 of the villager's
+    clock, so it moves on by itself without the system touching it
+    """
+    def __init__(self, count=0):
+        self.count = count
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, villager, owner=None):
+        if villager is None:
+            return self
+        system = villager.system
+        if system is None:
+            return villager.__dict__[self.name]
+        value = getattr(system, self.name)[villager.index].item()
+        if self.count:
+            value += self.count * system.get_clock(villager.index).item()
+        return value
+
+    def __set__(self, villager, value):
+        system = villager.system
+        if system is None:
+            villager.__dict__[self.name] = value
+            return
+        if self.count:
+            value -= self.count * system.get_clock(villager.index).item()
+        getattr(system, self.name)[villager.index] = value
+
+
+class VillagerSystem:
+    """
+    Villager i of villagers has row i of every array, removing a villager moves the last one into its row
+    A villager's clock is frame + clock_offset - behind: it stands still while the villager is behind and
+    jumps on when advance runs ticks the frames didn't count
+    """
+    # Array name -> dtype, the ones that are also Villager attributes are SystemAttributes there
+    ARRAYS = {"x": np.float64, "y": np.float64, "vx": np.float64, "vy": np.float64, "speed": np.float64,
+              "current_time": np.int64, "blurt_tick": np.int64, "frame_tick": np.int64,  # At tick 0 of the clock
+              "facing": np.int8, "target_x": np.float64, "target_y": np.float64,
+              "walking": np.bool_,  # current_action is "walk"
+              "moving": np.bool_,  # Walking with a waypoint to walk to (target_x, target_y)
+              "dirty": np.bool_,  # Has to go through update_state next frame whatever its timers say
+              "behind": np.int64,  # Ticks the villager has to be run for to catch up, frames left off screen
+              "clock_offset": np.int64,
+              "wake": np.int64}  # Frame it is due in the timer wheel, older entries for it there are stale
+    VILLAGER_ATTRIBUTES = ("x", "y", "speed", "current_time", "blurt_tick", "frame_tick", "facing")
+
+    def __init__(self, village):
+        self.village = village
+        self.villagers = []
+        for name, dtype in self.ARRAYS.items():
+            setattr(self, name, np.zeros(INITIAL_CAPACITY, dtype=dtype))
+        # Villagers with a path from before this navmesh rebuild have to find a new one
+        self.rebuilt_version = 0
+
+        self.frame = 0
+        self.wheel = [[] for _ in range(WHEEL_SIZE)]  # frame % WHEEL_SIZE -> villagers due on it
+
+    def __len__(self):
+        return len(self.villagers)
+
+    def get_clock(self, indices):
+        return self.frame + self.clock_offset[indices] - self.behind[indices]
+
+    def get_timers(self, indices):
+        """
+        current_time and blurt_tick of the villagers at indices
+        """
+        clock = self.get_clock(indices)
+        return self.current_time[indices] - clock, self.blurt_tick[indices] - clock
+
+    def add(self, villager):
+        if villager.system is not None:
+            return
+        index = len(self.villagers)
+        if index == len(self.x):
+            for name in self.ARRAYS:
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate((array, np.zeros_like(array))))
+
+        values = {name: getattr(villager, name) for name in self.VILLAGER_ATTRIBUTES}
+        self.villagers.append(villager)
+        villager.system, villager.index = self, index
+        self.clock_offset[index] = self.behind[index] = 0
+        for name, value in values.items():
+            setattr(villager, name, value)
+        self.vx[index] = self.vy[index] = 0
+        self.dirty[index] = True
+        self.wake[index] = -1
+        self.sync(index)
+        self.schedule(np.array([index]))
+
+    def remove(self, villager):
+        if villager.system is not self:
+            return
+        index, last = villager.index, len(self.villagers) - 1
+        self.catch_up(np.array([index]))
+        values = {name: getattr(villager, name) for name in self.VILLAGER_ATTRIBUTES}
+        villager.system, villager.index = None, -1
+        for name, value in values.items():
+            setattr(villager, name, value)
+
+        # Move the last villager into the empty row
+        moved = self.villagers.pop()
+        if index != last:
+            self.villagers[index] = moved
+            moved.index = index
+            for name in self.ARRAYS:
+                array = getattr(self, name)
+                array[index] = array[last]
+
+    def sync(self, index):
+        """
+        Picks up the action and next waypoint of a villager after its Python side changed them
+        """
+        villager = self.villagers[index]
+        self.walking[index] = villager.current_action == "walk"
+        self.moving[index] = self.walking[index] and bool(villager.path)
+        if self.moving[index]:
+            self.target_x[index] = villager.path[0].x
+            self.target_y[index] = villager.path[0].y
+
+    def update(self):
+        """
+        One frame for every villager, the same as calling Villager.update on each of them
+        With villager_lod on, the ones off screen are only counted as behind and caught up later
+        """
+        count = len(self.villagers)
+        if count == 0:
+            return
+        self.check_rebuilt(count)
+        self.frame += 1
+
+        if defines.villager_lod:
+            near = self.get_on_screen(count, SIMULATION_MARGIN)
+        else:
+            near = np.ones(count, dtype=np.bool_)
+        behind = self.behind[:count]
+        stepping = near
+        if behind.any() or not near.all():
+            behind[~near] += 1
+            # Coming back into view, or left long enough. This frame is run along with the ones they are behind by
+            catching_up = np.where(near, behind > 0, behind >= OFF_SCREEN_TICKS)
+            behind[near & catching_up] += 1
+            self.catch_up(np.flatnonzero(catching_up))
+            stepping = near & ~catching_up
+
+        due = self.pop_due()
+        due = due[stepping[due]]
+        self.update_states(due)
+        self.schedule(due)
+        self.walk(np.flatnonzero(stepping))
+
+    def pop_due(self):
+        """
+        Takes the villagers due this frame out of the timer wheel, returns their indices
+        """
+        slot = self.wheel[self.frame % WHEEL_SIZE]
+        if not slot:
+            return np.zeros(0, dtype=np.int64)
+        due = []
+        later = []
+        for villager in slot:
+            if villager.system is not self:
+                continue
+            wake = self.wake[villager.index]
+            if wake == self.frame:
+                due.append(villager.index)
+            elif wake > self.frame and wake % WHEEL_SIZE == self.frame % WHEEL_SIZE:
+                later.append(villager)  # Due on a later round of the wheel
+        self.wheel[self.frame % WHEEL_SIZE] = later
+        return np.unique(np.array(due, dtype=np.int64))
+
+    def schedule(self, indices):
+        """
+        Puts the villagers at indices in the timer wheel for the next frame one of their timers runs out on,
+        or the next frame if they are dirty or waiting on a path. Villagers that are behind are done once caught up
+        """
+        indices = indices[self.behind[indices] == 0]
+        if len(indices) == 0:
+            return
+        busy = self.dirty[indices] | self.walking[indices] & ~self.moving[indices]
+        wake = self.frame + 1 + np.where(busy, 0, self.get_timer_ticks(indices))
+        changed = wake != self.wake[indices]
+        for index, frame in zip(indices[changed].tolist(), wake[changed].tolist()):
+            self.wheel[frame % WHEEL_SIZE].append(self.villagers[index])
+        self.wake[indices] = wake
+
+    def catch_up(self, indices):
+        """
+        Runs the ticks the villagers at indices are behind by
+        """
+        if len(indices):
+            self.advance_rows(indices)
+
+    def advance(self, ticks):
+        """
+        The same as calling update ticks times, like Villager.advance but for everyone at once
+        Villagers that are behind are caught up as well
+        """
+        count = len(self.villagers)
+        if count == 0:
+            return
+        self.check_rebuilt(count)
+        self.clock_offset[:count] += ticks
+        self.behind[:count] += ticks
+        self.advance_rows(np.arange(count))
+
+    def advance_rows(self, indices):
+        """
+        Runs the ticks each villager at indices is behind by
+        Each round every villager skips the quiet ticks up to its next change of state, then that tick is run for real
+        The paths asked for on the way are found straight away, no frame goes by for the path service's workers
+        """
+        active = indices[self.behind[indices] > 0]
+        path_service = self.village.path_service
+        if np.any(self.walking[active] & ~self.moving[active]):
+            path_service.flush()  # Waiting on paths asked for before
+        path_service.in_process = True
+        while len(active):
+            self.skip(active, np.minimum(self.get_quiet_ticks(active), self.behind[active]))
+
+            # The villagers that have a tick left run it like update does
+            active = active[self.behind[active] > 0]
+            self.behind[active] -= 1
+            self.update_states(active)
+            self.walk(active)
+            active = active[self.behind[active] > 0]
+        path_service.in_process = False
+        self.schedule(indices)
+
+    def get_timer_ticks(self, indices):
+        """
+        How many of the coming ticks the timers of the villagers at indices only count down on
+        """
+        current_time, blurt_tick = self.get_timers(indices)
+        # The blurt starts when blurt_tick gets to 0 and ends when it drops below -100
+        next_blurt = np.where(blurt_tick > 0, blurt_tick, blurt_tick + 101)
+        return np.maximum(np.minimum(next_blurt, current_time + 1) - 1, 0)
+
+    def get_quiet_ticks(self, indices):
+        """
+        Villager.get_quiet_ticks for the villagers at indices
+        """
+        quiet_ticks = self.get_timer_ticks(indices)
+
+        moving = self.moving[indices]
+        speed = self.speed[indices]
+        distance = np.hypot(self.target_x[indices] - self.x[indices], self.target_y[indices] - self.y[indices])
+        walk_ticks = np.where(moving & (speed <= 2), np.floor((distance - 2) / speed) - 1, 0).astype(np.int64)
+        quiet_ticks = np.where(self.walking[indices], np.minimum(quiet_ticks, walk_ticks), quiet_ticks)
+        quiet_ticks[self.dirty[indices]] = 0
+        return np.maximum(quiet_ticks, 0)
+
+    def skip(self, indices, ticks):
+        """
+        Villager.skip for the villagers at indices, each by its own number of ticks
+        """
+        self.behind[indices] -= ticks
+
+        walking = (ticks > 0) & self.moving[indices]
+        indices, ticks = indices[walking], ticks[walking]
+        dx = self.target_x[indices] - self.x[indices]
+        dy = self.target_y[indices] - self.y[indices]
+        self.facing[indices] = dx < 0
+        step = self.speed[indices] * ticks / np.sqrt(dx ** 2 + dy ** 2)
+        self.x[indices] += dx * step
+        self.y[indices] += dy * step
+
+    def update_states(self, indices):
+        """
+        Runs Villager.update_state for the villagers at indices whose timers ran out, that are waiting on a path or are dirty
+        """
+        if len(indices) == 0:
+            return
+        current_time, blurt_tick = self.get_timers(indices)
+        needs_state = (self.dirty[indices] | (current_time < 0) | (blurt_tick == 0) | (blurt_tick < -100) |
+                       self.walking[indices] & ~self.moving[indices])
+        for index in indices[needs_state].tolist():
+            self.villagers[index].update_state()
+            self.dirty[index] = False
+            self.sync(index)
+
+    def check_rebuilt(self, count):
+        rebuilt_version = self.village.navmesh.rebuilt_version
+        if rebuilt_version != self.rebuilt_version:
+            # Walking villagers check whether their path is from before the rebuild
+            self.dirty[:count] |= self.walking[:count]
+            self.rebuilt_version = rebuilt_version
+            self.schedule(np.flatnonzero(self.walking[:count]))
+
+    def get_on_screen(self, count, margin):
+        """
+        Which of the villagers are within margin of the screen
+        """
+        x = self.x[:count] - defines.camera_x
+        y = self.y[:count] - defines.camera_y
+        return (x > -margin) & (x < defines.DISPLAY_WIDTH + margin) & (y > -margin) & (y < defines.DISPLAY_HEIGHT + margin)
+
+    def draw(self, surface, batch):
+        """
+        Draws the villagers that can be seen, all their sprites in one batch and then the lost markers and blurts on top
+        """
+        indices = np.flatnonzero(self.get_on_screen(len(self.villagers), DRAW_MARGIN))
+        villagers = [self.villagers[index] for index in indices.tolist()]
+        xs = (self.x[indices] - defines.camera_x).tolist()
+        ys = (self.y[indices] - defines.camera_y).tolist()
+        for villager, x, y in zip(villagers, xs, ys):
+            batch.add(villager.get_image(), (x, y))
+        batch.flush(surface)
+
+        for villager in villagers:
+            if villager.lost or villager.blurt_tick < 0:
+                villager.draw_overlays(surface)
+
+    def walk(self, indices):
+        """
+        Steps the moving villagers at indices toward their waypoints, the ones that reach it pick the next one in Python
+        """
+        moving = indices[self.moving[indices]]
+        if len(moving) == 0:
+            return
+        dx = self.target_x[moving] - self.x[moving]
+        dy = self.target_y[moving] - self.y[moving]
+        self.facing[moving] = dx < 0
+        dist_sq = dx ** 2 + dy ** 2
+
+        arrived = dist_sq < 4
+        stepping = ~arrived
+        walkers = moving[stepping]
+        dist = np.sqrt(dist_sq[stepping])
+        self.vx[walkers] = dx[stepping] / dist * self.speed[walkers]
+        self.vy[walkers] = dy[stepping] / dist * self.speed[walkers]
+        self.x[walkers] += self.vx[walkers]
+        self.y[walkers] += self.vy[walkers]
+
+        if arrived.any():
+            arrived = moving[arrived]
+            for index in arrived.tolist():
+                self.vx[index] = self.vy[index] = 0
+                self.villagers[index].reach_waypoint()
+                self.sync(index)
+            self.schedule(arrived)
@@ -0,0 +1,140 @@
+"""
+Batched geometry used to build the navmesh's visibility graph
+Every function works on whole arrays of points, segments and rectangles instead of one at a time
+
+Rectangles are stored as (xmin, xmax, ymin, ymax) to match NavMesh.liang_barsky
+"""
+
+import numpy as np
+
+from villagers import kernels
+
+# How many rows are processed at once, keeps the (rows x columns) temporaries small
+CHUNK_SIZE = 1024
+
+
+def batch_liang_barsky(segments, rects, mask=None):
+    """
+    Liang-Barsky for every segment against its own row of rectangles
+
+    :param segments: (n, 4) array of x0, y0, x1, y1
+    :param rects: (n, k, 4) array of the rectangles to test each segment against, or (k, 4) to test every segment against the same ones
+    :param mask: optional (n, k) bool array, False marks padding in rects
+    :return: (n,) bool array, True where the segment intersects at least one of its rectangles
+    """
+    segments = np.asarray(segments, dtype=np.float64)
+    rects = np.asarray(rects, dtype=np.float64)
+    if rects.ndim == 2:
+        rects = rects[np.newaxis, :, :]
+
+    x0 = segments[:, 0, np.newaxis]
+    y0 = segments[:, 1, np.newaxis]
+    dx = segments[:, 2, np.newaxis] - x0
+    dy = segments[:, 3, np.newaxis] - y0
+
+    xmin, xmax, ymin, ymax = rects[..., 0], rects[..., 1], rects[..., 2], rects[..., 3]
+
+    # p and q for the 4 edges (left, right, top, bottom), each (n, k)
+    p = np.broadcast_arrays(-dx, dx, -dy, dy, xmin)[:4]
+    q = (x0 - xmin, xmax - x0, y0 - ymin, ymax - y0)
+
+    shape = np.broadcast_shapes(x0.shape, xmin.shape)
+    u1 = np.zeros(shape)
+    u2 = np.ones(shape)
+    outside = np.zeros(shape, dtype=bool)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for pi, qi in zip(p, q):
+            parallel = pi == 0
+            outside |= parallel & (qi < 0)  # Line is parallel and outside the rectangle
+            u = qi / pi
+            entering = pi < 0
+            leaving = pi > 0
+            u1 = np.where(entering, np.maximum(u1, u), u1)
+            u2 = np.where(leaving, np.minimum(u2, u), u2)
+
+    hits = ~outside & (u1 <= u2)
+    if mask is not None:
+        hits &= mask
+    return hits.any(axis=1)
+
+
+def pad_candidates(segments, rects):
+    """
+    For each segment, gathers the rectangles that overlap its bounding box, padded to the longest row
+
+    :param segments: (n, 4) array of x0, y0, x1, y1
+    :param rects: (m, 4) array of xmin, xmax, ymin, ymax
+    :return: ((n, k, 4) padded rectangles, (n, k) mask that is False for padding)
+    """
+    seg_xmin = np.minimum(segments[:, 0], segments[:, 2])[:, np.newaxis]
+    seg_xmax = np.maximum(segments[:, 0], segments[:, 2])[:, np.newaxis]
+    seg_ymin = np.minimum(segments[:, 1], segments[:, 3])[:, np.newaxis]
+    seg_ymax = np.maximum(segments[:, 1], segments[:, 3])[:, np.newaxis]
+
+    overlap = ((seg_xmin <= rects[:, 1]) & (seg_xmax >= rects[:, 0]) &
+               (seg_ymin <= rects[:, 3]) & (seg_ymax >= rects[:, 2]))
+
+    width = max(int(overlap.sum(axis=1).max(initial=0)), 1)
+    # Stable sort puts the overlapping rectangles first in every row
+    order = np.argsort(~overlap, axis=1, kind="stable")[:, :width]
+    return rects[order], np.take_along_axis(overlap, order, axis=1)
+
+
+def segments_blocked(segments, rects):
+    """
+    True for every segment that passes through any of the rectangles
+
+    :param segments: (n, 4) array of x0, y0, x1, y1
+    :param rects: (m, 4) array of xmin, xmax, ymin, ymax
+    """
+    if kernels.enabled():
+        return kernels.segments_blocked(segments, rects)
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+    blocked = np.zeros(len(segments), dtype=bool)
+    if len(rects) == 0:
+        return blocked
+
+    for start in range(0, len(segments), CHUNK_SIZE):
+        chunk = segments[start:start + CHUNK_SIZE]
+        padded, mask = pad_candidates(chunk, rects)
+        blocked[start:start + CHUNK_SIZE] = batch_liang_barsky(chunk, padded, mask)
+    return blocked
+
+
+def nearest_neighbors(points, queries, k):
+    """
+    Brute force k nearest neighbors, the query point itself counts as one of them if it is in points
+
+    :param points: (n, 2) array of candidate points
+    :param queries: (m, 2) array of points to find neighbors for
+    :return: ((m, k) indices into points sorted nearest first, ties by index, (m, k) distances)
+    """
+    if kernels.enabled():
+        return kernels.nearest_neighbors(points, queries, k)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    queries = np.asarray(queries, dtype=np.float64).reshape(-1, 2)
+    k = min(k, len(points))
+    indices = np.empty((len(queries), k), dtype=np.int64)
+    distances = np.empty((len(queries), k))
+    if k == 0:
+        return indices, distances
+
+    for start in range(0, len(queries), CHUNK_SIZE):
+        chunk = queries[start:start + CHUNK_SIZE]
+        dx = chunk[:, 0, np.newaxis] - points[:, 0]
+        dy = chunk[:, 1, np.newaxis] - points[:, 1]
+        distance_sq = dx * dx + dy * dy
+        # Everything as close as the k-th nearest is a candidate, so points tied with it are picked by index
+        # rather than by however the partition happened to go
+        kth_sq = np.partition(distance_sq, k - 1, axis=1)[:, k - 1, np.newaxis]
+        rows, columns = np.nonzero(distance_sq <= kth_sq)
+        candidate_sq = distance_sq[rows, columns]
+        order = np.lexsort((columns, candidate_sq, rows))
+        # Every row has at least k candidates, keep the first k of each
+        row_starts = np.searchsorted(rows[order], np.arange(len(chunk)))
+        keep = order[(row_starts[:, np.newaxis] + np.arange(k)).ravel()]
+        indices[start:start + CHUNK_SIZE] = columns[keep].reshape(-1, k)
+        distances[start:start + CHUNK_SIZE] = np.sqrt(candidate_sq[keep]).reshape(-1, k)
+    return indices, distances
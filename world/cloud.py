@@ -47,8 +47,8 @@ class Cloud(pygame.sprite.Sprite):
             self.alpha = min(255, self.alpha + random.randint(0, 2))
             self.image.set_alpha(self.alpha)
 
-        def draw(self, surface):
-            surface.blit(self.image, (self.rect.x - defines.camera_x, self.rect.y - defines.camera_y))
+        def draw(self, batch):
+            batch.add(self.image, (self.rect.x - defines.camera_x, self.rect.y - defines.camera_y))
 
 class CloudHandler:
 
@@ -67,7 +67,8 @@ class CloudHandler:
         for cloud in self.clouds:
             cloud.update()
 
-    def draw(self, surface):
+    def draw(self, surface, batch):
         for cloud in self.clouds:
-            cloud.draw(surface)
+            cloud.draw(batch)
+        batch.flush(surface)
 
@@ -103,7 +103,7 @@ class Tree(pygame.sprite.Sprite):
     def update(self):
         pass
 
-    def draw(self, screen):
-        screen.blit(self.image, (self.x - defines.camera_x, self.y - defines.camera_y))
+    def draw(self, batch):
+        batch.add(self.image, (self.x - defines.camera_x, self.y - defines.camera_y))
 
     
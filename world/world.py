@@ -192,11 +192,12 @@ class World:
         for y in range(min_y, max_y + defines.GRID_SIZE, defines.GRID_SIZE):
             pygame.draw.line(surface, (100, 100, 100), (min_x - defines.camera_x, y - defines.camera_y), (max_x - defines.camera_x, y - defines.camera_y))
 
-    def draw(self, surface: pygame.Surface, turn):
+    def draw(self, surface: pygame.Surface, turn, batch):
         self.draw_background(surface, turn)
 
         self.update_floating_objects()
         self.update_ripples()
         self.draw_river(surface)
         for tree in self.trees:
-            tree.draw(surface)
\ No newline at end of file
+            tree.draw(batch)
+        batch.flush(surface)
\ No newline at end of file